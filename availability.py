@@ -0,0 +1,229 @@
+import bisect
+from typing import Dict, List, Any, Optional, Tuple
+
+from main import parse_time, MINUTES_PER_DAY
+from instrument import PROFILER
+
+
+def opening_intervals(venue: Dict[str, Any]) -> Optional[List[Tuple[int, int]]]:
+    """Reads the optional opening hours of a venue, as checked by check_availability, as
+    intervals of minutes after midnight, splitting any running past midnight in two.
+
+    Args:
+        venue (Dict[str, Any]): Cleaned venue dictionary.
+
+    Returns:
+        Optional[List[Tuple[int, int]]]: Opening and closing minutes, closing excluded, or
+        None if the venue has no opening hours.
+    """
+    if "opening_hours" not in venue:
+        return None
+    intervals = []
+    for opening, closing in venue["opening_hours"]:
+        opening_minutes, closing_minutes = parse_time(opening), parse_time(closing)
+        if closing_minutes > opening_minutes:
+            intervals.append((opening_minutes, closing_minutes))
+        else:
+            intervals.append((opening_minutes, MINUTES_PER_DAY))
+            intervals.append((0, closing_minutes))
+    return intervals
+
+
+def mask_from_flags(flags: bytearray) -> int:
+    """Converts a bytearray of b'0' and b'1' flags, one per venue, to an integer bitset in one
+    step, by reading the flags as binary digits.
+
+    Args:
+        flags (bytearray): Flags, with the venue at position p at index len(flags) - 1 - p.
+
+    Returns:
+        int: Bitset with bit p set for each flagged venue.
+    """
+    return int(flags, 2) if flags else 0
+
+
+def mask_positions(mask: int) -> List[int]:
+    """Lists the positions of the set bits of an integer bitset, scanning its binary digits
+    rather than clearing one bit at a time, which is slow for wide bitsets.
+
+    Args:
+        mask (int): Bitset to decode.
+
+    Returns:
+        List[int]: Positions of the set bits, lowest first.
+    """
+    digits = bin(mask)[:1:-1]
+    positions = []
+    position = digits.find("1")
+    while position != -1:
+        positions.append(position)
+        position = digits.find("1", position + 1)
+    return positions
+
+
+class AvailabilityIndex:
+    """Index over venues' opening hours and seating capacities, to rule venues out of a pick
+    for a time of day and party size before any food or drink evaluation.
+
+    Opening hours are indexed as an interval index: every opening and closing time splits the
+    day into segments, during each of which the same venues are open, and each segment keeps
+    a bitset of those venues. Capacities are indexed as a bitset, per distinct capacity, of
+    the venues seating at least that many. Venues without opening hours or a capacity can't be
+    ruled out by them, so are in every bitset.
+    """
+
+    def __init__(self, all_venues: List[Dict[str, Any]]):
+        self.venue_count = len(all_venues)
+        # Flags are indexed from the end, so the first venue becomes the lowest bit
+        flags = bytearray(b"0" * self.venue_count)
+        unlimited = bytearray(b"0" * self.venue_count)
+        # Number of each venue's opening intervals covering the current time, where venues
+        # without opening hours have one covering the whole day
+        open_counts = [0] * self.venue_count
+        events = {}
+        capacities = []
+        for position, venue in enumerate(all_venues):
+            flag = self.venue_count - 1 - position
+            intervals = opening_intervals(venue)
+            if intervals is None:
+                flags[flag] = ord("1")
+                open_counts[flag] = 1
+            for opening, closing in intervals or []:
+                events.setdefault(opening, []).append((flag, 1))
+                events.setdefault(closing, []).append((flag, -1))
+            if "capacity" in venue:
+                capacities.append((venue["capacity"], flag))
+            else:
+                unlimited[flag] = ord("1")
+
+        # Sweep through the day, recording which venues are open from each time until the next
+        self.segment_starts = sorted({0, *events} - {MINUTES_PER_DAY})
+        self.segment_masks = []
+        for start in self.segment_starts:
+            for flag, change in events.get(start, []):
+                open_counts[flag] += change
+                flags[flag] = ord("1") if open_counts[flag] else ord("0")
+            self.segment_masks.append(mask_from_flags(flags))
+
+        # From the largest capacity down, recording which venues seat at least each capacity
+        capacities.sort(reverse=True)
+        self.capacities = []
+        self.capacity_masks = []
+        self.unlimited_mask = mask_from_flags(unlimited)
+        flags = bytearray(unlimited)
+        for number, (capacity, flag) in enumerate(capacities):
+            flags[flag] = ord("1")
+            if number + 1 == len(capacities) or capacities[number + 1][0] != capacity:
+                self.capacities.append(capacity)
+                self.capacity_masks.append(mask_from_flags(flags))
+        self.capacities.reverse()
+        self.capacity_masks.reverse()
+
+    @classmethod
+    def from_masks(
+        cls,
+        venue_count: int,
+        segment_starts: List[int],
+        segment_masks: List[int],
+        capacities: List[int],
+        capacity_masks: List[int],
+        unlimited_mask: int,
+    ) -> "AvailabilityIndex":
+        """Re-creates an index from its bitsets, e.g. as stored in a snapshot, without sweeping
+        through the venues' opening hours again.
+
+        Args:
+            venue_count (int): Number of venues.
+            segment_starts (List[int]): Minute each segment of the day starts, ascending.
+            segment_masks (List[int]): Bitset of the venues open during each segment.
+            capacities (List[int]): Distinct capacities, ascending.
+            capacity_masks (List[int]): Bitset of the venues seating at least each capacity.
+            unlimited_mask (int): Bitset of the venues without a capacity.
+
+        Returns:
+            AvailabilityIndex: Index over the venues.
+        """
+        availability_index = cls([])
+        availability_index.venue_count = venue_count
+        availability_index.segment_starts = segment_starts
+        availability_index.segment_masks = segment_masks
+        availability_index.capacities = capacities
+        availability_index.capacity_masks = capacity_masks
+        availability_index.unlimited_mask = unlimited_mask
+        return availability_index
+
+    def open_at(self, minutes: int) -> int:
+        """Finds the venues open at a time of day.
+
+        Args:
+            minutes (int): Minutes after midnight.
+
+        Returns:
+            int: Bitset of venue positions.
+        """
+        segment = bisect.bisect_right(self.segment_starts, minutes % MINUTES_PER_DAY) - 1
+        return self.segment_masks[segment]
+
+    def seating(self, party_size: int) -> int:
+        """Finds the venues with room for a party.
+
+        Args:
+            party_size (int): Number of people.
+
+        Returns:
+            int: Bitset of venue positions.
+        """
+        number = bisect.bisect_left(self.capacities, party_size)
+        if number == len(self.capacities):
+            return self.unlimited_mask
+        return self.capacity_masks[number]
+
+    def available(
+        self, minutes: Optional[int] = None, party_size: Optional[int] = None
+    ) -> List[int]:
+        """Finds the venues open at a time of day, with room for a party.
+
+        Args:
+            minutes (Optional[int]): Minutes after midnight, or None for any time.
+            party_size (Optional[int]): Number of people, or None for any number.
+
+        Returns:
+            List[int]: Positions of the venues, in catalog order.
+        """
+        mask = (1 << self.venue_count) - 1
+        if minutes is not None:
+            mask &= self.open_at(minutes)
+        if party_size is not None:
+            mask &= self.seating(party_size)
+        return mask_positions(mask)
+
+
+@PROFILER.timed()
+def filter_venues_by_availability(
+    all_venues: List[Dict[str, Any]],
+    minutes: Optional[int] = None,
+    party_size: Optional[int] = None,
+    availability_index: Optional[AvailabilityIndex] = None,
+) -> List[Dict[str, Any]]:
+    """Restricts venues to those open at a time of day with room for a party, before any food
+    or drink evaluation, keeping venues without opening hours or a capacity.
+
+    Args:
+        all_venues (List[Dict[str, Any]]): List of dictionaries for all venues.
+        minutes (Optional[int]): Minutes after midnight, or None for any time.
+        party_size (Optional[int]): Number of people, or None for any number.
+        availability_index (Optional[AvailabilityIndex]): Index built over all_venues, to
+        reuse across picks.
+
+    Returns:
+        List[Dict[str, Any]]: Candidate venues, in catalog order.
+    """
+    if minutes is None and party_size is None:
+        return all_venues
+    availability_index = availability_index or AvailabilityIndex(all_venues)
+    candidates = [
+        all_venues[position]
+        for position in availability_index.available(minutes, party_size)
+    ]
+    PROFILER.count("venues_ruled_out_by_availability", len(all_venues) - len(candidates))
+    return candidates
@@ -0,0 +1,100 @@
+import contextlib
+import getopt
+import json
+import sys
+from typing import Dict, List, Any, Iterable, Iterator, Optional
+
+from main import stream_json_from_file
+from engine import BitmaskEngine
+from cache import PickCache
+from instrument import PROFILER
+from output import encode
+
+
+def read_groups(lines: Iterable[str]) -> Iterator[List[str]]:
+    """Parses groups of user names, one group per line. Each line should be a JSON list of
+    names, e.g. ["Tom Mullen", "Rosie Curran"], or ["everyone"]. Blank lines are skipped.
+
+    Args:
+        lines (Iterable[str]): Lines of input, e.g. an open file or sys.stdin.
+
+    Returns:
+        Iterator[List[str]]: Lists of names, one per group.
+    """
+    for line in lines:
+        line = line.strip()
+        if len(line) == 0:
+            continue
+        yield json.loads(line)
+
+
+def run_batch(
+    groups: Iterable[List[str]],
+    all_users: List[Dict[str, Any]],
+    all_venues: List[Dict[str, Any]],
+    cache: Optional[PickCache] = None,
+    reasons: str = "text",
+) -> Iterator[Dict[str, Any]]:
+    """Evaluates venues for many groups of users, building the per-user and per-venue
+    structures once and yielding one result per group, in the same shape as create_response.
+    Groups containing invalid names yield an error entry rather than ending the batch.
+
+    Args:
+        groups (Iterable[List[str]]): Lists of user names to evaluate venues for.
+        all_users (List[Dict[str, Any]]): List of dictionaries for all users.
+        all_venues (List[Dict[str, Any]]): List of dictionaries for all venues.
+        cache (Optional[PickCache]): Cache for groups repeated within or across batches. Its
+        keys don't include the reason mode, so a cache should only be used with one mode.
+        reasons (str): One of REASON_MODES - 'none' leaves places_to_avoid empty.
+
+    Returns:
+        Iterator[Dict[str, Any]]: One response per group, in input order.
+    """
+    engine = BitmaskEngine(all_users, all_venues)
+    for group in groups:
+        names, error = engine.resolve_names(group)
+        if error:
+            yield {"error": error}
+            continue
+        if cache is None:
+            yield engine.pick(names, reasons)
+        else:
+            yield cache.get_or_pick(names, lambda names: engine.pick(names, reasons))
+
+
+if __name__ == "__main__":
+
+    # With --passing-only, list only the places to visit for each group. With --metrics,
+    # profile the batch and write Prometheus text to the given file at the end
+    try:
+        option_list, args = getopt.getopt(sys.argv[1:], "", ["metrics=", "passing-only"])
+    except getopt.GetoptError as e:
+        print(f"Sorry, {e}. Options must come before the groups file.")
+        sys.exit(2)
+    options = dict(option_list)
+    PROFILER.enabled = "--metrics" in options
+
+    # Read JSON arrays or NDJSON, keeping the records as every group is evaluated against them
+    all_users = list(stream_json_from_file("./data/users.json", ["drinks", "wont_eat"]))
+
+    all_venues = list(stream_json_from_file("./data/venues.json", ["food", "drinks"]))
+
+    # Read groups from the file named in the first arg, or from stdin if none given
+    if len(args) > 0:
+        group_file = open(args[0], "r")
+    else:
+        group_file = contextlib.nullcontext(sys.stdin)
+
+    # Stream one compact JSON result per line, so output starts before all groups are read
+    reasons = "none" if "--passing-only" in options else "text"
+    with group_file as group_lines:
+        for response in run_batch(
+            read_groups(group_lines), all_users, all_venues, reasons=reasons
+        ):
+            if reasons == "none":
+                response.pop("places_to_avoid", None)
+            print(encode(response), flush=True)
+
+    if PROFILER.enabled:
+        with open(options["--metrics"], "w") as metrics:
+            metrics.write(PROFILER.to_prometheus())
@@ -0,0 +1,486 @@
+import getopt
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from typing import Dict, List, Any, Callable
+
+from main import (
+    retrieve_json_from_file,
+    filter_users_by_name,
+    create_banned_foods_dict,
+    create_preferred_drinks_dict,
+    evaluate_venues_for_food_suitability,
+    evaluate_venues_for_drink_suitability,
+    create_response,
+)
+from batch import run_batch
+from pipeline import load_team_data
+from records import compact_records
+
+
+# Number of timed calls of each stage, after one untimed warm-up call, of which the fastest
+# is kept - slower calls mostly measure whatever else the machine was doing
+BENCHMARK_REPEAT = 5
+
+
+def generate_terms(prefix: str, count: int) -> List[str]:
+    """Generates a vocabulary of distinct lower case terms.
+
+    Args:
+        prefix (str): Prefix for each term, e.g. 'food' or 'drink'.
+        count (int): Number of terms to generate.
+
+    Returns:
+        List[str]: Generated terms.
+    """
+    return [f"{prefix} {number}" for number in range(count)]
+
+
+def generate_users(
+    rng: random.Random,
+    user_count: int,
+    foods: List[str],
+    drinks: List[str],
+    max_wont_eat: int = 3,
+    max_drinks: int = 4,
+) -> List[Dict[str, Any]]:
+    """Generates synthetic users in the same shape as users.json.
+
+    Args:
+        rng (random.Random): Seeded random number generator.
+        user_count (int): Number of users to generate.
+        foods (List[str]): Food vocabulary to draw banned foods from.
+        drinks (List[str]): Drink vocabulary to draw preferred drinks from.
+        max_wont_eat (int): Maximum number of banned foods per user.
+        max_drinks (int): Maximum number of preferred drinks per user.
+
+    Returns:
+        List[Dict[str, Any]]: Generated users.
+    """
+    return [
+        {
+            "name": f"User {number}",
+            "wont_eat": rng.sample(foods, rng.randint(0, min(max_wont_eat, len(foods)))),
+            "drinks": rng.sample(drinks, rng.randint(1, min(max_drinks, len(drinks)))),
+        }
+        for number in range(user_count)
+    ]
+
+
+def generate_venues(
+    rng: random.Random,
+    venue_count: int,
+    foods: List[str],
+    drinks: List[str],
+    max_food: int = 5,
+    max_drinks: int = 8,
+) -> List[Dict[str, Any]]:
+    """Generates synthetic venues in the same shape as venues.json.
+
+    Args:
+        rng (random.Random): Seeded random number generator.
+        venue_count (int): Number of venues to generate.
+        foods (List[str]): Food vocabulary to draw venue foods from.
+        drinks (List[str]): Drink vocabulary to draw venue drinks from.
+        max_food (int): Maximum number of foods per venue.
+        max_drinks (int): Maximum number of drinks per venue.
+
+    Returns:
+        List[Dict[str, Any]]: Generated venues.
+    """
+    return [
+        {
+            "name": f"Venue {number}",
+            "food": rng.sample(foods, rng.randint(1, min(max_food, len(foods)))),
+            "drinks": rng.sample(drinks, rng.randint(1, min(max_drinks, len(drinks)))),
+        }
+        for number in range(venue_count)
+    ]
+
+
+def benchmark_batch_throughput(
+    user_count: int = 200,
+    venue_count: int = 1000,
+    group_count: int = 1000,
+    group_size: int = 8,
+    seed: int = 0,
+    repeat: int = BENCHMARK_REPEAT,
+) -> float:
+    """Measures batch throughput in groups per second over synthetic data.
+
+    Args:
+        user_count (int): Number of synthetic users.
+        venue_count (int): Number of synthetic venues.
+        group_count (int): Number of groups to evaluate.
+        group_size (int): Number of users per group.
+        seed (int): Seed for the synthetic data generator.
+        repeat (int): Number of timed batches, after a warm-up batch, of which the fastest
+        is kept.
+
+    Returns:
+        float: Groups evaluated per second, including building the batch structures.
+    """
+    rng = random.Random(seed)
+    foods = generate_terms("food", 50)
+    drinks = generate_terms("drink", 30)
+    all_users = generate_users(rng, user_count, foods, drinks)
+    all_venues = generate_venues(rng, venue_count, foods, drinks)
+    user_names = [user["name"] for user in all_users]
+    groups = [rng.sample(user_names, group_size) for _ in range(group_count)]
+
+    seconds = {}
+    time_stage(
+        seconds, "batch", lambda: list(run_batch(groups, all_users, all_venues)), repeat=repeat
+    )
+    return group_count / seconds["batch"]
+
+
+def write_dataset(
+    directory: str, all_users: List[Dict[str, Any]], all_venues: List[Dict[str, Any]]
+) -> List[str]:
+    """Writes users and venues as users.json and venues.json in a directory.
+
+    Args:
+        directory (str): Directory to write the files to.
+        all_users (List[Dict[str, Any]]): Users to write.
+        all_venues (List[Dict[str, Any]]): Venues to write.
+
+    Returns:
+        List[str]: File paths of users.json and venues.json.
+    """
+    paths = [os.path.join(directory, "users.json"), os.path.join(directory, "venues.json")]
+    for path, records in zip(paths, [all_users, all_venues]):
+        with open(path, "w") as output:
+            json.dump(records, output)
+    return paths
+
+
+def time_stage(
+    timings: Dict[str, float],
+    stage: str,
+    function: Callable,
+    *args,
+    repeat: int = BENCHMARK_REPEAT,
+) -> Any:
+    """Calls a function once to warm up, then times repeated calls as timeit.repeat does,
+    recording the fastest wall time in seconds against a stage name.
+
+    Args:
+        timings (Dict[str, float]): Timings to record into.
+        stage (str): Name of the stage.
+        function (Callable): Function to call. Every call is given the same arguments, so it
+        should not change them in a way that changes its result.
+        repeat (int): Number of timed calls.
+
+    Returns:
+        Any: Result of the warm-up call.
+    """
+    result = function(*args)
+    timings[stage] = min(timeit.repeat(lambda: function(*args), number=1, repeat=repeat))
+    return result
+
+
+def benchmark_pipeline(
+    user_count: int,
+    venue_count: int,
+    food_count: int = 50,
+    drink_count: int = 30,
+    list_length: int = 4,
+    group_size: int = 8,
+    seed: int = 0,
+    repeat: int = BENCHMARK_REPEAT,
+) -> Dict[str, Any]:
+    """Generates a synthetic users.json and venues.json, then times each stage of the main.py
+    pipeline separately for a group of users drawn from them, keeping the fastest of repeated
+    calls of each stage.
+
+    Args:
+        user_count (int): Number of synthetic users.
+        venue_count (int): Number of synthetic venues.
+        food_count (int): Size of the food vocabulary.
+        drink_count (int): Size of the drink vocabulary.
+        list_length (int): Typical list length - users ban up to this many foods and prefer up
+        to this many drinks, and venues serve up to twice this many foods and drinks.
+        group_size (int): Number of users to pick venues for.
+        seed (int): Seed for the synthetic data generator.
+        repeat (int): Number of timed calls of each stage.
+
+    Returns:
+        Dict[str, Any]: Benchmark parameters, and seconds taken by each stage.
+    """
+    rng = random.Random(seed)
+    foods = generate_terms("food", food_count)
+    drinks = generate_terms("drink", drink_count)
+    parameters = {
+        "users": user_count,
+        "venues": venue_count,
+        "foods": food_count,
+        "drinks": drink_count,
+        "list_length": list_length,
+        "group_size": group_size,
+        "seed": seed,
+    }
+    timings = {}
+    with tempfile.TemporaryDirectory() as directory:
+        users_path, venues_path = write_dataset(
+            directory,
+            generate_users(rng, user_count, foods, drinks, list_length, list_length),
+            generate_venues(rng, venue_count, foods, drinks, 2 * list_length, 2 * list_length),
+        )
+        all_users = time_stage(
+            timings,
+            "retrieve_users",
+            retrieve_json_from_file,
+            users_path,
+            ["drinks", "wont_eat"],
+            None,
+            repeat=repeat,
+        )
+        all_venues = time_stage(
+            timings,
+            "retrieve_venues",
+            retrieve_json_from_file,
+            venues_path,
+            ["food", "drinks"],
+            None,
+            repeat=repeat,
+        )
+        # The fused pipeline, timed apart from the stages above and left out of their total
+        fused_timings = {}
+        team_data = time_stage(
+            fused_timings, "load_team_data", load_team_data, users_path, venues_path, repeat=repeat
+        )
+
+    args = rng.sample([user["name"] for user in all_users], min(group_size, user_count))
+    filtered_users = time_stage(
+        timings, "filter_users_by_name", filter_users_by_name, args, all_users, repeat=repeat
+    )
+    banned_foods_dict = time_stage(
+        timings,
+        "create_banned_foods_dict",
+        create_banned_foods_dict,
+        "wont_eat",
+        args,
+        all_users,
+        filtered_users,
+        repeat=repeat,
+    )
+    preferred_drinks_dict = time_stage(
+        timings,
+        "create_preferred_drinks_dict",
+        create_preferred_drinks_dict,
+        "drinks",
+        args,
+        all_users,
+        filtered_users,
+        repeat=repeat,
+    )
+    failing_venues_reasons_dict, venues_passing_food = time_stage(
+        timings,
+        "evaluate_venues_for_food_suitability",
+        evaluate_venues_for_food_suitability,
+        banned_foods_dict,
+        all_venues,
+        {},
+        filtered_users,
+        repeat=repeat,
+    )
+    failing_venues_reasons_dict, venues_passing_drink = time_stage(
+        timings,
+        "evaluate_venues_for_drink_suitability",
+        evaluate_venues_for_drink_suitability,
+        preferred_drinks_dict,
+        all_venues,
+        failing_venues_reasons_dict,
+        filtered_users,
+        repeat=repeat,
+    )
+    time_stage(
+        timings,
+        "create_response",
+        create_response,
+        venues_passing_food,
+        venues_passing_drink,
+        failing_venues_reasons_dict,
+        repeat=repeat,
+    )
+    timings["total"] = sum(timings.values())
+    time_stage(fused_timings, "team_data_pick", team_data.pick, args, repeat=repeat)
+    fused_timings["fused_total"] = sum(fused_timings.values())
+    timings.update(fused_timings)
+    return {"parameters": parameters, "seconds": timings}
+
+
+def compare_results(
+    baseline: Dict[str, Any], current: Dict[str, Any]
+) -> List[Dict[str, Any]]:
+    """Compares the stage timings of two benchmark results files, matching runs by parameters.
+
+    Args:
+        baseline (Dict[str, Any]): Earlier results, as written by this script.
+        current (Dict[str, Any]): Later results, as written by this script.
+
+    Returns:
+        List[Dict[str, Any]]: Parameters, stage, and ratio of current to baseline seconds,
+        for every stage timed in both.
+    """
+    baseline_runs = {
+        json.dumps(run["parameters"], sort_keys=True): run["seconds"]
+        for run in baseline["pipeline"]
+    }
+    comparisons = []
+    for run in current["pipeline"]:
+        baseline_seconds = baseline_runs.get(json.dumps(run["parameters"], sort_keys=True))
+        if baseline_seconds is None:
+            continue
+        for stage, seconds in run["seconds"].items():
+            if baseline_seconds.get(stage):
+                comparisons.append(
+                    {
+                        "parameters": run["parameters"],
+                        "stage": stage,
+                        "ratio": seconds / baseline_seconds[stage],
+                    }
+                )
+    return comparisons
+
+
+def measure_record_memory(
+    user_count: int = 1000,
+    venue_count: int = 100000,
+    list_length: int = 4,
+    seed: int = 0,
+) -> Dict[str, int]:
+    """Measures the memory held by users and venues loaded by retrieve_json_from_file, and by
+    the same data as compact records, with tracemalloc.
+
+    Args:
+        user_count (int): Number of synthetic users.
+        venue_count (int): Number of synthetic venues.
+        list_length (int): Typical list length, as for benchmark_pipeline.
+        seed (int): Seed for the synthetic data generator.
+
+    Returns:
+        Dict[str, int]: Bytes held by the dictionaries, and by the compact records.
+    """
+    rng = random.Random(seed)
+    foods = generate_terms("food", 50)
+    drinks = generate_terms("drink", 30)
+    with tempfile.TemporaryDirectory() as directory:
+        users_path, venues_path = write_dataset(
+            directory,
+            generate_users(rng, user_count, foods, drinks, list_length, list_length),
+            generate_venues(rng, venue_count, foods, drinks, 2 * list_length, 2 * list_length),
+        )
+        tracemalloc.start()
+        try:
+            all_users = retrieve_json_from_file(users_path, ["drinks", "wont_eat"], None)
+            all_venues = retrieve_json_from_file(venues_path, ["food", "drinks"], None)
+            dict_bytes = tracemalloc.get_traced_memory()[0]
+            records = compact_records(all_users, all_venues)
+            del all_users, all_venues
+            record_bytes = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+    del records
+    return {"dict_bytes": dict_bytes, "record_bytes": record_bytes}
+
+
+def parse_counts(value: str) -> List[int]:
+    """Parses a comma separated list of integers, e.g. '100,1000'.
+
+    Args:
+        value (str): Comma separated integers.
+
+    Returns:
+        List[int]: Parsed integers.
+    """
+    return [int(count) for count in value.split(",")]
+
+
+if __name__ == "__main__":
+
+    # Each sizing option takes a comma separated list, and every combination is benchmarked
+    try:
+        options, _ = getopt.getopt(
+            sys.argv[1:],
+            "",
+            [
+                "users=",
+                "venues=",
+                "foods=",
+                "drinks=",
+                "list-length=",
+                "group-size=",
+                "seed=",
+                "output=",
+                "compare=",
+                "repeat=",
+                "memory",
+            ],
+        )
+    except getopt.GetoptError as e:
+        print(f"Sorry, {e}.")
+        sys.exit(2)
+    options = dict(options)
+    sweep = itertools.product(
+        parse_counts(options.get("--users", "100,1000")),
+        parse_counts(options.get("--venues", "1000,10000")),
+        parse_counts(options.get("--foods", "50")),
+        parse_counts(options.get("--drinks", "30")),
+        parse_counts(options.get("--list-length", "4")),
+    )
+    group_size = int(options.get("--group-size", 8))
+    seed = int(options.get("--seed", 0))
+    repeat = int(options.get("--repeat", BENCHMARK_REPEAT))
+
+    results = []
+    for user_count, venue_count, food_count, drink_count, list_length in sweep:
+        result = benchmark_pipeline(
+            user_count, venue_count, food_count, drink_count, list_length, group_size, seed, repeat
+        )
+        results.append(result)
+        print(json.dumps(result))
+
+    groups_per_second = benchmark_batch_throughput(repeat=repeat)
+    print(f"Batch throughput: {groups_per_second:.0f} groups/second")
+
+    # With --memory, also compare the memory held by dictionaries and compact records, which
+    # builds 100,000 venues so is left out unless asked for
+    record_memory = None
+    if "--memory" in options:
+        record_memory = measure_record_memory()
+        print(
+            f"Memory for 1,000 users and 100,000 venues: {record_memory['dict_bytes']:,} bytes "
+            f"as dictionaries, {record_memory['record_bytes']:,} bytes as compact records"
+        )
+
+    output_path = options.get("--output", "benchmark_results.json")
+    with open(output_path, "w") as output:
+        json.dump(
+            {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "repeat": repeat,
+                "pipeline": results,
+                "batch_groups_per_second": groups_per_second,
+                "record_memory": record_memory,
+            },
+            output,
+            indent=2,
+        )
+    print(f"Results written to {output_path}")
+
+    # Report how much slower (> 1) or faster (< 1) each stage is than an earlier results file
+    if "--compare" in options:
+        with open(options["--compare"], "r") as baseline_file, open(output_path, "r") as current_file:
+            for comparison in compare_results(json.load(baseline_file), json.load(current_file)):
+                print(json.dumps(comparison))
@@ -0,0 +1,198 @@
+import hashlib
+import os
+from collections import OrderedDict
+from typing import Dict, List, Any, Callable, Iterable, Optional, Tuple
+
+from index import hash_file
+
+
+def stat_files(file_paths: Iterable[str]) -> Tuple:
+    """Fingerprints files by modification time and size, as a cheap check for changes.
+
+    Args:
+        file_paths (Iterable[str]): File paths to fingerprint.
+
+    Returns:
+        Tuple: Modification time and size of each file, or None for missing files.
+    """
+    fingerprint = []
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+            fingerprint.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            fingerprint.append(None)
+    return tuple(fingerprint)
+
+
+def hash_data_files(file_paths: Iterable[str]) -> str:
+    """Computes a version hash over the contents of data files, matching
+    DataWatcher.data_version for the users and venues files.
+
+    Args:
+        file_paths (Iterable[str]): File paths to hash, skipping missing files.
+
+    Returns:
+        str: Hex digest of the file hashes.
+    """
+    digest = hashlib.sha256()
+    for file_path in file_paths:
+        if os.path.exists(file_path):
+            digest.update(hash_file(file_path).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class PickCache:
+    """Least recently used cache of pick responses, keyed by the set of attendee names plus a
+    version hash of the users and venues data the responses were computed from.
+
+    When given the data file paths, every lookup checks the files' modification times and
+    sizes, and on any change re-hashes their contents and drops all cached responses.
+    Responses are shared between lookups, so callers must not modify them.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 1024,
+        data_paths: Iterable[str] = (),
+        data_version: Optional[str] = None,
+    ):
+        self.max_size = max_size
+        self.data_paths = list(data_paths)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.file_fingerprint = stat_files(self.data_paths)
+        self.data_version = data_version or self.hash_data_files()
+
+    def hash_data_files(self) -> str:
+        """Computes a version hash over the contents of the data files.
+
+        Returns:
+            str: Hex digest of the file hashes.
+        """
+        return hash_data_files(self.data_paths)
+
+    def check_data_files(self):
+        """Drops all cached responses if any data file has changed since last checked."""
+        if not self.data_paths:
+            return
+        file_fingerprint = stat_files(self.data_paths)
+        if file_fingerprint == self.file_fingerprint:
+            return
+        self.file_fingerprint = file_fingerprint
+        data_version = self.hash_data_files()
+        # Files touched without changing their contents keep their cached responses
+        if data_version != self.data_version:
+            self.set_data_version(data_version)
+
+    def set_data_version(self, data_version: str):
+        """Records that the data has changed, dropping all cached responses.
+
+        Args:
+            data_version (str): Version hash of the new data.
+        """
+        self.data_version = data_version
+        self.entries.clear()
+        self.invalidations += 1
+
+    def invalidate_where(
+        self, affected: Callable[[frozenset, Dict[str, Any]], bool]
+    ) -> int:
+        """Drops only the cached responses affected by a change to the data.
+
+        Args:
+            affected (Callable[[frozenset, Dict[str, Any]], bool]): Given the set of names and
+            the cached response, returns whether the response is out of date.
+
+        Returns:
+            int: Number of responses dropped.
+        """
+        stale_keys = [
+            key for key, response in self.entries.items() if affected(key[0], response)
+        ]
+        for key in stale_keys:
+            del self.entries[key]
+        self.invalidations += len(stale_keys)
+        return len(stale_keys)
+
+    def key(self, names: Iterable[str]) -> Tuple[frozenset, str]:
+        """Builds the cache key for a group, which ignores name order and repeats.
+
+        Args:
+            names (Iterable[str]): Validated user names.
+
+        Returns:
+            Tuple[frozenset, str]: Set of names, and data version.
+        """
+        return frozenset(name.strip() for name in names), self.data_version
+
+    def get(self, names: Iterable[str]) -> Optional[Dict[str, Any]]:
+        """Looks up the cached response for a group.
+
+        Args:
+            names (Iterable[str]): Validated user names.
+
+        Returns:
+            Optional[Dict[str, Any]]: Cached response, or None if not cached.
+        """
+        self.check_data_files()
+        key = self.key(names)
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, names: Iterable[str], response: Dict[str, Any]):
+        """Caches the response for a group, evicting the least recently used if full.
+
+        Args:
+            names (Iterable[str]): Validated user names.
+            response (Dict[str, Any]): Response for those users.
+        """
+        if self.max_size <= 0:
+            return
+        key = self.key(names)
+        self.entries[key] = response
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_pick(
+        self, names: List[str], pick: Callable[[List[str]], Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """Returns the cached response for a group, or computes and caches it.
+
+        Args:
+            names (List[str]): Validated user names.
+            pick (Callable[[List[str]], Dict[str, Any]]): Computes the response for names.
+
+        Returns:
+            Dict[str, Any]: Response for those users.
+        """
+        response = self.get(names)
+        if response is None:
+            response = pick(names)
+            self.put(names, response)
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        """Reports the cache size and counters.
+
+        Returns:
+            Dict[str, Any]: Size bound, entries, hits, misses, evictions and invalidations.
+        """
+        return {
+            "max_size": self.max_size,
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "data_version": self.data_version,
+        }
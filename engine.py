@@ -0,0 +1,460 @@
+from typing import Dict, List, Any, Tuple, Iterable, Iterator, Optional, Union
+
+from main import create_response, describe_reason, add_reasons, Reason, REASON_MODES
+from instrument import PROFILER, count_reasons
+from names import NameIndex
+
+
+def intern_terms(terms: Iterable[str], term_ids: Dict[str, int]) -> List[int]:
+    """Assigns an integer ID to each term not already present in the term ID mapping,
+    and returns the IDs of the given terms, de-duplicated and in first-seen order.
+
+    Args:
+        terms (Iterable[str]): Food or drink terms to intern.
+        term_ids (Dict[str, int]): Mapping of terms to IDs, updated in place.
+
+    Returns:
+        List[int]: Term IDs of the given terms.
+    """
+    ids = {}
+    for term in terms:
+        if term not in term_ids:
+            term_ids[term] = len(term_ids)
+        ids[term_ids[term]] = None
+    return list(ids)
+
+
+def encode_terms(term_ids: Iterable[int]) -> int:
+    """Encodes a collection of integer IDs as an integer bitset.
+
+    Args:
+        term_ids (Iterable[int]): IDs to set in the bitset.
+
+    Returns:
+        int: Bitset with one bit set per ID.
+    """
+    mask = 0
+    for term_id in term_ids:
+        mask |= 1 << term_id
+    return mask
+
+
+def iter_bits(mask: int) -> Iterator[int]:
+    """Yields the positions of the set bits of an integer bitset, lowest first.
+
+    Args:
+        mask (int): Bitset to decode.
+
+    Returns:
+        Iterator[int]: Positions of the set bits.
+    """
+    while mask:
+        lowest = mask & -mask
+        yield lowest.bit_length() - 1
+        mask ^= lowest
+
+
+class BitmaskEngine:
+    """Evaluates venues for food and drink suitability using integer bitsets.
+
+    Every food and drink term is interned to an integer ID, and every user is given a bit
+    position in the order they appear in the users file. Each venue then carries a bitset of
+    its foods, and a bitset of the users who would drink something there, so that a venue
+    passes or fails a pick with a couple of AND operations rather than list scans.
+
+    Users are keyed by name in the same way as filter_users_by_name, so where a name is
+    repeated the user keeps the position of its first appearance and the details of its last.
+    As in create_banned_foods_dict, the foods listed by the earlier records still count as
+    banned - nobody is given as the reason, but a venue serving only those foods fails on food.
+    Users and venues can be added, updated and removed without rebuilding the engine.
+    """
+
+    @PROFILER.timed("BitmaskEngine.build")
+    def __init__(
+        self, all_users: List[Dict[str, Any]], all_venues: List[Dict[str, Any]]
+    ):
+        self.term_ids = {}
+        # Bitset of the users banning each food, and of the users drinking each drink
+        self.food_banners = {}
+        self.drink_drinkers = {}
+        # Bitset of the users whose earlier records, under a repeated name, list each food
+        self.food_shadowers = {}
+        self.user_index = {}
+        # Built when first needed for suggestions, and dropped whenever users are added or removed
+        self.name_index = None
+        self.user_names = []
+        self.user_wont_eat = []
+        self.user_drinks = []
+        self.user_wont_eat_masks = []
+        self.user_shadowed_masks = []
+        self.venue_names = []
+        self.venue_foods = []
+        self.venue_drinks = []
+        self.venue_food_masks = []
+        self.venue_drinker_masks = []
+        for user in all_users:
+            self.load_user(user)
+        for venue in all_venues:
+            self.add_venue(venue)
+
+    def set_user_terms(self, position: int, wont_eat: List[str], drinks: List[str]):
+        """Sets the banned foods and preferred drinks of the user at a bit position, keeping
+        the food, drink and venue bitsets that include that user up to date.
+
+        Args:
+            position (int): Bit position of the user.
+            wont_eat (List[str]): Foods the user won't eat.
+            drinks (List[str]): Drinks the user drinks.
+        """
+        user_bit = 1 << position
+        for food_id in self.user_wont_eat[position]:
+            self.food_banners[food_id] &= ~user_bit
+        for drink_id in self.user_drinks[position]:
+            self.drink_drinkers[drink_id] &= ~user_bit
+
+        self.user_wont_eat[position] = intern_terms(wont_eat, self.term_ids)
+        self.user_drinks[position] = intern_terms(drinks, self.term_ids)
+        self.user_wont_eat_masks[position] = encode_terms(self.user_wont_eat[position])
+        for food_id in self.user_wont_eat[position]:
+            self.food_banners[food_id] = self.food_banners.get(food_id, 0) | user_bit
+        for drink_id in self.user_drinks[position]:
+            self.drink_drinkers[drink_id] = self.drink_drinkers.get(drink_id, 0) | user_bit
+
+        user_drinks = set(self.user_drinks[position])
+        for venue_position, venue_drinks in enumerate(self.venue_drinks):
+            if user_drinks.intersection(venue_drinks):
+                self.venue_drinker_masks[venue_position] |= user_bit
+            else:
+                self.venue_drinker_masks[venue_position] &= ~user_bit
+
+    def load_user(self, user: Dict[str, Any]):
+        """Adds a user record from the users file. Where the name repeats an earlier record,
+        that record's foods are kept as banned by nobody, as in create_banned_foods_dict.
+
+        Args:
+            user (Dict[str, Any]): Cleaned user dictionary.
+        """
+        if user["name"] in self.user_index:
+            self.shadow_user_foods(self.user_index[user["name"]])
+            self.update_user(user)
+        else:
+            self.add_user(user)
+
+    def add_user(self, user: Dict[str, Any]):
+        """Adds a user after all existing users, or updates them if the name already exists.
+
+        Args:
+            user (Dict[str, Any]): Cleaned user dictionary.
+        """
+        if user["name"] in self.user_index:
+            self.update_user(user)
+            return
+        self.name_index = None
+        self.user_index[user["name"]] = len(self.user_names)
+        self.user_names.append(user["name"])
+        self.user_wont_eat.append([])
+        self.user_drinks.append([])
+        self.user_wont_eat_masks.append(0)
+        self.user_shadowed_masks.append(0)
+        self.set_user_terms(self.user_index[user["name"]], user["wont_eat"], user["drinks"])
+
+    def shadow_user_foods(self, position: int):
+        """Keeps the current banned foods of the user at a bit position as banned by nobody,
+        before a later record with the same name replaces their details.
+
+        Args:
+            position (int): Bit position of the user.
+        """
+        user_bit = 1 << position
+        for food_id in self.user_wont_eat[position]:
+            self.food_shadowers[food_id] = self.food_shadowers.get(food_id, 0) | user_bit
+        self.user_shadowed_masks[position] |= self.user_wont_eat_masks[position]
+
+    def update_user(self, user: Dict[str, Any]):
+        """Replaces the banned foods and preferred drinks of an existing user.
+
+        Args:
+            user (Dict[str, Any]): Cleaned user dictionary, named as an existing user.
+        """
+        self.set_user_terms(self.user_index[user["name"]], user["wont_eat"], user["drinks"])
+
+    def remove_user(self, name: str):
+        """Removes a user. Their bit position is left unused rather than renumbering others.
+
+        Args:
+            name (str): Name of the user to remove.
+        """
+        self.name_index = None
+        position = self.user_index.pop(name)
+        for food_id in iter_bits(self.user_shadowed_masks[position]):
+            self.food_shadowers[food_id] &= ~(1 << position)
+        self.user_shadowed_masks[position] = 0
+        self.set_user_terms(position, [], [])
+
+    def encode_venue(self, venue: Dict[str, Any]) -> Tuple[List[int], List[int], int, int]:
+        """Encodes a venue's foods and drinks as term IDs and bitsets.
+
+        Args:
+            venue (Dict[str, Any]): Cleaned venue dictionary.
+
+        Returns:
+            Tuple[List[int], List[int], int, int]: Food IDs, drink IDs, bitset of foods, and
+            bitset of the users who drink something the venue serves.
+        """
+        food_ids = intern_terms(venue["food"], self.term_ids)
+        drink_ids = intern_terms(venue["drinks"], self.term_ids)
+        drinkers = 0
+        for drink_id in drink_ids:
+            drinkers |= self.drink_drinkers.get(drink_id, 0)
+        return food_ids, drink_ids, encode_terms(food_ids), drinkers
+
+    def add_venue(self, venue: Dict[str, Any]):
+        """Adds a venue after all existing venues.
+
+        Args:
+            venue (Dict[str, Any]): Cleaned venue dictionary.
+        """
+        food_ids, drink_ids, food_mask, drinkers = self.encode_venue(venue)
+        self.venue_names.append(venue["name"])
+        self.venue_foods.append(food_ids)
+        self.venue_drinks.append(drink_ids)
+        self.venue_food_masks.append(food_mask)
+        self.venue_drinker_masks.append(drinkers)
+
+    def update_venue(self, venue: Dict[str, Any]):
+        """Replaces the foods and drinks of the first venue with the same name, keeping its place.
+
+        Args:
+            venue (Dict[str, Any]): Cleaned venue dictionary, named as an existing venue.
+        """
+        position = self.venue_names.index(venue["name"])
+        (
+            self.venue_foods[position],
+            self.venue_drinks[position],
+            self.venue_food_masks[position],
+            self.venue_drinker_masks[position],
+        ) = self.encode_venue(venue)
+
+    def remove_venue(self, name: str):
+        """Removes the first venue with the given name.
+
+        Args:
+            name (str): Name of the venue to remove.
+        """
+        position = self.venue_names.index(name)
+        del self.venue_names[position]
+        del self.venue_foods[position]
+        del self.venue_drinks[position]
+        del self.venue_food_masks[position]
+        del self.venue_drinker_masks[position]
+
+    def resolve_names(self, names: Iterable[str]) -> Tuple[List[str], Optional[str]]:
+        """Validates user names given by a library or service caller, without exiting on
+        invalid names as validate_args does. 'everyone' selects all users.
+
+        Args:
+            names (Iterable[str]): User names to validate.
+
+        Returns:
+            Tuple[List[str], Optional[str]]: Validated names, and an error message if invalid.
+        """
+        names = [name.strip() for name in names]
+        if "everyone" in names:
+            return list(self.user_index), None
+        if len(names) == 0:
+            return names, "No users given."
+        invalid_names = [name for name in names if name not in self.user_index]
+        if invalid_names:
+            if self.name_index is None:
+                self.name_index = NameIndex(self.user_index)
+            suggestions = self.name_index.suggest(invalid_names[0])
+            if suggestions:
+                return names, f"Not valid users: {invalid_names}. Did you mean: {suggestions}?"
+            return names, f"Not valid users: {invalid_names}"
+        return names, None
+
+    def select_users(self, names: Iterable[str]) -> int:
+        """Builds the bitset of selected users, ignoring names not in the users file.
+
+        Args:
+            names (Iterable[str]): User names to select.
+
+        Returns:
+            int: Bitset of selected user positions.
+        """
+        selected = 0
+        for name in names:
+            if name in self.user_index:
+                selected |= 1 << self.user_index[name]
+        return selected
+
+    def banned_foods(self, selected: int) -> int:
+        """Builds the bitset of foods banned for the selected users, as the keys of
+        create_banned_foods_dict - those they won't eat, and those listed by earlier records
+        under their names.
+
+        Args:
+            selected (int): Bitset of selected users.
+
+        Returns:
+            int: Bitset of food IDs.
+        """
+        banned = 0
+        for position in iter_bits(selected):
+            banned |= self.user_wont_eat_masks[position] | self.user_shadowed_masks[position]
+        return banned
+
+    def food_blockers(self, food_id: int) -> int:
+        """Builds the bitset of users who can't be in a group with a food to eat - those who
+        won't eat it, and those whose earlier records list it.
+
+        Args:
+            food_id (int): ID of the food.
+
+        Returns:
+            int: Bitset of user positions.
+        """
+        return self.food_banners.get(food_id, 0) | self.food_shadowers.get(food_id, 0)
+
+    def food_reasons(
+        self, position: int, selected: int, reasons: str = "text"
+    ) -> List[Union[str, Reason]]:
+        """Lists the reasons a venue fails on food, in the same order as
+        evaluate_venues_for_food_suitability, for a venue where every food is banned.
+
+        Args:
+            position (int): Position of the venue.
+            selected (int): Bitset of selected users.
+            reasons (str): 'lazy' for Reasons, otherwise the reason text.
+
+        Returns:
+            List[Union[str, Reason]]: One reason per selected user banning any of the venue's
+            foods.
+        """
+        users = {}
+        for food_id in self.venue_foods[position]:
+            banners = self.food_banners.get(food_id, 0) & selected
+            for user_position in iter_bits(banners):
+                users[user_position] = None
+        return [
+            describe_reason(self.user_names[user_position], "eat", reasons)
+            for user_position in users
+        ]
+
+    def drink_reasons(
+        self, drinkless: int, reasons: str = "text"
+    ) -> List[Union[str, Reason]]:
+        """Lists the reasons a venue fails on drink.
+
+        Args:
+            drinkless (int): Bitset of selected users with nothing to drink at the venue.
+            reasons (str): 'lazy' for Reasons, otherwise the reason text.
+
+        Returns:
+            List[Union[str, Reason]]: One reason per drinkless user.
+        """
+        return [
+            describe_reason(self.user_names[user_position], "drink", reasons)
+            for user_position in iter_bits(drinkless)
+        ]
+
+    def venue_outcome(
+        self, position: int, selected: int
+    ) -> Tuple[bool, bool, List[str], List[str]]:
+        """Evaluates a single venue for the selected users.
+
+        Args:
+            position (int): Position of the venue.
+            selected (int): Bitset of selected users.
+
+        Returns:
+            Tuple[bool, bool, List[str], List[str]]: Whether the venue passes on food and on
+            drink, and its food and drink failure reasons.
+        """
+        banned = self.banned_foods(selected)
+        passes_food = bool(self.venue_food_masks[position] & ~banned)
+        drinkless = selected & ~self.venue_drinker_masks[position]
+        return (
+            passes_food,
+            not drinkless,
+            [] if passes_food else self.food_reasons(position, selected),
+            self.drink_reasons(drinkless),
+        )
+
+    @PROFILER.timed()
+    def evaluate(
+        self, names: Iterable[str], reasons: str = "text"
+    ) -> Tuple[Dict[str, List[str]], List[str], List[str]]:
+        """Evaluates all venues for the named users, producing the same intermediate results
+        as running evaluate_venues_for_food_suitability then evaluate_venues_for_drink_suitability.
+
+        Args:
+            names (Iterable[str]): Validated user names to evaluate venues for.
+            reasons (str): One of REASON_MODES - 'none' skips building reasons.
+
+        Returns:
+            Tuple[Dict[str, List[str]], List[str], List[str]]: Failing venues with reasons,
+            venues passing on food, and venues passing on drink.
+        """
+        assert reasons in REASON_MODES, f"Got reason mode {reasons}, expected one of {REASON_MODES}"
+        selected = self.select_users(names)
+        banned = self.banned_foods(selected)
+
+        failing_venues_reasons_dict = {}
+        venues_passing_food = []
+        venues_passing_drink = []
+        drink_failures = []
+        for position, name in enumerate(self.venue_names):
+            # Venue passes on food if any of its foods is not banned by a selected user
+            if self.venue_food_masks[position] & ~banned:
+                venues_passing_food.append(name)
+            elif reasons != "none":
+                add_reasons(
+                    failing_venues_reasons_dict,
+                    name,
+                    self.food_reasons(position, selected, reasons),
+                )
+
+            # Venue passes on drink if every selected user drinks something it serves
+            drinkless = selected & ~self.venue_drinker_masks[position]
+            if drinkless:
+                drink_failures.append((name, drinkless))
+            else:
+                venues_passing_drink.append(name)
+
+        # Drink reasons are recorded after all food reasons, as in the original pipeline
+        if reasons != "none":
+            for name, drinkless in drink_failures:
+                add_reasons(
+                    failing_venues_reasons_dict,
+                    name,
+                    self.drink_reasons(drinkless, reasons),
+                )
+
+        return failing_venues_reasons_dict, venues_passing_food, venues_passing_drink
+
+    @PROFILER.timed()
+    def pick(self, names: Iterable[str], reasons: str = "text") -> Dict[str, Any]:
+        """Evaluates all venues for the named users and forms the same output as create_response.
+
+        Args:
+            names (Iterable[str]): Validated user names to evaluate venues for.
+            reasons (str): One of REASON_MODES. With 'lazy', reasons are Reasons to be rendered
+            by render_reasons, and with 'none', places_to_avoid is left empty.
+
+        Returns:
+            Dict[str, Any]: Places to visit and places to avoid, with reasons.
+        """
+        (
+            failing_venues_reasons_dict,
+            venues_passing_food,
+            venues_passing_drink,
+        ) = self.evaluate(names, reasons)
+        if PROFILER.enabled:
+            PROFILER.count("picks")
+            PROFILER.count("users_filtered", bin(self.select_users(names)).count("1"))
+            PROFILER.count("venues_evaluated", len(self.venue_names))
+            PROFILER.count("reasons_generated", count_reasons(failing_venues_reasons_dict))
+        return create_response(
+            venues_passing_food, venues_passing_drink, failing_venues_reasons_dict
+        )
@@ -0,0 +1,171 @@
+from typing import Dict, List, Any, Iterable, Optional
+
+from engine import BitmaskEngine, iter_bits
+from ranking import count_bits
+from instrument import PROFILER
+
+
+class VenueExplainer:
+    """Works out the cheapest changes that would make each failing venue pass for a group -
+    the fewest users to leave out, or a single food or drink for the venue to add.
+
+    Everything comes from the engine's bitsets of the users banning each food and drinking
+    each drink, rather than re-running the evaluate functions for each possible change. Foods
+    and drinks to add are suggested most widely served first, from those served by any venue
+    or, for drinks, drunk by any user.
+    """
+
+    def __init__(self, engine: BitmaskEngine):
+        self.engine = engine
+        self.terms = [None] * len(engine.term_ids)
+        for term, term_id in engine.term_ids.items():
+            self.terms[term_id] = term
+
+        # Number of venues serving each food and drink, to suggest widely served ones first
+        food_venue_counts = {}
+        drink_venue_counts = {}
+        for position in range(len(engine.venue_names)):
+            for food_id in engine.venue_foods[position]:
+                food_venue_counts[food_id] = food_venue_counts.get(food_id, 0) + 1
+            for drink_id in engine.venue_drinks[position]:
+                drink_venue_counts[drink_id] = drink_venue_counts.get(drink_id, 0) + 1
+        for drink_id in engine.drink_drinkers:
+            drink_venue_counts.setdefault(drink_id, 0)
+        self.foods_by_popularity = sorted(
+            food_venue_counts, key=lambda food_id: (-food_venue_counts[food_id], food_id)
+        )
+        self.drinks_by_popularity = sorted(
+            drink_venue_counts, key=lambda drink_id: (-drink_venue_counts[drink_id], drink_id)
+        )
+
+    def user_list(self, users: int) -> List[str]:
+        """Names the users in a bitset.
+
+        Args:
+            users (int): Bitset of users.
+
+        Returns:
+            List[str]: User names, in users file order.
+        """
+        return [self.engine.user_names[position] for position in iter_bits(users)]
+
+    def foods_to_add(self, selected: int, limit: int) -> List[str]:
+        """Finds foods none of the selected users ban. Any one of them would make a venue
+        failing only on food pass, since every food it serves is already banned.
+
+        Args:
+            selected (int): Bitset of selected users.
+            limit (int): Most foods to return.
+
+        Returns:
+            List[str]: Foods, most widely served first.
+        """
+        foods = []
+        for food_id in self.foods_by_popularity:
+            if not self.engine.food_blockers(food_id) & selected:
+                foods.append(self.terms[food_id])
+                if len(foods) == limit:
+                    break
+        return foods
+
+    def drinks_to_add(self, drinkless: int, limit: int) -> List[str]:
+        """Finds drinks every one of the drinkless users drinks, any one of which would give
+        them all something to drink.
+
+        Args:
+            drinkless (int): Bitset of selected users with nothing to drink at a venue.
+            limit (int): Most drinks to return.
+
+        Returns:
+            List[str]: Drinks, most widely served first.
+        """
+        drinks = []
+        for drink_id in self.drinks_by_popularity:
+            if self.engine.drink_drinkers.get(drink_id, 0) & drinkless == drinkless:
+                drinks.append(self.terms[drink_id])
+                if len(drinks) == limit:
+                    break
+        return drinks
+
+    def users_to_drop(self, position: int, selected: int, drinkless: int) -> Optional[int]:
+        """Finds the smallest set of users to leave out for a venue to pass. Every drinkless
+        user must go, plus, if the venue fails on food, everyone banning one of its foods -
+        whichever food leaves the fewest out.
+
+        Args:
+            position (int): Position of the venue.
+            selected (int): Bitset of selected users.
+            drinkless (int): Bitset of selected users with nothing to drink at the venue.
+
+        Returns:
+            Optional[int]: Bitset of users to leave out, or None if no group of the users
+            would pass, e.g. for a venue serving no food.
+        """
+        banned = self.engine.banned_foods(selected & ~drinkless)
+        if self.engine.venue_food_masks[position] & ~banned:
+            best = drinkless
+        else:
+            best = None
+            for food_id in self.engine.venue_foods[position]:
+                dropped = drinkless | (self.engine.food_blockers(food_id) & selected)
+                if best is None or count_bits(dropped) < count_bits(best):
+                    best = dropped
+        if best is None or best == selected:
+            return None
+        return best
+
+    @PROFILER.timed()
+    def explain(self, names: Iterable[str], limit: int = 3) -> List[Dict[str, Any]]:
+        """Explains how each venue listed in places_to_avoid for the named users could pass.
+
+        Args:
+            names (Iterable[str]): Validated user names.
+            limit (int): Most foods or drinks to suggest adding to each venue.
+
+        Returns:
+            List[Dict[str, Any]]: For each failing venue, in places_to_avoid order (venues
+            failing on food first, then those failing only on drink), the users to leave
+            out (or None if leaving users out can't help), and the foods and drinks any one of
+            which would make it pass if added (empty if no single addition would).
+        """
+        engine = self.engine
+        selected = engine.select_users(names)
+        banned = engine.banned_foods(selected)
+        # The same foods would fix every venue failing only on food, so find them once
+        foods = None
+
+        food_explanations = []
+        drink_explanations = []
+        for position, name in enumerate(engine.venue_names):
+            food_mask = engine.venue_food_masks[position]
+            passes_food = bool(food_mask & ~banned)
+            drinkless = selected & ~engine.venue_drinker_masks[position]
+            # Venues serving no food, or only foods banned by earlier records of repeated
+            # names, fail on food without reasons, so are only listed in places_to_avoid,
+            # after the food failures, if they also fail on drink
+            fails_food_with_reasons = not passes_food and any(
+                engine.food_banners.get(food_id, 0) & selected
+                for food_id in engine.venue_foods[position]
+            )
+            if not fails_food_with_reasons and not drinkless:
+                continue
+
+            add_food = []
+            add_drink = []
+            if not drinkless:
+                if foods is None:
+                    foods = self.foods_to_add(selected, limit)
+                add_food = foods
+            elif passes_food:
+                add_drink = self.drinks_to_add(drinkless, limit)
+            dropped = self.users_to_drop(position, selected, drinkless)
+            explanations = food_explanations if fails_food_with_reasons else drink_explanations
+            explanations.append(
+                {
+                    "name": name,
+                    "drop_users": None if dropped is None else self.user_list(dropped),
+                    "add_food": add_food,
+                    "add_drink": add_drink,
+                }
+            )
+        return food_explanations + drink_explanations
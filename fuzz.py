@@ -0,0 +1,513 @@
+import copy
+import getopt
+import json
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Any, Callable, Iterator, Optional, Tuple
+
+from main import (
+    filter_users_by_name,
+    create_banned_foods_dict,
+    create_preferred_drinks_dict,
+    create_response,
+    pick_venues,
+    render_reasons,
+    parse_time,
+    format_time,
+    MINUTES_PER_DAY,
+)
+from availability import filter_venues_by_availability
+from engine import BitmaskEngine
+from index import (
+    VenueIndex,
+    evaluate_venues_for_food_suitability_indexed,
+    evaluate_venues_for_drink_suitability_indexed,
+)
+from matrix import MatrixEngine
+from parallel import pick_venues_parallel
+from pipeline import TeamData
+from records import compact_records
+from spatial import distance_km, filter_venues_by_distance
+from store import VenueStore
+
+
+def pick_indexed(
+    names: List[str], all_users: List[Dict[str, Any]], all_venues: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """Runs a pick with the VenueIndex evaluate functions from index.py.
+
+    Args:
+        names (List[str]): User names to evaluate venues for.
+        all_users (List[Dict[str, Any]]): List of dictionaries for all users.
+        all_venues (List[Dict[str, Any]]): List of dictionaries for all venues.
+
+    Returns:
+        Dict[str, Any]: Places to visit and places to avoid, with reasons.
+    """
+    filtered_users = filter_users_by_name(names, all_users)
+    banned_foods_dict = create_banned_foods_dict("wont_eat", names, all_users, filtered_users)
+    preferred_drinks_dict = create_preferred_drinks_dict(
+        "drinks", names, all_users, filtered_users
+    )
+    venue_index = VenueIndex.build(all_venues)
+    failing_venues_reasons_dict, venues_passing_food = (
+        evaluate_venues_for_food_suitability_indexed(
+            banned_foods_dict, venue_index, all_venues, {}, filtered_users
+        )
+    )
+    failing_venues_reasons_dict, venues_passing_drink = (
+        evaluate_venues_for_drink_suitability_indexed(
+            preferred_drinks_dict, venue_index, failing_venues_reasons_dict, filtered_users
+        )
+    )
+    return create_response(
+        venues_passing_food, venues_passing_drink, failing_venues_reasons_dict
+    )
+
+
+def pick_team_data(
+    names: List[str], all_users: List[Dict[str, Any]], all_venues: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """Runs a pick with the indexes of the single-pass load pipeline.
+
+    Args:
+        names (List[str]): User names to evaluate venues for.
+        all_users (List[Dict[str, Any]]): List of dictionaries for all users.
+        all_venues (List[Dict[str, Any]]): List of dictionaries for all venues.
+
+    Returns:
+        Dict[str, Any]: Places to visit and places to avoid, with reasons.
+    """
+    team_data = TeamData()
+    for user in all_users:
+        team_data.add_user(user)
+    for venue in all_venues:
+        team_data.add_venue(venue)
+    return team_data.pick(names)
+
+
+def pick_store(
+    names: List[str], all_users: List[Dict[str, Any]], all_venues: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """Runs a pick as queries on an in-memory SQLite VenueStore.
+
+    Args:
+        names (List[str]): User names to evaluate venues for.
+        all_users (List[Dict[str, Any]]): List of dictionaries for all users.
+        all_venues (List[Dict[str, Any]]): List of dictionaries for all venues.
+
+    Returns:
+        Dict[str, Any]: Places to visit and places to avoid, with reasons.
+    """
+    store = VenueStore(":memory:")
+    try:
+        store.import_records(all_users, all_venues)
+        return store.pick(names)
+    finally:
+        store.close()
+
+
+# Alternatives to pick_venues, each called with the names, users and venues of a case
+ENGINES = {
+    "bitmask": lambda names, users, venues: BitmaskEngine(users, venues).pick(names),
+    "matrix": lambda names, users, venues: MatrixEngine(users, venues).pick(names),
+    "indexed": pick_indexed,
+    "pipeline": pick_team_data,
+    "records": lambda names, users, venues: pick_venues(names, *compact_records(users, venues)),
+    "lazy": lambda names, users, venues: render_reasons(
+        pick_venues(names, users, venues, reasons="lazy")
+    ),
+    "store": pick_store,
+    "parallel": lambda names, users, venues: pick_venues_parallel(names, users, venues, workers=2),
+}
+
+
+def near_brute_force(venues: List[Dict[str, Any]], query: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Keeps the venues within the query's radius, or without coordinates, by measuring the
+    distance to every venue.
+
+    Args:
+        venues (List[Dict[str, Any]]): Venues of a case.
+        query (Dict[str, Any]): Query of a case.
+
+    Returns:
+        List[Dict[str, Any]]: Candidate venues, in catalog order.
+    """
+    return [
+        venue
+        for venue in venues
+        if "latitude" not in venue
+        or distance_km(query["latitude"], query["longitude"], venue["latitude"], venue["longitude"])
+        <= query["radius_km"]
+    ]
+
+
+def is_open_at(venue: Dict[str, Any], minutes: int) -> bool:
+    """Checks whether a venue is open at a time of day, interval by interval.
+
+    Args:
+        venue (Dict[str, Any]): Venue dictionary.
+        minutes (int): Minutes after midnight.
+
+    Returns:
+        bool: Whether the venue is open, or has no opening hours.
+    """
+    if "opening_hours" not in venue:
+        return True
+    for opening, closing in venue["opening_hours"]:
+        opening_minutes, closing_minutes = parse_time(opening), parse_time(closing)
+        if closing_minutes > opening_minutes:
+            if opening_minutes <= minutes < closing_minutes:
+                return True
+        elif minutes >= opening_minutes or minutes < closing_minutes:
+            return True
+    return False
+
+
+def at_brute_force(venues: List[Dict[str, Any]], query: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Keeps the venues open at the query's time with seats for its party, or without opening
+    hours or a capacity, by checking every venue.
+
+    Args:
+        venues (List[Dict[str, Any]]): Venues of a case.
+        query (Dict[str, Any]): Query of a case.
+
+    Returns:
+        List[Dict[str, Any]]: Candidate venues, in catalog order.
+    """
+    return [
+        venue
+        for venue in venues
+        if (query["minutes"] is None or is_open_at(venue, query["minutes"]))
+        and (
+            query["party_size"] is None
+            or venue.get("capacity", query["party_size"]) >= query["party_size"]
+        )
+    ]
+
+
+# Venue filters applied before pick_venues, each as the indexed filter main.py runs and a brute
+# force equivalent for the reference, both called with the venues and query of a case
+FILTERS = {
+    "near": (
+        lambda venues, query: filter_venues_by_distance(
+            venues, query["latitude"], query["longitude"], query["radius_km"]
+        ),
+        near_brute_force,
+    ),
+    "at": (
+        lambda venues, query: filter_venues_by_availability(
+            venues, query["minutes"], query["party_size"]
+        ),
+        at_brute_force,
+    ),
+}
+
+# Centres for the near filter, including ones where the grid can't bound a search box
+FUZZ_CENTRES = [(51.5, -0.12), (89.95, 10.0), (-0.5, 179.95)]
+
+
+def engine_pair(engine_name: str, case: Dict[str, Any]) -> Tuple[Callable, Callable]:
+    """Finds the engine to check and the reference to check it against, for a case.
+
+    Args:
+        engine_name (str): Name of an engine in ENGINES, or a filter in FILTERS.
+        case (Dict[str, Any]): Case from generate_case.
+
+    Returns:
+        Tuple[Callable, Callable]: Engine and reference, each called with the names, users and
+        venues of the case.
+    """
+    if engine_name not in FILTERS:
+        return ENGINES[engine_name], pick_venues
+    indexed_filter, brute_force_filter = FILTERS[engine_name]
+    query = case["query"]
+    return (
+        lambda names, users, venues: pick_venues(names, users, indexed_filter(venues, query)),
+        lambda names, users, venues: pick_venues(names, users, brute_force_filter(venues, query)),
+    )
+
+
+def generate_case(rng: random.Random) -> Dict[str, Any]:
+    """Generates a small random dataset and group, favouring edge cases - users with no
+    drinks or banned foods, terms repeated within a list, venues with no food or drinks, users
+    or venues sharing a name, and groups of nobody, everybody, or the same user twice. Venues
+    may have coordinates, opening hours and a capacity, for a query of the FILTERS to match.
+
+    Args:
+        rng (random.Random): Seeded random number generator.
+
+    Returns:
+        Dict[str, Any]: Case with 'users', 'venues', 'names' and 'query' keys.
+    """
+    foods = [f"food {number}" for number in range(rng.randint(1, 6))]
+    drinks = [f"drink {number}" for number in range(rng.randint(1, 6))]
+
+    def terms(vocabulary: List[str], most: int) -> List[str]:
+        # Drawn with replacement, so terms may repeat
+        return [rng.choice(vocabulary) for _ in range(rng.randint(0, most))]
+
+    users = [
+        {"name": f"User {number}", "wont_eat": terms(foods, 4), "drinks": terms(drinks, 3)}
+        for number in range(rng.randint(0, 6))
+    ]
+    venues = [
+        {"name": f"Venue {number}", "food": terms(foods, 4), "drinks": terms(drinks, 4)}
+        for number in range(rng.randint(0, 8))
+    ]
+    # Records sharing a name are allowed, with the last user of a name giving its details
+    for records in (users, venues):
+        for position in range(1, len(records)):
+            if rng.random() < 0.15:
+                records[position]["name"] = records[rng.randrange(position)]["name"]
+
+    latitude, longitude = rng.choice(FUZZ_CENTRES)
+    # Hours on the hour, so venues often open or close at exactly the query's time
+    hours = [format_time(hour * 60) for hour in range(25)]
+    for venue in venues:
+        if rng.random() < 0.7:
+            venue["latitude"] = max(-90.0, min(90.0, latitude + rng.uniform(-0.2, 0.2)))
+            venue["longitude"] = max(-180.0, min(180.0, longitude + rng.uniform(-0.2, 0.2)))
+        if rng.random() < 0.7:
+            venue["opening_hours"] = []
+            for _ in range(rng.randint(0, 2)):
+                opening, closing = rng.sample(hours[:-1], 2)
+                venue["opening_hours"].append([opening, "24:00" if closing == "00:00" else closing])
+        if rng.random() < 0.7:
+            venue["capacity"] = rng.randint(1, 8)
+    query = {
+        "latitude": latitude,
+        "longitude": longitude,
+        "radius_km": rng.choice([0.5, 5, 20, 50]),
+        "minutes": rng.choice([None, rng.randrange(MINUTES_PER_DAY), rng.randrange(24) * 60]),
+        "party_size": rng.choice([None, rng.randint(1, 8)]),
+    }
+
+    user_names = list(dict.fromkeys(user["name"] for user in users))
+    names = rng.sample(user_names, rng.randint(0, len(user_names)))
+    if names and rng.random() < 0.1:
+        names.append(names[0])
+    return {"users": users, "venues": venues, "names": names, "query": query}
+
+
+def sort_drink_reasons(reasons: List[str]) -> List[str]:
+    """Sorts the drink reasons at the end of a venue's reasons, leaving the food reasons before
+    them in order. Any food reason after a drink reason is sorted in with the drink reasons, so
+    still differs from the reference.
+
+    Args:
+        reasons (List[str]): Reasons a venue fails.
+
+    Returns:
+        List[str]: Reasons, with the drink reasons sorted.
+    """
+    first_drink = next(
+        (number for number, reason in enumerate(reasons) if reason.endswith(" to drink.")),
+        len(reasons),
+    )
+    return reasons[:first_drink] + sorted(reasons[first_drink:])
+
+
+def normalise(response: Dict[str, Any]) -> Dict[str, Any]:
+    """Puts a response into a canonical form for comparison. The order of places_to_visit,
+    and of each venue's drink reasons, comes from set iteration in the reference, so varies
+    with string hashing and is ignored. The order of places_to_avoid, and of each venue's food
+    reasons, which come before its drink reasons, is kept.
+
+    Args:
+        response (Dict[str, Any]): Output of create_response, or an equivalent.
+
+    Returns:
+        Dict[str, Any]: Canonical response.
+    """
+    return {
+        "places_to_visit": sorted(response["places_to_visit"]),
+        "places_to_avoid": [
+            {"name": failure["name"], "reasons": sort_drink_reasons(failure["reasons"])}
+            for failure in response["places_to_avoid"]
+        ],
+    }
+
+
+def run_engine(engine: Callable, case: Dict[str, Any]) -> Any:
+    """Runs a pick on a copy of a case, so that engines changing their input can't affect the
+    oracle, reporting exceptions as results.
+
+    Args:
+        engine (Callable): Engine or reference from engine_pair.
+        case (Dict[str, Any]): Case from generate_case.
+
+    Returns:
+        Any: Normalised response, or the text of the exception raised.
+    """
+    case = copy.deepcopy(case)
+    try:
+        return normalise(engine(case["names"], case["users"], case["venues"]))
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+
+
+def mismatches(case: Dict[str, Any], engine_name: str) -> bool:
+    """Checks whether an engine's output differs from pick_venues on a case.
+
+    Args:
+        case (Dict[str, Any]): Case from generate_case.
+        engine_name (str): Name of the engine in ENGINES, or a filter in FILTERS.
+
+    Returns:
+        bool: Whether the outputs differ.
+    """
+    engine, reference = engine_pair(engine_name, case)
+    return run_engine(engine, case) != run_engine(reference, case)
+
+
+def smaller_cases(case: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Generates cases one step smaller than a case - with a venue, user, group member or
+    single term removed.
+
+    Args:
+        case (Dict[str, Any]): Case from generate_case.
+
+    Returns:
+        Iterator[Dict[str, Any]]: Smaller cases, biggest removals first.
+    """
+    for position in range(len(case["venues"])):
+        yield {**case, "venues": case["venues"][:position] + case["venues"][position + 1 :]}
+    for position in range(len(case["users"])):
+        users = case["users"][:position] + case["users"][position + 1 :]
+        # Names stay in the group while another record has them
+        user_names = {user["name"] for user in users}
+        yield {
+            **case,
+            "users": users,
+            "names": [name for name in case["names"] if name in user_names],
+        }
+    for position in range(len(case["names"])):
+        yield {**case, "names": case["names"][:position] + case["names"][position + 1 :]}
+    for records in ("users", "venues"):
+        for record_position, record in enumerate(case[records]):
+            for key, terms in record.items():
+                if not isinstance(terms, list):
+                    continue
+                for position in range(len(terms)):
+                    smaller_record = {**record, key: terms[:position] + terms[position + 1 :]}
+                    smaller_records = list(case[records])
+                    smaller_records[record_position] = smaller_record
+                    yield {**case, records: smaller_records}
+
+
+def shrink_case(case: Dict[str, Any], engine_name: str) -> Dict[str, Any]:
+    """Shrinks a mismatching case greedily, taking any one step smaller case which still
+    mismatches, until no step smaller case does.
+
+    Args:
+        case (Dict[str, Any]): Case on which the engine mismatches pick_venues.
+        engine_name (str): Name of the engine in ENGINES, or a filter in FILTERS.
+
+    Returns:
+        Dict[str, Any]: Minimal mismatching case.
+    """
+    shrinking = True
+    while shrinking:
+        shrinking = False
+        for smaller_case in smaller_cases(case):
+            if mismatches(smaller_case, engine_name):
+                case = smaller_case
+                shrinking = True
+                break
+    return case
+
+
+def check_seed(task: tuple) -> List[Dict[str, Any]]:
+    """Generates the case for a seed and checks every engine against pick_venues on it, in a
+    worker process.
+
+    Args:
+        task (tuple): Seed, and names of the engines to check.
+
+    Returns:
+        List[Dict[str, Any]]: For each mismatching engine, the seed, the engine, the shrunk
+        case, and the expected and actual output on it.
+    """
+    seed, engine_names = task
+    case = generate_case(random.Random(seed))
+    failures = []
+    for engine_name in engine_names:
+        if mismatches(case, engine_name):
+            minimal_case = shrink_case(case, engine_name)
+            engine, reference = engine_pair(engine_name, minimal_case)
+            failures.append(
+                {
+                    "seed": seed,
+                    "engine": engine_name,
+                    "case": minimal_case,
+                    "expected": run_engine(reference, minimal_case),
+                    "actual": run_engine(engine, minimal_case),
+                }
+            )
+    return failures
+
+
+def fuzz(
+    case_count: int,
+    seed: int = 0,
+    engine_names: Optional[List[str]] = None,
+    workers: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Checks engines against pick_venues on many generated cases, spread over worker
+    processes. Each case is generated from its own seed, so any failure can be rerun alone.
+
+    Args:
+        case_count (int): Number of cases to generate.
+        seed (int): Seed of the first case, with later cases taking the following seeds.
+        engine_names (Optional[List[str]]): Engines in ENGINES or filters in FILTERS to check,
+        defaulting to all.
+        workers (Optional[int]): Number of worker processes, defaulting to the CPU count, or
+        1 to run in this process.
+
+    Returns:
+        List[Dict[str, Any]]: Failures, as reported by check_seed, in seed order.
+    """
+    engine_names = engine_names or list(ENGINES) + list(FILTERS)
+    tasks = [(case_seed, engine_names) for case_seed in range(seed, seed + case_count)]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        results = map(check_seed, tasks)
+        return [failure for failures in results for failure in failures]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(check_seed, tasks, chunksize=max(1, case_count // (workers * 8)))
+        return [failure for failures in results for failure in failures]
+
+
+if __name__ == "__main__":
+
+    try:
+        options, _ = getopt.getopt(
+            sys.argv[1:], "", ["cases=", "seed=", "engines=", "workers="]
+        )
+    except getopt.GetoptError as e:
+        print(f"Sorry, {e}.")
+        sys.exit(2)
+    options = dict(options)
+    engine_names = options["--engines"].split(",") if "--engines" in options else None
+    unknown_engines = set(engine_names or []) - set(ENGINES) - set(FILTERS)
+    if unknown_engines:
+        print(
+            f"Sorry, no such engines: {sorted(unknown_engines)}."
+            f" Choose from {list(ENGINES) + list(FILTERS)}."
+        )
+        sys.exit(2)
+
+    case_count = int(options.get("--cases", 1000))
+    failures = fuzz(
+        case_count,
+        int(options.get("--seed", 0)),
+        engine_names,
+        int(options["--workers"]) if "--workers" in options else None,
+    )
+    for failure in failures:
+        print(json.dumps(failure))
+    print(f"{len(failures)} mismatches in {case_count} cases", file=sys.stderr)
+    sys.exit(1 if failures else 0)
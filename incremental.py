@@ -0,0 +1,222 @@
+from typing import Dict, List, Any
+
+from engine import BitmaskEngine
+from cache import PickCache
+
+
+def insert_in_user_order(users: List[str], name: str, user_order: Dict[str, int]):
+    """Inserts a user name into a list of names kept in filtered_users order.
+
+    Args:
+        users (List[str]): Names, in filtered_users order.
+        name (str): Name to insert.
+        user_order (Dict[str, int]): Position of each name in filtered_users.
+    """
+    position = len(users)
+    while position > 0 and user_order[users[position - 1]] > user_order[name]:
+        position -= 1
+    users.insert(position, name)
+
+
+def remove_user_from_inverted_dict(
+    inverted_dict: Dict[str, List[str]], name: str, terms: List[str]
+):
+    """Removes a user from the entries of an inverted dict for the given terms, dropping
+    entries left with no users.
+
+    Args:
+        inverted_dict (Dict[str, List[str]]): Banned foods or preferred drinks dictionary.
+        name (str): Name of the user to remove.
+        terms (List[str]): Terms the user was listed against.
+    """
+    for term in set(terms):
+        if term not in inverted_dict:
+            continue
+        inverted_dict[term] = [user for user in inverted_dict[term] if user != name]
+        if len(inverted_dict[term]) == 0:
+            del inverted_dict[term]
+
+
+def apply_user_update(
+    user: Dict[str, Any],
+    filtered_users: Dict[str, Dict],
+    banned_foods_dict: Dict[str, List[str]],
+    preferred_drinks_dict: Dict[str, List[str]],
+):
+    """Applies a change to a selected user's banned foods or preferred drinks to the outputs of
+    filter_users_by_name, create_banned_foods_dict and create_preferred_drinks_dict in place,
+    touching only the entries of that user's old and new terms. Users not already selected
+    are ignored, as they do not appear in these structures.
+
+    Args:
+        user (Dict[str, Any]): Cleaned user dictionary with the new details.
+        filtered_users (Dict[str, Dict]): Dictionary of selected users and their details.
+        banned_foods_dict (Dict[str, List[str]]): Dictionary of banned foods: users banning them.
+        preferred_drinks_dict (Dict[str, List[str]]): Dictionary of preferred drinks: users
+        preferring them.
+    """
+    name = user["name"]
+    if name not in filtered_users:
+        return
+    user_order = {user_name: order for order, user_name in enumerate(filtered_users)}
+    for inverted_dict, key in (
+        (banned_foods_dict, "wont_eat"),
+        (preferred_drinks_dict, "drinks"),
+    ):
+        remove_user_from_inverted_dict(inverted_dict, name, filtered_users[name][key])
+        for term in user[key]:
+            insert_in_user_order(inverted_dict.setdefault(term, []), name, user_order)
+    filtered_users[name] = {"wont_eat": user["wont_eat"], "drinks": user["drinks"]}
+
+
+def apply_user_removal(
+    name: str,
+    filtered_users: Dict[str, Dict],
+    banned_foods_dict: Dict[str, List[str]],
+    preferred_drinks_dict: Dict[str, List[str]],
+):
+    """Removes a selected user from the outputs of filter_users_by_name,
+    create_banned_foods_dict and create_preferred_drinks_dict in place.
+
+    Args:
+        name (str): Name of the user to remove.
+        filtered_users (Dict[str, Dict]): Dictionary of selected users and their details.
+        banned_foods_dict (Dict[str, List[str]]): Dictionary of banned foods: users banning them.
+        preferred_drinks_dict (Dict[str, List[str]]): Dictionary of preferred drinks: users
+        preferring them.
+    """
+    if name not in filtered_users:
+        return
+    remove_user_from_inverted_dict(
+        banned_foods_dict, name, filtered_users[name]["wont_eat"]
+    )
+    remove_user_from_inverted_dict(
+        preferred_drinks_dict, name, filtered_users[name]["drinks"]
+    )
+    del filtered_users[name]
+
+
+def venue_is_listed(outcome: tuple) -> bool:
+    """Checks whether a venue outcome appears in a response, either as a place to visit or
+    as a place to avoid. Venues failing on food only because they serve no food have no
+    reasons, so appear in neither.
+
+    Args:
+        outcome (tuple): Output of BitmaskEngine.venue_outcome.
+
+    Returns:
+        bool: True if the venue is listed in the response.
+    """
+    passes_food, passes_drink, food_reasons, drink_reasons = outcome
+    return (passes_food and passes_drink) or bool(food_reasons or drink_reasons)
+
+
+class IncrementalPicker:
+    """Answers picks from a BitmaskEngine with cached responses, and applies small changes to
+    users and venues without rebuilding anything.
+
+    After each change only the cached responses it affects are dropped, to be recomputed on
+    their next pick. A user change affects groups including that user. A venue change affects
+    groups for which that venue's outcome - passing, or its failure reasons - has changed,
+    which is found by evaluating only that venue for each cached group.
+    """
+
+    def __init__(
+        self,
+        all_users: List[Dict[str, Any]],
+        all_venues: List[Dict[str, Any]],
+        cache_size: int = 1024,
+    ):
+        self.engine = BitmaskEngine(all_users, all_venues)
+        self.cache = PickCache(cache_size, data_version="incremental")
+
+    def pick(self, names: List[str]) -> Dict[str, Any]:
+        """Evaluates venues for the named users, reusing a cached response where still valid.
+
+        Args:
+            names (List[str]): Validated user names to evaluate venues for.
+
+        Returns:
+            Dict[str, Any]: Places to visit and places to avoid, with reasons.
+        """
+        return self.cache.get_or_pick(names, self.engine.pick)
+
+    def add_user(self, user: Dict[str, Any]):
+        """Adds a user, or updates them if the name already exists.
+
+        Args:
+            user (Dict[str, Any]): Cleaned user dictionary.
+        """
+        self.engine.add_user(user)
+        self.cache.invalidate_where(lambda names, response: user["name"] in names)
+
+    def update_user(self, user: Dict[str, Any]):
+        """Replaces the banned foods and preferred drinks of an existing user.
+
+        Args:
+            user (Dict[str, Any]): Cleaned user dictionary, named as an existing user.
+        """
+        self.engine.update_user(user)
+        self.cache.invalidate_where(lambda names, response: user["name"] in names)
+
+    def remove_user(self, name: str):
+        """Removes a user.
+
+        Args:
+            name (str): Name of the user to remove.
+        """
+        self.engine.remove_user(name)
+        self.cache.invalidate_where(lambda names, response: name in names)
+
+    def cached_venue_outcomes(self, position: int) -> Dict[frozenset, tuple]:
+        """Evaluates a single venue for every cached group.
+
+        Args:
+            position (int): Position of the venue.
+
+        Returns:
+            Dict[frozenset, tuple]: Venue outcome for each cached group's set of names.
+        """
+        return {
+            names: self.engine.venue_outcome(position, self.engine.select_users(names))
+            for names, _ in self.cache.entries
+        }
+
+    def add_venue(self, venue: Dict[str, Any]):
+        """Adds a venue after all existing venues.
+
+        Args:
+            venue (Dict[str, Any]): Cleaned venue dictionary.
+        """
+        self.engine.add_venue(venue)
+        new_outcomes = self.cached_venue_outcomes(len(self.engine.venue_names) - 1)
+        self.cache.invalidate_where(
+            lambda names, response: venue_is_listed(new_outcomes[names])
+        )
+
+    def update_venue(self, venue: Dict[str, Any]):
+        """Replaces the foods and drinks of an existing venue.
+
+        Args:
+            venue (Dict[str, Any]): Cleaned venue dictionary, named as an existing venue.
+        """
+        position = self.engine.venue_names.index(venue["name"])
+        old_outcomes = self.cached_venue_outcomes(position)
+        self.engine.update_venue(venue)
+        new_outcomes = self.cached_venue_outcomes(position)
+        self.cache.invalidate_where(
+            lambda names, response: old_outcomes[names] != new_outcomes[names]
+        )
+
+    def remove_venue(self, name: str):
+        """Removes an existing venue.
+
+        Args:
+            name (str): Name of the venue to remove.
+        """
+        position = self.engine.venue_names.index(name)
+        old_outcomes = self.cached_venue_outcomes(position)
+        self.engine.remove_venue(name)
+        self.cache.invalidate_where(
+            lambda names, response: venue_is_listed(old_outcomes[names])
+        )
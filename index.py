@@ -0,0 +1,350 @@
+import bisect
+import hashlib
+import json
+import os
+from typing import Dict, List, Any, Tuple, Optional
+
+from main import add_reasons
+
+INDEX_FORMAT_VERSION = 1
+
+
+def hash_file(file_path: str) -> str:
+    """Computes a SHA-256 hex digest of a file's contents, used to tell whether an index
+    built from that file is still current.
+
+    Args:
+        file_path (str): File path to hash.
+
+    Returns:
+        str: Hex digest of the file contents.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as source:
+        for block in iter(lambda: source.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class VenueIndex:
+    """Inverted index over venues, mapping each food and drink term to the venues offering it,
+    along with the number of distinct foods each venue serves.
+
+    Index entries hold a stable ID per venue rather than its position, so that removing a venue
+    needs no other entries renumbering. IDs are given out in venue order, so entries sorted by
+    ID are also in venue order. Saved indexes hold positions, as IDs only differ once venues
+    are removed.
+    """
+
+    def __init__(
+        self,
+        venue_names: List[str],
+        food_venues: Dict[str, List[int]],
+        drink_venues: Dict[str, List[int]],
+        food_counts: List[int],
+        source_hash: Optional[str] = None,
+    ):
+        self.venue_names = venue_names
+        self.food_venues = food_venues
+        self.drink_venues = drink_venues
+        self.food_counts = food_counts
+        self.source_hash = source_hash
+        # ID of the venue at each position, and the ID to give the next venue added
+        self.venue_ids = list(range(len(venue_names)))
+        self.next_venue_id = len(venue_names)
+
+    @classmethod
+    def build(
+        cls, all_venues: List[Dict[str, Any]], source_hash: Optional[str] = None
+    ) -> "VenueIndex":
+        """Builds an index from cleaned venue dictionaries.
+
+        Args:
+            all_venues (List[Dict[str, Any]]): List of dictionaries for all venues.
+            source_hash (Optional[str]): Hash of the file the venues were read from.
+
+        Returns:
+            VenueIndex: Index over the venues.
+        """
+        venue_names = []
+        food_venues = {}
+        drink_venues = {}
+        food_counts = []
+        for position, venue in enumerate(all_venues):
+            venue_names.append(venue["name"])
+            foods = set(venue["food"])
+            food_counts.append(len(foods))
+            for food in foods:
+                food_venues.setdefault(food, []).append(position)
+            for drink in set(venue["drinks"]):
+                drink_venues.setdefault(drink, []).append(position)
+        return cls(venue_names, food_venues, drink_venues, food_counts, source_hash)
+
+    def add_venue(self, venue: Dict[str, Any]):
+        """Adds a venue to the index, after all existing venues.
+
+        Args:
+            venue (Dict[str, Any]): Cleaned venue dictionary.
+        """
+        position = len(self.venue_names)
+        self.venue_names.append(venue["name"])
+        self.food_counts.append(0)
+        self.venue_ids.append(self.next_venue_id)
+        self.next_venue_id += 1
+        self.index_venue_terms(position, venue)
+
+    def update_venue(
+        self, position: int, old_venue: Dict[str, Any], venue: Dict[str, Any]
+    ):
+        """Replaces the venue at a position, touching only the entries of its old and new terms.
+
+        Args:
+            position (int): Position of the venue in all_venues.
+            old_venue (Dict[str, Any]): Venue currently at that position.
+            venue (Dict[str, Any]): Cleaned venue dictionary to replace it with.
+        """
+        self.unindex_venue_terms(position, old_venue)
+        self.venue_names[position] = venue["name"]
+        self.index_venue_terms(position, venue)
+
+    def remove_venue(self, position: int, old_venue: Dict[str, Any]):
+        """Removes the venue at a position, touching only the entries of its terms. Later
+        venues move down a position, keeping their IDs.
+
+        Args:
+            position (int): Position of the venue in all_venues.
+            old_venue (Dict[str, Any]): Venue currently at that position.
+        """
+        self.unindex_venue_terms(position, old_venue)
+        del self.venue_names[position]
+        del self.food_counts[position]
+        del self.venue_ids[position]
+
+    def index_venue_terms(self, position: int, venue: Dict[str, Any]):
+        """Adds a venue's foods and drinks to the index entries.
+
+        Args:
+            position (int): Position of the venue in all_venues.
+            venue (Dict[str, Any]): Cleaned venue dictionary.
+        """
+        # The index no longer matches the file it was built from
+        self.source_hash = None
+        venue_id = self.venue_ids[position]
+        foods = set(venue["food"])
+        self.food_counts[position] = len(foods)
+        for food in foods:
+            bisect.insort(self.food_venues.setdefault(food, []), venue_id)
+        for drink in set(venue["drinks"]):
+            bisect.insort(self.drink_venues.setdefault(drink, []), venue_id)
+
+    def unindex_venue_terms(self, position: int, venue: Dict[str, Any]):
+        """Removes a venue's foods and drinks from the index entries.
+
+        Args:
+            position (int): Position of the venue in all_venues.
+            venue (Dict[str, Any]): Venue dictionary, as it was indexed.
+        """
+        venue_id = self.venue_ids[position]
+        for term_venues, terms in (
+            (self.food_venues, set(venue["food"])),
+            (self.drink_venues, set(venue["drinks"])),
+        ):
+            for term in terms:
+                venue_ids = term_venues[term]
+                del venue_ids[bisect.bisect_left(venue_ids, venue_id)]
+                if len(venue_ids) == 0:
+                    del term_venues[term]
+        self.food_counts[position] = 0
+        self.source_hash = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Converts the index to a JSON serializable dictionary.
+
+        Returns:
+            Dict[str, Any]: Serializable form of the index.
+        """
+        food_venues, drink_venues = self.food_venues, self.drink_venues
+        # Once venues have been removed, IDs no longer match positions
+        if self.next_venue_id != len(self.venue_ids):
+            positions = {venue_id: position for position, venue_id in enumerate(self.venue_ids)}
+            food_venues, drink_venues = (
+                {
+                    term: [positions[venue_id] for venue_id in venue_ids]
+                    for term, venue_ids in term_venues.items()
+                }
+                for term_venues in (self.food_venues, self.drink_venues)
+            )
+        return {
+            "version": INDEX_FORMAT_VERSION,
+            "source_hash": self.source_hash,
+            "venue_names": self.venue_names,
+            "food_venues": food_venues,
+            "drink_venues": drink_venues,
+            "food_counts": self.food_counts,
+        }
+
+    @classmethod
+    def from_dict(cls, index_dict: Dict[str, Any]) -> "VenueIndex":
+        """Re-creates an index from the output of to_dict.
+
+        Args:
+            index_dict (Dict[str, Any]): Serialized index.
+
+        Returns:
+            VenueIndex: Index over the venues.
+        """
+        assert (
+            index_dict["version"] == INDEX_FORMAT_VERSION
+        ), f"Got index format {index_dict['version']}, expected {INDEX_FORMAT_VERSION}"
+        return cls(
+            index_dict["venue_names"],
+            index_dict["food_venues"],
+            index_dict["drink_venues"],
+            index_dict["food_counts"],
+            index_dict["source_hash"],
+        )
+
+    def save(self, file_path: str):
+        """Writes the index to a JSON file.
+
+        Args:
+            file_path (str): File path to write the index to.
+        """
+        with open(file_path, "w") as output:
+            json.dump(self.to_dict(), output)
+
+    @classmethod
+    def load(cls, file_path: str) -> "VenueIndex":
+        """Reads an index from a JSON file written by save.
+
+        Args:
+            file_path (str): File path to read the index from.
+
+        Returns:
+            VenueIndex: Index over the venues.
+        """
+        with open(file_path, "r") as inputs:
+            return cls.from_dict(json.load(inputs))
+
+
+def load_or_build_venue_index(
+    venues_path: str, index_path: str, all_venues: List[Dict[str, Any]]
+) -> VenueIndex:
+    """Loads a saved venue index if it was built from the current contents of the venues file,
+    otherwise builds the index from the venues and saves it for future runs.
+
+    Args:
+        venues_path (str): File path of the venues JSON the venues were read from.
+        index_path (str): File path of the saved index.
+        all_venues (List[Dict[str, Any]]): Cleaned venues read from venues_path.
+
+    Returns:
+        VenueIndex: Index over the venues.
+    """
+    source_hash = hash_file(venues_path)
+    if os.path.exists(index_path):
+        try:
+            venue_index = VenueIndex.load(index_path)
+            if venue_index.source_hash == source_hash:
+                return venue_index
+        # A stale or unreadable index is rebuilt rather than treated as an error
+        except Exception:
+            pass
+    venue_index = VenueIndex.build(all_venues, source_hash)
+    venue_index.save(index_path)
+    return venue_index
+
+
+def evaluate_venues_for_food_suitability_indexed(
+    banned_foods_dict: Dict[str, List[str]],
+    venue_index: VenueIndex,
+    all_venues: List[Dict[str, Any]],
+    failing_venues_reasons_dict: Dict[str, Any],
+    filtered_users: Dict[str, Any],
+) -> Tuple[Dict[str, Any], List[str]]:
+    """Indexed equivalent of evaluate_venues_for_food_suitability. Counts how many of each
+    venue's foods are banned by walking the index entries of the banned foods only, and fails
+    venues where every food is banned. The venues are only read to write the failure reasons.
+
+    Args:
+        banned_foods_dict (Dict[str, List[str]]): Dictionary mapping banned foods to users banning them.
+        venue_index (VenueIndex): Index built over all_venues.
+        all_venues (List[Dict[str, Any]]): List of all available venues.
+        failing_venues_reasons_dict (Dict[str, Any]): Dictionary to hold failing venues and their reasons.
+        filtered_users (Dict[str, Any]): Dictionary of only relevant users.
+
+    Returns:
+        Tuple[Dict[str, Any], List[str]]: Outputs Dict of failing venues with reasons, and List
+        of passing venues.
+    """
+    banned_counts = [0] * venue_index.next_venue_id
+    for food in banned_foods_dict:
+        for venue_id in venue_index.food_venues.get(food, []):
+            banned_counts[venue_id] += 1
+
+    venues_food_pass = []
+    for position, venue_name in enumerate(venue_index.venue_names):
+        if banned_counts[venue_index.venue_ids[position]] < venue_index.food_counts[position]:
+            venues_food_pass.append(venue_name)
+            continue
+        add_reasons(
+            failing_venues_reasons_dict,
+            venue_name,
+            (
+                f"There is nothing for {user} to eat."
+                for food in all_venues[position]["food"]
+                for user in banned_foods_dict[food]
+            ),
+        )
+
+    return failing_venues_reasons_dict, venues_food_pass
+
+
+def evaluate_venues_for_drink_suitability_indexed(
+    preferred_drinks_dict: Dict[str, List[str]],
+    venue_index: VenueIndex,
+    failing_venues_reasons_dict: Dict[str, Any],
+    filtered_users: Dict[str, Any],
+) -> Tuple[Dict[str, Any], List[str]]:
+    """Indexed equivalent of evaluate_venues_for_drink_suitability. Unions the venues serving
+    each user's preferred drinks, and passes venues found in every user's union.
+
+    Args:
+        preferred_drinks_dict (Dict[str, List[str]]): Dictionary mapping preferred drinks
+        to users preferring them.
+        venue_index (VenueIndex): Index built over all venues.
+        failing_venues_reasons_dict (Dict[str, Any]): Dictionary to hold failing venues and their reasons.
+        filtered_users (Dict[str, Any]): Dictionary of only relevant users.
+
+    Returns:
+        Tuple[Dict[str, Any], List[str]]: Outputs Dict of failing venues with reasons, and List
+        of passing venues.
+    """
+    user_venues = {user: set() for user in filtered_users}
+    for drink, users in preferred_drinks_dict.items():
+        drink_venues = venue_index.drink_venues.get(drink, [])
+        for user in users:
+            user_venues[user].update(drink_venues)
+
+    # Count how many users have something to drink at each venue
+    satisfied_counts = [0] * venue_index.next_venue_id
+    for venues in user_venues.values():
+        for venue_id in venues:
+            satisfied_counts[venue_id] += 1
+
+    venues_drink_pass = []
+    for venue_id, venue_name in zip(venue_index.venue_ids, venue_index.venue_names):
+        if satisfied_counts[venue_id] == len(user_venues):
+            venues_drink_pass.append(venue_name)
+            continue
+        add_reasons(
+            failing_venues_reasons_dict,
+            venue_name,
+            (
+                f"There is nothing for {user} to drink."
+                for user, venues in user_venues.items()
+                if venue_id not in venues
+            ),
+        )
+
+    return failing_venues_reasons_dict, venues_drink_pass
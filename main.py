@@ -1,9 +1,32 @@
 import json
+import re
 import sys
 import getopt
 import copy
 from itertools import chain
-from typing import Dict, List, Any, Tuple
+from typing import (
+    Dict,
+    List,
+    Any,
+    Tuple,
+    Iterable,
+    Iterator,
+    NamedTuple,
+    Optional,
+    TextIO,
+    Union,
+)
+
+from instrument import PROFILER, count_reasons
+from names import NameIndex
+
+
+# Rosters up to this size are listed in full in error messages, larger ones are not
+ROSTER_DISPLAY_LIMIT = 20
+
+# Text from a JSON decoding error to the end of the buffer which may be a number or literal
+# cut short by the end of a chunk, so that reading more might complete it
+TRUNCATED_TOKEN = re.compile(r"[\w.+\-]*")
 
 
 def clean_input(
@@ -20,13 +43,105 @@ def clean_input(
         Dict[str, List[str]]: Cleaned dictionary.
     """
     for key in keys:
-        clean_values = [value.lower() for value in input_dict[key] if value is not ""]
+        clean_values = [value.lower() for value in input_dict[key] if value != ""]
         input_dict[key] = clean_values
     return input_dict
 
 
+def check_coordinates(input_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """Checks the optional latitude and longitude of a record, which must be given together,
+    as numbers of degrees within range. Records without either are left as they are.
+
+    Args:
+        input_dict (Dict[str, Any]): Record which may hold 'latitude' and 'longitude' keys.
+
+    Returns:
+        Dict[str, Any]: The record, with its coordinates as floats.
+    """
+    if "latitude" not in input_dict and "longitude" not in input_dict:
+        return input_dict
+    name = input_dict.get("name")
+    for key, limit in (("latitude", 90), ("longitude", 180)):
+        value = input_dict.get(key)
+        assert isinstance(value, (int, float)) and not isinstance(
+            value, bool
+        ), f"Record {name} has {key} {value!r}, expected a number of degrees"
+        assert -limit <= value <= limit, f"Record {name} has {key} {value}, out of range"
+        input_dict[key] = float(value)
+    return input_dict
+
+
+# Minutes in a day, the latest time opening hours can give
+MINUTES_PER_DAY = 24 * 60
+
+
+def parse_time(value: Any) -> int:
+    """Parses a time of day given as 'HH:MM', from '00:00' to '24:00'.
+
+    Args:
+        value (Any): Time of day.
+
+    Returns:
+        int: Minutes after midnight.
+    """
+    hours, _, minutes = value.partition(":") if isinstance(value, str) else ("", "", "")
+    assert (
+        hours.isascii() and hours.isdigit() and minutes.isascii() and minutes.isdigit()
+    ) and len(minutes) == 2, f"Got time {value!r}, expected 'HH:MM'"
+    total = int(hours) * 60 + int(minutes)
+    assert int(minutes) < 60 and total <= MINUTES_PER_DAY, f"Got time {value!r}, out of range"
+    return total
+
+
+def format_time(minutes: int) -> str:
+    """Formats minutes after midnight as a time of day, 'HH:MM'.
+
+    Args:
+        minutes (int): Minutes after midnight, up to MINUTES_PER_DAY.
+
+    Returns:
+        str: Time of day.
+    """
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def check_availability(input_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """Checks the optional opening hours and seating capacity of a record. Opening hours are a
+    list of ['HH:MM', 'HH:MM'] opening and closing times, each day, where a closing time
+    earlier than the opening time is after midnight. Capacity is a positive whole number of
+    seats. Records without either are left as they are.
+
+    Args:
+        input_dict (Dict[str, Any]): Record which may hold 'opening_hours' and 'capacity' keys.
+
+    Returns:
+        Dict[str, Any]: The record, with its times written as 'HH:MM'.
+    """
+    name = input_dict.get("name")
+    if "opening_hours" in input_dict:
+        opening_hours = input_dict["opening_hours"]
+        assert isinstance(opening_hours, list) and all(
+            isinstance(interval, list) and len(interval) == 2 for interval in opening_hours
+        ), f"Record {name} has opening_hours {opening_hours!r}, expected ['HH:MM', 'HH:MM'] pairs"
+        clean_hours = []
+        for opening, closing in opening_hours:
+            opening_minutes, closing_minutes = parse_time(opening), parse_time(closing)
+            assert (
+                opening_minutes % MINUTES_PER_DAY != closing_minutes % MINUTES_PER_DAY
+            ), f"Record {name} opens and closes at {opening}, use '00:00' to '24:00' for all day"
+            clean_hours.append([format_time(opening_minutes), format_time(closing_minutes)])
+        input_dict["opening_hours"] = clean_hours
+    if "capacity" in input_dict:
+        capacity = input_dict["capacity"]
+        assert (
+            isinstance(capacity, int) and not isinstance(capacity, bool) and capacity > 0
+        ), f"Record {name} has capacity {capacity!r}, expected a positive whole number"
+    return input_dict
+
+
+@PROFILER.timed()
 def retrieve_json_from_file(
-    file_path: str, keys: List[str], expected_record_count: int
+    file_path: str, keys: List[str], expected_record_count: Optional[int]
 ) -> List[Dict]:
     """Reads list of JSON objects into a list of dictionaries, and applies lower casing and record
     count checks.
@@ -34,7 +149,7 @@ def retrieve_json_from_file(
     Args:
         file_path (str): File path for JSON.
         keys (List[str]): List of keys in resulting dict requiring lower-casing.
-        expected_record_count (int): Expected records.
+        expected_record_count (Optional[int]): Expected records, or None to skip the check.
 
     Returns:
         List[Dict]: List of dictionaries.
@@ -45,13 +160,15 @@ def retrieve_json_from_file(
             # Lower case all food and drink names for consistency
             clean_data = []
             for row in data:
-                row = clean_input(row, keys)
+                row = check_availability(check_coordinates(clean_input(row, keys)))
                 clean_data.append(row)
             inputs.close()
             # Check record count against expected
             assert (
-                len(clean_data) == expected_record_count
+                expected_record_count is None
+                or len(clean_data) == expected_record_count
             ), f"Got {len(clean_data)} records, expected {expected_record_count}"
+            PROFILER.count("records_loaded", len(clean_data))
             return clean_data
     # Catch exceptions with data validation, or reading from input files
     except Exception as e:
@@ -59,21 +176,144 @@ def retrieve_json_from_file(
         sys.exit(2)
 
 
-def validate_args(acceptable_args: List[str], actual_args: List[str]) -> List[str]:
+def iter_json_records(inputs: TextIO, chunk_size: int = 65536) -> Iterator[Any]:
+    """Incrementally parses JSON objects from a file, reading it a chunk at a time. Accepts
+    either a single top-level JSON array of objects, or newline delimited JSON (NDJSON) with
+    one object per line. Only the current chunk and the object being parsed are held in memory,
+    and a malformed object raises as soon as it is read, rather than at the end of the file.
+
+    Args:
+        inputs (TextIO): Open file to read from.
+        chunk_size (int): Number of characters to read at a time.
+
+    Returns:
+        Iterator[Any]: Parsed objects, in file order.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    end_of_file = False
+    # None until the first character is seen, then whether the file is a JSON array
+    is_array = None
+    while True:
+        # Skip whitespace, plus the commas between array elements
+        separators = " \t\r\n," if is_array else " \t\r\n"
+        while position < len(buffer) and buffer[position] in separators:
+            position += 1
+        if position == len(buffer):
+            if end_of_file:
+                assert not is_array, "Unexpected end of file inside JSON array"
+                return
+            buffer = inputs.read(chunk_size)
+            position = 0
+            end_of_file = len(buffer) == 0
+            continue
+
+        if is_array is None:
+            is_array = buffer[position] == "["
+            if is_array:
+                position += 1
+            continue
+        if is_array and buffer[position] == "]":
+            return
+
+        try:
+            record, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError as e:
+            # Record may be split across chunks - read more and try again, unless the error is
+            # followed by more of the record, in which case more data can't fix it
+            truncated = e.msg.startswith("Unterminated string") or TRUNCATED_TOKEN.fullmatch(
+                buffer, e.pos
+            )
+            if end_of_file or not truncated:
+                raise
+            chunk = inputs.read(chunk_size)
+            end_of_file = len(chunk) == 0
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield record
+
+
+def stream_json_from_file(
+    file_path: str, keys: List[str], expected_record_count: Optional[int] = None
+) -> Iterator[Dict]:
+    """Streaming alternative to retrieve_json_from_file, which yields cleaned records one at a
+    time so that memory use does not grow with file size. Reads JSON arrays or NDJSON files.
+
+    Args:
+        file_path (str): File path for JSON or NDJSON.
+        keys (List[str]): List of keys in each dict requiring lower-casing.
+        expected_record_count (Optional[int]): Expected records, checked once the file is
+        exhausted, or None to skip the check.
+
+    Returns:
+        Iterator[Dict]: Cleaned dictionaries, in file order.
+    """
+    try:
+        record_count = 0
+        with open(file_path, "r") as inputs:
+            for row in iter_json_records(inputs):
+                record_count += 1
+                # Lower case all food and drink names for consistency
+                yield check_availability(check_coordinates(clean_input(row, keys)))
+        # Check record count against expected
+        assert (
+            expected_record_count is None or record_count == expected_record_count
+        ), f"Got {record_count} records, expected {expected_record_count}"
+    # Catch exceptions with data validation, or reading from input files
+    except Exception as e:
+        print(f"An error occurred reading file at file path {file_path}: {e}")
+        sys.exit(2)
+
+
+def describe_roster(name_index: NameIndex, arg: str = "") -> str:
+    """Describes the valid user names for an error message - the whole roster if small,
+    otherwise names close to the one given, and how to look names up.
+
+    Args:
+        name_index (NameIndex): Index of valid user names.
+        arg (str): Invalid name given, if any.
+
+    Returns:
+        str: Description of the names to choose from.
+    """
+    if len(name_index) <= ROSTER_DISPLAY_LIMIT:
+        return f"Choose from: {name_index.names}"
+    suggestions = name_index.suggest(arg) if arg else []
+    if suggestions:
+        return f"Did you mean one of: {suggestions}? Use --complete to look up other names"
+    return "Use --complete with the start of a name to look up names"
+
+
+@PROFILER.timed()
+def validate_args(
+    acceptable_args: Union[List[str], NameIndex], actual_args: List[str]
+) -> List[str]:
     """Validates that the command line arguments used to run the programme contain valid user
     names, against a list of acceptable options. Provides error message if not validated.
 
     Args:
-        acceptable_args (List[str]): List of valid user name options to check against.
+        acceptable_args (Union[List[str], NameIndex]): List of valid user name options to check
+        against, or a NameIndex built from them. A list is only indexed to describe the roster
+        in an error message.
         actual_args (List[str]): Args received when programme is run.
 
     Returns:
         List[str]: Validated args.
     """
-    #  If no args provided, print error prompt and exit
+    if isinstance(acceptable_args, NameIndex):
+        name_index = valid_names = acceptable_args
+        acceptable_args = name_index.names
+    else:
+        # Sorting a NameIndex only pays off for an error message, so a set will do until then
+        name_index = None
+        valid_names = set(acceptable_args)
+    #  If no args provided, print error prompt and exit
     if len(actual_args) == 0:
+        name_index = NameIndex(acceptable_args) if name_index is None else name_index
         print(
-            f"You must enter valid users to find venues for. Choose from: {acceptable_args} or\
+            f"You must enter valid users to find venues for. {describe_roster(name_index)} or\
              type 'everyone' to take the whole team - don't forget the single quotes!"
         )
         sys.exit(2)
@@ -84,15 +324,17 @@ def validate_args(acceptable_args: List[str], actual_args: List[str]) -> List[st
             actual_args = acceptable_args
             return actual_args
         # If arg is empty, or an invalid arg provided, print error prompt and exit
-        if len(arg) == 0 or arg not in acceptable_args:
+        if len(arg) == 0 or arg not in valid_names:
+            name_index = NameIndex(acceptable_args) if name_index is None else name_index
             print(
-                f"Sorry, that is not a valid user. Choose from: {acceptable_args} or type\
+                f"Sorry, {arg!r} is not a valid user. {describe_roster(name_index, arg)} or type\
                  'everyone' to take the whole team - don't forget the single quotes!"
             )
             sys.exit(2)
-        return actual_args
+    return actual_args
 
 
+@PROFILER.timed()
 def filter_users_by_name(
     names: List[str], users: List[Dict[str, Any]]
 ) -> Dict[str, Dict]:
@@ -115,6 +357,7 @@ def filter_users_by_name(
     return filtered_users
 
 
+@PROFILER.timed()
 def create_banned_foods_dict(
     desired_key: str,
     args: List[str],
@@ -152,6 +395,7 @@ def create_banned_foods_dict(
     return banned_foods_dict
 
 
+@PROFILER.timed()
 def create_preferred_drinks_dict(
     desired_key: str,
     args: Dict[str, Any],
@@ -189,11 +433,72 @@ def create_preferred_drinks_dict(
     return preferred_drinks_dict
 
 
+class Reason(NamedTuple):
+    """Lazy failure reason, which only builds its text when converted to a string.
+
+    Args:
+        user (str): Name of the user the venue fails for.
+        need (str): What the user has nothing of at the venue - 'eat' or 'drink'.
+    """
+
+    user: str
+    need: str
+
+    def __str__(self) -> str:
+        return f"There is nothing for {self.user} to {self.need}."
+
+
+# How the evaluate functions record failure reasons - as text, as Reason tuples to be
+# rendered later, or not at all
+REASON_MODES = ("text", "lazy", "none")
+
+
+def describe_reason(user: str, need: str, reasons: str = "text") -> Union[str, Reason]:
+    """Creates the reason a venue fails for a user.
+
+    Args:
+        user (str): Name of the user the venue fails for.
+        need (str): What the user has nothing of at the venue - 'eat' or 'drink'.
+        reasons (str): 'lazy' for a Reason, otherwise the reason text.
+
+    Returns:
+        Union[str, Reason]: Failure reason.
+    """
+    if reasons == "lazy":
+        return Reason(user, need)
+    return f"There is nothing for {user} to {need}."
+
+
+def add_reasons(
+    failing_venues_reasons_dict: Dict[str, Any],
+    venue_name: str,
+    new_reasons: Iterable[Union[str, Reason]],
+):
+    """Records reasons against a failing venue, skipping any already recorded. The venue is
+    only added to the dictionary if it ends up with at least one reason.
+
+    Args:
+        failing_venues_reasons_dict (Dict[str, Any]): Dictionary to hold failing venues and their reasons.
+        venue_name (str): Name of the failing venue.
+        new_reasons (Iterable[Union[str, Reason]]): Reasons the venue fails.
+    """
+    venue_reasons = failing_venues_reasons_dict.get(venue_name, [])
+    seen_reasons = set(venue_reasons)
+    for reason in new_reasons:
+        if reason not in seen_reasons:
+            seen_reasons.add(reason)
+            venue_reasons.append(reason)
+    if venue_reasons:
+        failing_venues_reasons_dict[venue_name] = venue_reasons
+
+
+@PROFILER.timed()
 def evaluate_venues_for_food_suitability(
     banned_foods_dict: Dict[str, List[str]],
     all_venues: List[Dict[str, Any]],
     failing_venues_reasons_dict: Dict[str, Any],
     filtered_users: Dict[str, Any],
+    reasons: str = "text",
 ) -> Tuple[List[Dict], List[str]]:
     """For each venue, checks if there are foods left to eat there after subtracting
     the banned foods for all relevant users. Outputs results of this evaluation.
@@ -203,39 +508,42 @@ def evaluate_venues_for_food_suitability(
         all_venues (List[Dict[str, Any]]): Dictionary of all available venues.
         failing_venues_reasons_dict (Dict[str, Any]): Dictionary to hold failing venues and their reasons.
         filtered_users (Dict[str, Any]): Dictionary of only relevant users.
+        reasons (str): One of REASON_MODES - 'none' skips building reasons, for callers
+        needing only the passing venues.
 
     Returns:
         Tuple[List[Dict], List[str]]: Outputs List of passing venues, and Dict of failing venues with
         reasons.
     """
+    assert reasons in REASON_MODES, f"Got reason mode {reasons}, expected one of {REASON_MODES}"
     venues_food_pass = []
     for venue in all_venues:
 
-        # Get list of foods available from current venue left over after subtracting the banned foods
-        acceptable_foods = [
-            food for food in venue["food"] if food not in list(banned_foods_dict.keys())
-        ]
-        # If no acceptable foods left after filtering, create reason and mark venue as failing on food
-        if len(acceptable_foods) == 0:
-            for food in venue["food"]:
-                for user in banned_foods_dict[food]:
-                    reason = f"There is nothing for {user} to eat."
-                    if venue["name"] not in list(failing_venues_reasons_dict.keys()):
-                        failing_venues_reasons_dict[venue["name"]] = []
-                    if reason not in failing_venues_reasons_dict[venue["name"]]:
-                        failing_venues_reasons_dict[venue["name"]].append(reason)
-        # Otherwise, mark venue as passing on food
-        else:
+        # Mark venue as passing on food if any of its foods is left after subtracting the banned foods
+        if any(food not in banned_foods_dict for food in venue["food"]):
             venues_food_pass.append(venue["name"])
+        # Otherwise, create reasons for the users banning its foods, unless reasons aren't wanted
+        elif reasons != "none":
+            add_reasons(
+                failing_venues_reasons_dict,
+                venue["name"],
+                (
+                    describe_reason(user, "eat", reasons)
+                    for food in venue["food"]
+                    for user in banned_foods_dict[food]
+                ),
+            )
 
     return failing_venues_reasons_dict, venues_food_pass
 
 
+@PROFILER.timed()
 def evaluate_venues_for_drink_suitability(
     preferred_drinks_dict: Dict[str, Any],
     all_venues: List[Dict[str, Any]],
     failing_venues_reasons_dict: Dict[str, Any],
     filtered_users: Dict[str, Any],
+    reasons: str = "text",
 ) -> Tuple[List[Dict], List[str]]:
     """For each venue, checks if all users will drink at least one of their drink options.
      Outputs results of this evaluation.
@@ -246,42 +554,61 @@ def evaluate_venues_for_drink_suitability(
         all_venues (List[Dict[str, Any]]): Dictionary of all available venues.
         failing_venues_reasons_dict (Dict[str, Any]): Dictionary to hold failing venues and their reasons.
         filtered_users (Dict[str, Any]): Dictionary of only relevant users.
+        reasons (str): One of REASON_MODES - 'none' skips building reasons, for callers
+        needing only the passing venues.
 
     Returns:
         Tuple[List[Dict], List[str]]: Outputs List of passing venues, and Dict of failing venues with
         reasons.
     """
+    assert reasons in REASON_MODES, f"Got reason mode {reasons}, expected one of {REASON_MODES}"
     venues_drink_pass = []
 
     for venue in all_venues:
-        # First filter out drinks that none of the users want to drink
-        venue_drinks = [
-            drink
-            for drink in venue["drinks"]
-            if drink in list(preferred_drinks_dict.keys())
-        ]
-        names = []
-        for drink in venue_drinks:
-            # Collect names of users happy with this venue's drinks options
-            names.append(preferred_drinks_dict[drink])
-        names_flattened = set(list(chain.from_iterable(names)))
+        # Collect names of users happy with this venue's drinks options, ignoring drinks
+        # that none of the users want to drink
+        names_flattened = set(
+            chain.from_iterable(
+                preferred_drinks_dict[drink]
+                for drink in venue["drinks"]
+                if drink in preferred_drinks_dict
+            )
+        )
         # If all relevant users are present in the list of names, then everyone is happy with
         # venue's drinks options - mark venue as passed on drinks
-        if len(names_flattened) == len(list(filtered_users.keys())):
+        if len(names_flattened) == len(filtered_users):
             venues_drink_pass.append(venue["name"])
-        # Otherwise, if we have drinkless users - create reason and mark venue as failed
-        else:
+        # Otherwise, if we have drinkless users - create reasons, unless reasons aren't wanted
+        elif reasons != "none":
             drinkless_users = set(list(filtered_users.keys())) - names_flattened
-            for user in drinkless_users:
-                reason = f"There is nothing for {user} to drink."
-                if venue["name"] not in list(failing_venues_reasons_dict.keys()):
-                    failing_venues_reasons_dict[venue["name"]] = []
-                if reason not in failing_venues_reasons_dict[venue["name"]]:
-                    failing_venues_reasons_dict[venue["name"]].append(reason)
+            add_reasons(
+                failing_venues_reasons_dict,
+                venue["name"],
+                (describe_reason(user, "drink", reasons) for user in drinkless_users),
+            )
 
     return failing_venues_reasons_dict, venues_drink_pass
 
 
+def render_reasons(venues_response: Dict[str, Any]) -> Dict[str, Any]:
+    """Converts any lazy Reasons in a response to their text, ready to be serialized.
+
+    Args:
+        venues_response (Dict[str, Any]): Output of create_response.
+
+    Returns:
+        Dict[str, Any]: Copy of the response with every reason as text.
+    """
+    return {
+        **venues_response,
+        "places_to_avoid": [
+            {**failure, "reasons": [str(reason) for reason in failure["reasons"]]}
+            for failure in venues_response["places_to_avoid"]
+        ],
+    }
+
+
+@PROFILER.timed()
 def create_response(
     venues_passing_food: List[str],
     venues_passing_drink: List[str],
@@ -308,32 +635,37 @@ def create_response(
 
     venues_response = {"places_to_visit": passing_venues, "places_to_avoid": failures}
 
-    venues_response_json = json.dumps(venues_response)
-
     return venues_response
 
 
-if __name__ == "__main__":
-
-    all_users = retrieve_json_from_file("./data/users.json", ["drinks", "wont_eat"], 7)
-
-    all_venues = retrieve_json_from_file("./data/venues.json", ["food", "drinks"], 9)
-
-    user_names = [user["name"] for user in all_users]
-
-    # Get command line args, ignoring the first term (filename)
-    args = sys.argv[1:]
+@PROFILER.timed()
+def evaluate_pick(
+    names: List[str],
+    all_users: List[Dict[str, Any]],
+    all_venues: List[Dict[str, Any]],
+    reasons: str = "text",
+) -> Tuple[Dict[str, List[Any]], List[str], List[str]]:
+    """Runs the full evaluation for the named users - filtering users, inverting their food and
+    drink preferences, and evaluating every venue on food then drink - without forming the output.
 
-    args = validate_args(user_names, args)
+    Args:
+        names (List[str]): Validated user names to evaluate venues for.
+        all_users (List[Dict[str, Any]]): List of dictionaries for all users.
+        all_venues (List[Dict[str, Any]]): List of dictionaries for all venues.
+        reasons (str): One of REASON_MODES.
 
-    filtered_users = filter_users_by_name(args, all_users)
+    Returns:
+        Tuple[Dict[str, List[Any]], List[str], List[str]]: Failing venues with reasons,
+        venues passing on food, and venues passing on drink.
+    """
+    filtered_users = filter_users_by_name(names, all_users)
 
     banned_foods_dict = create_banned_foods_dict(
-        "wont_eat", args, all_users, filtered_users
+        "wont_eat", names, all_users, filtered_users
     )
 
     preferred_drinks_dict = create_preferred_drinks_dict(
-        "drinks", args, all_users, filtered_users
+        "drinks", names, all_users, filtered_users
     )
 
     failing_venues_reasons_dict = {}
@@ -342,19 +674,355 @@ if __name__ == "__main__":
         failing_venues_reasons_dict,
         venues_passing_food,
     ) = evaluate_venues_for_food_suitability(
-        banned_foods_dict, all_venues, failing_venues_reasons_dict, filtered_users
+        banned_foods_dict,
+        all_venues,
+        failing_venues_reasons_dict,
+        filtered_users,
+        reasons,
     )
 
     (
         failing_venues_reasons_dict,
         venues_passing_drink,
     ) = evaluate_venues_for_drink_suitability(
-        preferred_drinks_dict, all_venues, failing_venues_reasons_dict, filtered_users
+        preferred_drinks_dict,
+        all_venues,
+        failing_venues_reasons_dict,
+        filtered_users,
+        reasons,
     )
 
-    response = create_response(
+    if PROFILER.enabled:
+        PROFILER.count("picks")
+        PROFILER.count("users_filtered", len(filtered_users))
+        PROFILER.count("venues_evaluated", len(all_venues))
+        PROFILER.count("reasons_generated", count_reasons(failing_venues_reasons_dict))
+
+    return failing_venues_reasons_dict, venues_passing_food, venues_passing_drink
+
+
+@PROFILER.timed()
+def pick_venues(
+    names: List[str],
+    all_users: List[Dict[str, Any]],
+    all_venues: List[Dict[str, Any]],
+    reasons: str = "text",
+) -> Dict[str, Any]:
+    """Runs the full evaluation for the named users with evaluate_pick, and forms the output.
+
+    Args:
+        names (List[str]): Validated user names to evaluate venues for.
+        all_users (List[Dict[str, Any]]): List of dictionaries for all users.
+        all_venues (List[Dict[str, Any]]): List of dictionaries for all venues.
+        reasons (str): One of REASON_MODES. With 'lazy', reasons are Reasons to be rendered by
+        render_reasons, and with 'none', places_to_avoid is left empty.
+
+    Returns:
+        Dict[str, Any]: Places to visit and places to avoid, with reasons.
+    """
+    (
+        failing_venues_reasons_dict,
+        venues_passing_food,
+        venues_passing_drink,
+    ) = evaluate_pick(names, all_users, all_venues, reasons)
+
+    return create_response(
         venues_passing_food, venues_passing_drink, failing_venues_reasons_dict
     )
 
+
+if __name__ == "__main__":
+
+    # Get command line args, ignoring the first term (filename), and any options before names
+    try:
+        option_list, args = getopt.getopt(
+            sys.argv[1:],
+            "",
+            [
+                "serve",
+                "port=",
+                "cache-size=",
+                "top=",
+                "max-attendance",
+                "must-attend=",
+                "profile",
+                "passing-only",
+                "store",
+                "workers=",
+                "near=",
+                "radius=",
+                "complete=",
+                "format=",
+                "output=",
+                "explain",
+                "watch",
+                "at=",
+                "party-size=",
+            ],
+        )
+    except getopt.GetoptError as e:
+        print(f"Sorry, {e}. Options must come before user names.")
+        sys.exit(2)
+    options = dict(option_list)
+
+    # With --profile, time each stage and count data sizes, and report them after the output
+    if "--profile" in options:
+        PROFILER.enabled = True
+
+    # Check the whole number options up front, so a bad value gets a message, not a traceback
+    for option, minimum, maximum in (
+        ("--port", 0, 65535),
+        ("--cache-size", 0, None),
+        ("--top", 1, None),
+        ("--workers", 1, None),
+    ):
+        if option in options:
+            try:
+                value = int(options[option])
+                assert value >= minimum and (maximum is None or value <= maximum)
+            except (AssertionError, ValueError):
+                upper = f" and at most {maximum}" if maximum is not None else ""
+                print(f"Sorry, {option} must be a whole number of at least {minimum}{upper}.")
+                sys.exit(2)
+
+    # --workers only shards the plain pick, so refuse the modes which would ignore it
+    if "--workers" in options:
+        ignored = [
+            option
+            for option in ("--serve", "--store", "--max-attendance", "--explain", "--top")
+            if option in options
+        ]
+        if ignored:
+            print(f"Sorry, --workers can't be used with {', '.join(ignored)}.")
+            sys.exit(2)
+
+    from output import (
+        OUTPUT_FORMATS,
+        iter_pick_json,
+        iter_response_json,
+        open_output,
+        write_pieces,
+    )
+
+    # With --format, choose between the indented JSON printed by default, compact JSON, or
+    # NDJSON with one entry per line. With --output, write it to a file rather than stdout
+    output_format = options.get("--format", "pretty")
+    if output_format not in OUTPUT_FORMATS:
+        print(f"Sorry, --format must be one of {list(OUTPUT_FORMATS)}.")
+        sys.exit(2)
+    output_path = options.get("--output")
+
+    # With --store, run the pick as queries on the SQLite store, importing the JSON files
+    # into it first if either has changed. The store has no coordinates, hours or capacities
+    if "--store" in options:
+        ignored = [
+            option
+            for option in ("--near", "--radius", "--at", "--party-size")
+            if option in options
+        ]
+        if ignored:
+            print(f"Sorry, {', '.join(ignored)} can't be used with --store.")
+            sys.exit(2)
+        from store import VenueStore, import_json, store_is_current
+
+        if not store_is_current(
+            "./data/venues.db", ["./data/users.json", "./data/venues.json"]
+        ):
+            import_json(
+                "./data/users.json", "./data/venues.json", "./data/venues.db", None, None
+            )
+        store = VenueStore("./data/venues.db")
+        args = validate_args(store.user_names(), args)
+        reasons = "none" if "--passing-only" in options else "text"
+        response = store.pick(args, reasons)
+        if reasons == "none":
+            del response["places_to_avoid"]
+        with open_output(output_path) as output:
+            write_pieces(iter_response_json(response, output_format), output)
+        if PROFILER.enabled:
+            print(json.dumps(PROFILER.report(), indent=3), file=sys.stderr)
+        sys.exit(0)
+
+    from snapshot import load_snapshot, snapshot_is_current
+
+    # The server answers for any group, so it has no one place or time to narrow venues by
+    if "--serve" in options:
+        ignored = [
+            option
+            for option in ("--near", "--radius", "--at", "--party-size")
+            if option in options
+        ]
+        if ignored:
+            print(f"Sorry, {', '.join(ignored)} can't be used with --serve.")
+            sys.exit(2)
+
+    # Use the compiled snapshot when it was compiled from the current JSON files, as it is
+    # faster to load
+    # Set when the JSON files are loaded, for picks with the indexes built while loading
+    team_data = None
+    using_snapshot = snapshot_is_current(
+        "./data/snapshot.bin", ["./data/users.json", "./data/venues.json"]
+    )
+    if using_snapshot:
+        all_users, all_venues = load_snapshot("./data/snapshot.bin")
+    else:
+        from pipeline import load_team_data
+
+        # Validate, clean and index each record as it is read, and report every problem at once
+        team_data = load_team_data("./data/users.json", "./data/venues.json")
+        if team_data.errors:
+            print(f"Found {len(team_data.errors)} problem(s) in the data files:")
+            print("\n".join(f"- {error}" for error in team_data.errors))
+            sys.exit(2)
+        all_users, all_venues = team_data.all_users, team_data.all_venues
+
+    # In server mode, keep the data loaded and answer POST /pick requests until interrupted
+    if "--serve" in options:
+        from server import serve
+        from cache import PickCache, hash_data_files
+
+        # The engine keeps the data loaded here, so cached responses only go out of date when
+        # --watch reloads whichever data file changes in the background and swaps it in. Until
+        # then they are keyed by the version of the files as loaded
+        data_paths = ("./data/users.json", "./data/venues.json")
+        cache = PickCache(
+            int(options.get("--cache-size", 1024)), data_version=hash_data_files(data_paths)
+        )
+        serve(
+            all_users,
+            all_venues,
+            port=int(options.get("--port", 8000)),
+            cache=cache,
+            watch_paths=data_paths if "--watch" in options else None,
+        )
+        sys.exit(0)
+
+    # With --near, only consider venues within --radius km (default 1) of the given latitude
+    # and longitude, plus any venues without coordinates. The snapshot stores a grid index
+    # over its venues, so it needn't be built again
+    if "--near" in options:
+        from spatial import filter_venues_by_distance
+
+        try:
+            latitude, longitude = (float(value) for value in options["--near"].split(","))
+            radius_km = float(options.get("--radius", 1))
+            # Comparisons with nan are all false, so it fails each of these
+            assert -90 <= latitude <= 90 and -180 <= longitude <= 180
+            assert 0 < radius_km < float("inf")
+        except (AssertionError, ValueError):
+            print("Sorry, give --near as 'latitude,longitude' and --radius in kilometres.")
+            sys.exit(2)
+        if using_snapshot:
+            from snapshot import load_grid_index
+
+            grid_index = load_grid_index("./data/snapshot.bin")
+        else:
+            grid_index = None
+        all_venues = filter_venues_by_distance(
+            all_venues, latitude, longitude, radius_km, grid_index
+        )
+
+    # With --at and --party-size, only consider venues open at that time of day ('HH:MM')
+    # with seats for that many, plus any venues without opening hours or a capacity. The
+    # snapshot stores an availability index over its venues, so unless --near has narrowed
+    # them it needn't be built again
+    if "--at" in options or "--party-size" in options:
+        from availability import filter_venues_by_availability
+
+        try:
+            minutes = parse_time(options["--at"]) if "--at" in options else None
+            party_size = int(options["--party-size"]) if "--party-size" in options else None
+            assert party_size is None or party_size > 0
+        except (AssertionError, ValueError):
+            print("Sorry, give --at as a time of day 'HH:MM' and --party-size as a number.")
+            sys.exit(2)
+        if using_snapshot and "--near" not in options:
+            from snapshot import load_availability_index
+
+            availability_index = load_availability_index("./data/snapshot.bin")
+        else:
+            availability_index = None
+        all_venues = filter_venues_by_availability(
+            all_venues, minutes, party_size, availability_index
+        )
+
+    user_names = NameIndex(user["name"] for user in all_users)
+
+    # With --complete, list the user names starting with the given text, one per line
+    if "--complete" in options:
+        print("\n".join(user_names.complete(options["--complete"])))
+        sys.exit(0)
+
+    args = validate_args(user_names, args)
+
+    # With --max-attendance, find the largest group of these users with a venue to go to
+    if "--max-attendance" in options:
+        from engine import BitmaskEngine
+        from solver import maximise_attendance
+
+        must_attend = [value for key, value in option_list if key == "--must-attend"]
+        must_attend = validate_args(user_names, must_attend) if must_attend else []
+        engine = BitmaskEngine(all_users, all_venues)
+        response = maximise_attendance(engine, args, must_attend)
+        if response is None:
+            print("Sorry, there is no venue which suits all of the must-attend users.")
+            sys.exit(2)
+    # With --explain, show the cheapest change which would make each failing venue pass
+    elif "--explain" in options:
+        from engine import BitmaskEngine
+        from explain import VenueExplainer
+
+        engine = BitmaskEngine(all_users, all_venues)
+        response = {"explanations": VenueExplainer(engine).explain(args)}
+    # With --top, rank venues by how well they suit the users and show only the best few
+    elif "--top" in options:
+        from engine import BitmaskEngine
+        from ranking import rank_venues
+
+        engine = BitmaskEngine(all_users, all_venues)
+        response = {"top_venues": rank_venues(engine, args, int(options["--top"]))}
+    # With --workers, evaluate shards of the venues on that many processes
+    elif "--workers" in options:
+        from parallel import pick_venues_parallel
+
+        reasons = "none" if "--passing-only" in options else "text"
+        response = pick_venues_parallel(
+            args, all_users, all_venues, int(options["--workers"]), reasons
+        )
+        if reasons == "none":
+            del response["places_to_avoid"]
+    # With --passing-only, skip working out why venues fail, and list only the places to visit
+    elif "--passing-only" in options:
+        response = pick_venues(args, all_users, all_venues, reasons="none")
+        del response["places_to_avoid"]
+    # In compact or NDJSON format, write each entry straight from the evaluation rather than
+    # building the response first, rendering lazy reasons only as they are written
+    elif output_format != "pretty":
+        (
+            failing_venues_reasons_dict,
+            venues_passing_food,
+            venues_passing_drink,
+        ) = evaluate_pick(args, all_users, all_venues, reasons="lazy")
+        response = None
+    # Answer from the indexes built while loading, unless the venues were narrowed down since
+    elif team_data is not None and all_venues is team_data.all_venues:
+        response = team_data.pick(args)
+    else:
+        response = pick_venues(args, all_users, all_venues)
+
     # Display output
-    print(json.dumps(response, indent=3))
+    if response is None:
+        pieces = iter_pick_json(
+            venues_passing_food,
+            venues_passing_drink,
+            failing_venues_reasons_dict,
+            output_format,
+        )
+    else:
+        pieces = iter_response_json(response, output_format)
+    with open_output(output_path) as output:
+        write_pieces(pieces, output)
+
+    # Report the profile on stderr, so the output above stays valid JSON
+    if PROFILER.enabled:
+        print(json.dumps(PROFILER.report(), indent=3), file=sys.stderr)
@@ -0,0 +1,259 @@
+from typing import Dict, List, Any, Iterable, Tuple
+
+from main import create_response, add_reasons, pick_venues
+
+# NumPy is optional - without it, picks fall back to the pure Python evaluate functions
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Most cells in each block of venues evaluated for drinks at once, bounding the memory a pick
+# takes whatever the number of venues
+BLOCK_CELLS = 1 << 22
+
+
+def build_term_columns(term_lists: Iterable[List[str]]) -> Dict[str, int]:
+    """Assigns a matrix column to each distinct term, in first-seen order.
+
+    Args:
+        term_lists (Iterable[List[str]]): Lists of food or drink terms.
+
+    Returns:
+        Dict[str, int]: Mapping of terms to column numbers.
+    """
+    columns = {}
+    for terms in term_lists:
+        for term in terms:
+            if term not in columns:
+                columns[term] = len(columns)
+    return columns
+
+
+def build_rows(term_lists: List[List[str]], columns: Dict[str, int]) -> Tuple[Any, Any]:
+    """Builds a sparse 0/1 matrix with a row per list of terms and a column per known term, in
+    compressed sparse row form - the column of every term, row after row, and the offset at
+    which each row's columns start.
+
+    Args:
+        term_lists (List[List[str]]): Lists of food or drink terms, one per row.
+        columns (Dict[str, int]): Mapping of terms to column numbers.
+
+    Returns:
+        Tuple[numpy.ndarray, numpy.ndarray]: Column numbers, and row offsets into them, with
+        a final offset marking the end of the last row.
+    """
+    offsets = np.zeros(len(term_lists) + 1, dtype=np.int64)
+    np.cumsum([len(terms) for terms in term_lists], out=offsets[1:])
+    indices = np.fromiter(
+        (columns[term] for terms in term_lists for term in terms),
+        dtype=np.int32,
+        count=int(offsets[-1]),
+    )
+    return indices, offsets
+
+
+def row_columns(matrix: Tuple[Any, Any], row: int) -> Any:
+    """Finds the columns set in one row of a sparse matrix from build_rows.
+
+    Args:
+        matrix (Tuple[numpy.ndarray, numpy.ndarray]): Column numbers and row offsets.
+        row (int): Row number.
+
+    Returns:
+        numpy.ndarray: Column numbers, in term order.
+    """
+    indices, offsets = matrix
+    return indices[offsets[row] : offsets[row + 1]]
+
+
+def dense_rows(matrix: Tuple[Any, Any], rows: List[int], column_count: int) -> Any:
+    """Builds a dense matrix of chosen rows of a sparse matrix from build_rows.
+
+    Args:
+        matrix (Tuple[numpy.ndarray, numpy.ndarray]): Column numbers and row offsets.
+        rows (List[int]): Row numbers to include, in order.
+        column_count (int): Number of columns.
+
+    Returns:
+        numpy.ndarray: Matrix of float32 flags, suitable for BLAS matrix products.
+    """
+    dense = np.zeros((len(rows), column_count), dtype=np.float32)
+    for number, row in enumerate(rows):
+        dense[number, row_columns(matrix, row)] = 1.0
+    return dense
+
+
+def dense_range(matrix: Tuple[Any, Any], start: int, stop: int, column_count: int) -> Any:
+    """Builds a dense matrix of a range of rows of a sparse matrix from build_rows.
+
+    Args:
+        matrix (Tuple[numpy.ndarray, numpy.ndarray]): Column numbers and row offsets.
+        start (int): First row number.
+        stop (int): Row number after the last.
+        column_count (int): Number of columns.
+
+    Returns:
+        numpy.ndarray: Matrix of float32 flags, suitable for BLAS matrix products.
+    """
+    indices, offsets = matrix
+    dense = np.zeros((stop - start, column_count), dtype=np.float32)
+    rows = np.repeat(np.arange(stop - start), np.diff(offsets[start : stop + 1]))
+    dense[rows, indices[offsets[start] : offsets[stop]]] = 1.0
+    return dense
+
+
+class MatrixEngine:
+    """Evaluates venues for food and drink suitability with array operations.
+
+    Users' banned foods and preferred drinks, and venues' foods and drinks, are held as sparse
+    0/1 matrices with a column per term. A pick counts the foods each venue has left after
+    removing the selected users' banned foods with one gather and one bincount, and finds which
+    selected users have a drink at each venue with a matrix product per block of venues, so
+    that no matrix grows with both the number of users and the number of venues.
+
+    Users are keyed by name in the same way as filter_users_by_name, so where a name is
+    repeated the details of its last record count, while the foods of every record count as
+    banned, as in create_banned_foods_dict.
+
+    MatrixEngine is a library backend, not used by main.py. When NumPy is not installed, pick
+    falls back to the pure Python evaluate functions in main.py.
+    """
+
+    def __init__(
+        self, all_users: List[Dict[str, Any]], all_venues: List[Dict[str, Any]]
+    ):
+        self.all_users = all_users
+        self.all_venues = all_venues
+        if np is None:
+            return
+
+        # Row of each name's last record, in the order names first appear
+        last_rows = {}
+        for row, user in enumerate(all_users):
+            last_rows[user["name"]] = row
+        self.user_names = list(last_rows)
+        self.user_rows = list(last_rows.values())
+        self.record_names = [user["name"] for user in all_users]
+        self.venue_names = [venue["name"] for venue in all_venues]
+
+        user_wont_eat = [user["wont_eat"] for user in all_users]
+        user_drinks = [user["drinks"] for user in all_users]
+        venue_foods = [venue["food"] for venue in all_venues]
+        venue_drinks = [venue["drinks"] for venue in all_venues]
+        self.food_columns = build_term_columns(user_wont_eat + venue_foods)
+        self.drink_columns = build_term_columns(user_drinks + venue_drinks)
+        self.user_food_matrix = build_rows(user_wont_eat, self.food_columns)
+        self.user_drink_matrix = build_rows(user_drinks, self.drink_columns)
+        self.venue_food_matrix = build_rows(venue_foods, self.food_columns)
+        self.venue_drink_matrix = build_rows(venue_drinks, self.drink_columns)
+        # Venue of each entry in the venue food matrix, to total the entries of each venue
+        self.venue_food_entries = np.repeat(
+            np.arange(len(all_venues)), np.diff(self.venue_food_matrix[1])
+        )
+
+    def evaluate(
+        self, names: List[str]
+    ) -> Tuple[Dict[str, List[str]], List[str], List[str]]:
+        """Evaluates all venues for the named users, producing the same intermediate results
+        as running evaluate_venues_for_food_suitability then evaluate_venues_for_drink_suitability.
+
+        Args:
+            names (List[str]): Validated user names to evaluate venues for.
+
+        Returns:
+            Tuple[Dict[str, List[str]], List[str], List[str]]: Failing venues with reasons,
+            venues passing on food, and venues passing on drink.
+        """
+        selected_names = set(names)
+        users = [
+            (name, row)
+            for name, row in zip(self.user_names, self.user_rows)
+            if name in selected_names
+        ]
+        venue_count = len(self.venue_names)
+
+        # Foods left at each venue = venue foods not banned by any record of a selected user
+        banned = np.zeros(len(self.food_columns), dtype=bool)
+        for row, name in enumerate(self.record_names):
+            if name in selected_names:
+                banned[row_columns(self.user_food_matrix, row)] = True
+        foods_left = np.bincount(
+            self.venue_food_entries,
+            weights=~banned[self.venue_food_matrix[0]],
+            minlength=venue_count,
+        )
+        # Reasons naming the users banning each food, from the details of their last records
+        food_reasons = {}
+        for name, row in users:
+            reason = f"There is nothing for {name} to eat."
+            for column in row_columns(self.user_food_matrix, row).tolist():
+                food_reasons.setdefault(column, []).append(reason)
+
+        # Drinks for each selected user at each venue = user drinks x venue drinks, a block of
+        # venues at a time
+        drink_column_count = len(self.drink_columns)
+        selected_drinks = dense_rows(
+            self.user_drink_matrix, [row for _, row in users], drink_column_count
+        )
+        block_size = max(1, BLOCK_CELLS // max(len(users), drink_column_count, 1))
+        failing_drink = np.zeros(venue_count, dtype=bool)
+        drink_failures = []
+        for start in range(0, venue_count, block_size):
+            stop = min(start + block_size, venue_count)
+            venue_drinks = dense_range(self.venue_drink_matrix, start, stop, drink_column_count)
+            drinkless = (selected_drinks @ venue_drinks.T) == 0.0
+            failing_drink[start:stop] = drinkless.any(axis=0)
+            for offset in np.flatnonzero(failing_drink[start:stop]).tolist():
+                drink_failures.append(
+                    (start + offset, np.flatnonzero(drinkless[:, offset]).tolist())
+                )
+
+        failing_venues_reasons_dict = {}
+        for position in np.flatnonzero(foods_left == 0.0).tolist():
+            add_reasons(
+                failing_venues_reasons_dict,
+                self.venue_names[position],
+                (
+                    reason
+                    for column in row_columns(self.venue_food_matrix, position).tolist()
+                    for reason in food_reasons.get(column, [])
+                ),
+            )
+        # Drink reasons are recorded after all food reasons, as in the original pipeline
+        drink_reasons = [f"There is nothing for {name} to drink." for name, _ in users]
+        for position, user_numbers in drink_failures:
+            add_reasons(
+                failing_venues_reasons_dict,
+                self.venue_names[position],
+                (drink_reasons[number] for number in user_numbers),
+            )
+
+        venues_passing_food = [
+            self.venue_names[position] for position in np.flatnonzero(foods_left > 0.0).tolist()
+        ]
+        venues_passing_drink = [
+            self.venue_names[position] for position in np.flatnonzero(~failing_drink).tolist()
+        ]
+        return failing_venues_reasons_dict, venues_passing_food, venues_passing_drink
+
+    def pick(self, names: List[str]) -> Dict[str, Any]:
+        """Evaluates all venues for the named users and forms the same output as create_response.
+
+        Args:
+            names (List[str]): Validated user names to evaluate venues for.
+
+        Returns:
+            Dict[str, Any]: Places to visit and places to avoid, with reasons.
+        """
+        if np is None:
+            return pick_venues(names, self.all_users, self.all_venues)
+        (
+            failing_venues_reasons_dict,
+            venues_passing_food,
+            venues_passing_drink,
+        ) = self.evaluate(names)
+        return create_response(
+            venues_passing_food, venues_passing_drink, failing_venues_reasons_dict
+        )
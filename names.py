@@ -0,0 +1,66 @@
+import bisect
+import difflib
+from typing import List, Iterable
+
+
+class NameIndex:
+    """Index over a roster of user names, built once, for checking names in constant time,
+    completing name prefixes, and suggesting names close to a misspelled one.
+
+    Prefixes and suggestions ignore case, so 'tom m' completes to 'Tom Mullen'.
+    """
+
+    def __init__(self, names: Iterable[str]):
+        # Roster order, with repeated names kept once
+        self.names = list(dict.fromkeys(names))
+        self.name_set = set(self.names)
+        # Case folded names, sorted, alongside the names they came from
+        folded = sorted((name.casefold(), name) for name in self.names)
+        self.folded_names = [folded_name for folded_name, _ in folded]
+        self.sorted_names = [name for _, name in folded]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.name_set
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def complete(self, prefix: str, limit: int = 10) -> List[str]:
+        """Finds names starting with a prefix, by binary search of the sorted names.
+
+        Args:
+            prefix (str): Start of a name, in any case.
+            limit (int): Most names to return.
+
+        Returns:
+            List[str]: Matching names, in alphabetical order.
+        """
+        folded_prefix = prefix.strip().casefold()
+        start = bisect.bisect_left(self.folded_names, folded_prefix)
+        matches = []
+        for position in range(start, min(start + limit, len(self.folded_names))):
+            if not self.folded_names[position].startswith(folded_prefix):
+                break
+            matches.append(self.sorted_names[position])
+        return matches
+
+    def suggest(self, name: str, limit: int = 5) -> List[str]:
+        """Suggests names close to one which isn't in the roster - names it is a prefix of
+        first, then the most similar names by edit similarity.
+
+        Args:
+            name (str): Misspelled or partial name.
+            limit (int): Most names to return.
+
+        Returns:
+            List[str]: Suggested names, best first.
+        """
+        suggestions = self.complete(name, limit) if name.strip() else []
+        folded_name = name.strip().casefold()
+        for folded_match in difflib.get_close_matches(
+            folded_name, self.folded_names, n=limit
+        ):
+            match = self.sorted_names[bisect.bisect_left(self.folded_names, folded_match)]
+            if match not in suggestions:
+                suggestions.append(match)
+        return suggestions[:limit]
@@ -0,0 +1,145 @@
+import json
+import sys
+from contextlib import nullcontext
+from typing import Dict, List, Any, ContextManager, Iterator, Optional, TextIO
+
+# orjson is optional - without it, output is encoded with the standard library
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# 'pretty' is the indented JSON main.py has always printed
+OUTPUT_FORMATS = ("pretty", "compact", "ndjson")
+
+
+def encode(value: Any) -> str:
+    """Encodes a value as compact JSON, with orjson if it is installed.
+
+    Args:
+        value (Any): JSON serializable value.
+
+    Returns:
+        str: Compact JSON text.
+    """
+    if orjson is not None:
+        return orjson.dumps(value).decode("utf-8")
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def encode_bytes(value: Any) -> bytes:
+    """Encodes a value as compact UTF-8 JSON, with orjson if it is installed, which produces
+    bytes directly.
+
+    Args:
+        value (Any): JSON serializable value.
+
+    Returns:
+        bytes: Compact JSON, UTF-8 encoded.
+    """
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def encode_failure(venue: str, reasons: List[Any]) -> str:
+    """Encodes a failing venue as it appears in places_to_avoid, rendering any lazy Reasons.
+
+    Args:
+        venue (str): Name of the failing venue.
+        reasons (List[Any]): Reasons it fails, as text or Reasons.
+
+    Returns:
+        str: Compact JSON text.
+    """
+    return encode({"name": venue, "reasons": [str(reason) for reason in reasons]})
+
+
+def iter_pick_json(
+    venues_passing_food: List[str],
+    venues_passing_drink: List[str],
+    failing_venues: Dict[str, List[Any]],
+    output_format: str,
+) -> Iterator[str]:
+    """Encodes the results of evaluating venues a piece at a time, giving the same output as
+    encoding create_response's result, without building it. The results themselves are
+    already held in full, so this saves the response and its JSON text, not the evaluation.
+
+    In 'compact' format the pieces join into one JSON object. In 'ndjson' format each piece is
+    a line holding one entry, e.g. {"places_to_visit": "Tally Joe"} or {"places_to_avoid":
+    {"name": "Fabrique", "reasons": [...]}}.
+
+    Args:
+        venues_passing_food (List[str]): Venues passing food evaluation.
+        venues_passing_drink (List[str]): Venues passing drink evaluation.
+        failing_venues (Dict[str, List[Any]]): Venues failing food and/or drink evaluation,
+        and their reasons, as text or Reasons.
+        output_format (str): 'compact' or 'ndjson'.
+
+    Returns:
+        Iterator[str]: Pieces of JSON text.
+    """
+    # Same places_to_visit order as create_response
+    passing_venues = list(set(venues_passing_food) & set(venues_passing_drink))
+    if output_format == "ndjson":
+        for venue in passing_venues:
+            yield f'{{"places_to_visit":{encode(venue)}}}\n'
+        for venue, reasons in failing_venues.items():
+            yield f'{{"places_to_avoid":{encode_failure(venue, reasons)}}}\n'
+        return
+
+    yield '{"places_to_visit":['
+    for number, venue in enumerate(passing_venues):
+        yield f",{encode(venue)}" if number else encode(venue)
+    yield '],"places_to_avoid":['
+    for number, (venue, reasons) in enumerate(failing_venues.items()):
+        yield f",{encode_failure(venue, reasons)}" if number else encode_failure(venue, reasons)
+    yield "]}\n"
+
+
+def iter_response_json(response: Dict[str, Any], output_format: str) -> Iterator[str]:
+    """Encodes an already built response, such as ranked venues, in an output format. In
+    'ndjson' format each item of a list is a line of its own, keyed by the list's name.
+
+    Args:
+        response (Dict[str, Any]): Response to encode.
+        output_format (str): One of OUTPUT_FORMATS.
+
+    Returns:
+        Iterator[str]: Pieces of JSON text.
+    """
+    if output_format == "pretty":
+        yield json.dumps(response, indent=3) + "\n"
+    elif output_format == "compact":
+        yield encode(response) + "\n"
+    else:
+        for key, value in response.items():
+            for item in value if isinstance(value, list) else [value]:
+                yield encode({key: item}) + "\n"
+
+
+def open_output(output_path: Optional[str]) -> ContextManager[TextIO]:
+    """Opens the file to write output to, closing it once written, or stdout if none given.
+
+    Args:
+        output_path (Optional[str]): File path to write to, or None for stdout.
+
+    Returns:
+        ContextManager[TextIO]: Context manager giving the open file or stream.
+    """
+    if output_path is None:
+        return nullcontext(sys.stdout)
+    return open(output_path, "w", encoding="utf-8")
+
+
+def write_pieces(pieces: Iterator[str], output: TextIO):
+    """Writes pieces of text to an output as they are produced.
+
+    Args:
+        pieces (Iterator[str]): Pieces of text.
+        output (TextIO): Open file or stream, e.g. sys.stdout.
+    """
+    for piece in pieces:
+        output.write(piece)
+    output.flush()
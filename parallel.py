@@ -0,0 +1,268 @@
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Any, Tuple, Optional
+
+from main import (
+    filter_users_by_name,
+    create_banned_foods_dict,
+    create_preferred_drinks_dict,
+    evaluate_venues_for_food_suitability,
+    evaluate_venues_for_drink_suitability,
+    create_response,
+    add_reasons,
+    REASON_MODES,
+)
+from instrument import PROFILER, count_reasons
+
+
+# Shards per worker, so that workers finishing early pick up more of the catalog
+SHARDS_PER_WORKER = 4
+
+# Venues inherited by forked workers, and the user-side structures of the latest pick each
+# worker has seen
+worker_state = {}
+
+
+def init_worker(all_venues: Optional[List[Dict[str, Any]]]):
+    """Stores the venues in a worker process when it starts.
+
+    Args:
+        all_venues (Optional[List[Dict[str, Any]]]): All venues, given only to forked workers,
+        which inherit them from the parent rather than having them sent.
+    """
+    worker_state["all_venues"] = all_venues
+    worker_state["pick"] = None
+
+
+def evaluate_shard(
+    shard: Tuple[int, bytes, int, int, Optional[List[Dict[str, Any]]]]
+) -> Tuple[Dict[str, List[str]], List[str], Dict[str, List[str]], List[str]]:
+    """Runs both evaluate functions over a shard of venues, in a worker process. Food and drink
+    failures are kept apart, so that they can be merged in the original pipeline's order.
+
+    Args:
+        shard (Tuple[int, bytes, int, int, Optional[List[Dict[str, Any]]]]): Number of the pick,
+        its pickled user-side structures, which each worker unpickles once per pick, start and
+        stop positions of the shard in all_venues, and its venues unless the worker already
+        holds all_venues.
+
+    Returns:
+        Tuple[Dict[str, List[str]], List[str], Dict[str, List[str]], List[str]]: Venues failing
+        on food with reasons, venues passing on food, venues failing on drink with reasons, and
+        venues passing on drink.
+    """
+    pick, pick_state, start, stop, venues = shard
+    if worker_state["pick"] != pick:
+        worker_state.update(pickle.loads(pick_state))
+        worker_state["pick"] = pick
+    if venues is None:
+        venues = worker_state["all_venues"][start:stop]
+    food_failures, venues_passing_food = evaluate_venues_for_food_suitability(
+        worker_state["banned_foods_dict"],
+        venues,
+        {},
+        worker_state["filtered_users"],
+        worker_state["reasons"],
+    )
+    drink_failures, venues_passing_drink = evaluate_venues_for_drink_suitability(
+        worker_state["preferred_drinks_dict"],
+        venues,
+        {},
+        worker_state["filtered_users"],
+        worker_state["reasons"],
+    )
+    return food_failures, venues_passing_food, drink_failures, venues_passing_drink
+
+
+def split_shards(venue_count: int, shard_count: int) -> List[Tuple[int, int]]:
+    """Splits venue positions into consecutive shards of near equal size.
+
+    Args:
+        venue_count (int): Number of venues.
+        shard_count (int): Number of shards to split into.
+
+    Returns:
+        List[Tuple[int, int]]: Start and stop positions of each non-empty shard, in order.
+    """
+    shard_size = max(1, -(-venue_count // max(1, shard_count)))
+    return [
+        (start, min(start + shard_size, venue_count))
+        for start in range(0, venue_count, shard_size)
+    ]
+
+
+class ShardPool:
+    """Process pool evaluating shards of one list of venues, kept open across picks so that
+    worker processes are started, and sent the venues, only once.
+
+    Worker processes are forked where the platform allows, so that they inherit the venues
+    rather than having each shard sent to them, and share the parent's string hashing, which
+    lists each venue's drinkless users in the same order as a serial run. The venues must not
+    be changed while the pool is open.
+    """
+
+    def __init__(self, all_venues: List[Dict[str, Any]], workers: Optional[int] = None):
+        self.all_venues = all_venues
+        self.workers = workers or os.cpu_count() or 1
+        forking = "fork" in multiprocessing.get_all_start_methods()
+        self.shards = [
+            (start, stop, None if forking else all_venues[start:stop])
+            for start, stop in split_shards(len(all_venues), self.workers * SHARDS_PER_WORKER)
+        ]
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("fork" if forking else None),
+            initializer=init_worker,
+            initargs=(all_venues if forking else None,),
+        )
+        self.picks = 0
+
+    def __enter__(self) -> "ShardPool":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Shuts down the worker processes."""
+        self.executor.shutdown()
+
+    def map(
+        self, pick_state: Dict[str, Any]
+    ) -> List[Tuple[Dict[str, List[str]], List[str], Dict[str, List[str]], List[str]]]:
+        """Evaluates every shard of the venues for one pick.
+
+        Args:
+            pick_state (Dict[str, Any]): User-side structures of the pick, keyed as evaluate_shard
+            reads them from worker_state.
+
+        Returns:
+            List[Tuple[Dict[str, List[str]], List[str], Dict[str, List[str]], List[str]]]: Result
+            of evaluate_shard for each shard, in venue order.
+        """
+        self.picks += 1
+        # Pickled once here, rather than once per shard by the executor
+        pick_state = pickle.dumps(pick_state)
+        return list(
+            self.executor.map(
+                evaluate_shard,
+                [
+                    (self.picks, pick_state, start, stop, venues)
+                    for start, stop, venues in self.shards
+                ],
+            )
+        )
+
+
+@PROFILER.timed()
+def evaluate_venues_parallel(
+    banned_foods_dict: Dict[str, List[str]],
+    preferred_drinks_dict: Dict[str, List[str]],
+    all_venues: List[Dict[str, Any]],
+    filtered_users: Dict[str, Dict],
+    workers: Optional[int] = None,
+    reasons: str = "text",
+    pool: Optional[ShardPool] = None,
+) -> Tuple[Dict[str, List[str]], List[str], List[str]]:
+    """Runs the food and drink evaluate functions over shards of the venues on a process pool,
+    and merges the results into exactly what running them in turn over all venues gives - food
+    failures in venue order, then drink reasons added to those and to further failing venues.
+
+    Args:
+        banned_foods_dict (Dict[str, List[str]]): Dictionary of banned foods: users banning them.
+        preferred_drinks_dict (Dict[str, List[str]]): Dictionary of preferred drinks: users
+        preferring them.
+        all_venues (List[Dict[str, Any]]): List of dictionaries for all venues.
+        filtered_users (Dict[str, Dict]): Dictionary of selected users and their details.
+        workers (Optional[int]): Number of worker processes, defaulting to the CPU count.
+        Ignored when given a pool.
+        reasons (str): One of REASON_MODES - 'none' skips building reasons.
+        pool (Optional[ShardPool]): Open pool over all_venues, to reuse across picks. Without
+        one, a pool is started for this pick alone.
+
+    Returns:
+        Tuple[Dict[str, List[str]], List[str], List[str]]: Failing venues with reasons,
+        venues passing on food, and venues passing on drink.
+    """
+    assert reasons in REASON_MODES, f"Got reason mode {reasons}, expected one of {REASON_MODES}"
+    pick_state = {
+        "banned_foods_dict": banned_foods_dict,
+        "preferred_drinks_dict": preferred_drinks_dict,
+        "filtered_users": filtered_users,
+        "reasons": reasons,
+    }
+    if pool is None:
+        with ShardPool(all_venues, workers) as pool:
+            shard_results = pool.map(pick_state)
+    else:
+        assert pool.all_venues is all_venues, "The pool was opened over other venues"
+        shard_results = pool.map(pick_state)
+
+    failing_venues_reasons_dict = {}
+    venues_passing_food = []
+    venues_passing_drink = []
+    for food_failures, shard_passing_food, _, shard_passing_drink in shard_results:
+        for name, venue_reasons in food_failures.items():
+            add_reasons(failing_venues_reasons_dict, name, venue_reasons)
+        venues_passing_food.extend(shard_passing_food)
+        venues_passing_drink.extend(shard_passing_drink)
+    for _, _, drink_failures, _ in shard_results:
+        for name, venue_reasons in drink_failures.items():
+            add_reasons(failing_venues_reasons_dict, name, venue_reasons)
+    return failing_venues_reasons_dict, venues_passing_food, venues_passing_drink
+
+
+@PROFILER.timed()
+def pick_venues_parallel(
+    names: List[str],
+    all_users: List[Dict[str, Any]],
+    all_venues: List[Dict[str, Any]],
+    workers: Optional[int] = None,
+    reasons: str = "text",
+    pool: Optional[ShardPool] = None,
+) -> Dict[str, Any]:
+    """Parallel equivalent of pick_venues, building the user-side structures once in this
+    process and evaluating shards of the venues on a process pool.
+
+    Args:
+        names (List[str]): Validated user names to evaluate venues for.
+        all_users (List[Dict[str, Any]]): List of dictionaries for all users.
+        all_venues (List[Dict[str, Any]]): List of dictionaries for all venues.
+        workers (Optional[int]): Number of worker processes, defaulting to the CPU count.
+        reasons (str): One of REASON_MODES. With 'none', places_to_avoid is left empty.
+        pool (Optional[ShardPool]): Open pool over all_venues, to reuse across picks.
+
+    Returns:
+        Dict[str, Any]: Places to visit and places to avoid, with reasons.
+    """
+    filtered_users = filter_users_by_name(names, all_users)
+    banned_foods_dict = create_banned_foods_dict("wont_eat", names, all_users, filtered_users)
+    preferred_drinks_dict = create_preferred_drinks_dict(
+        "drinks", names, all_users, filtered_users
+    )
+
+    (
+        failing_venues_reasons_dict,
+        venues_passing_food,
+        venues_passing_drink,
+    ) = evaluate_venues_parallel(
+        banned_foods_dict,
+        preferred_drinks_dict,
+        all_venues,
+        filtered_users,
+        workers,
+        reasons,
+        pool,
+    )
+
+    if PROFILER.enabled:
+        PROFILER.count("picks")
+        PROFILER.count("users_filtered", len(filtered_users))
+        PROFILER.count("venues_evaluated", len(all_venues))
+        PROFILER.count("reasons_generated", count_reasons(failing_venues_reasons_dict))
+
+    return create_response(
+        venues_passing_food, venues_passing_drink, failing_venues_reasons_dict
+    )
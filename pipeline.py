@@ -0,0 +1,307 @@
+import bisect
+from typing import Dict, List, Any, Callable, Iterable, Optional, Set
+
+from main import (
+    check_coordinates,
+    check_availability,
+    iter_json_records,
+    evaluate_venues_for_food_suitability,
+    evaluate_venues_for_drink_suitability,
+    create_response,
+    REASON_MODES,
+)
+from instrument import PROFILER, count_reasons
+
+
+# Keys holding lists of food or drink terms in each kind of record
+USER_KEYS = ["wont_eat", "drinks"]
+VENUE_KEYS = ["food", "drinks"]
+
+
+class TeamData:
+    """Users and venues loaded in a single pass per record - each record is validated,
+    lower cased, stripped of empty terms, and has its terms interned and indexed as it is read.
+
+    Every validation problem is collected in errors rather than stopping at the first, so
+    that a bad file can be fixed in one go. Records with problems are left out.
+
+    The users are indexed from each food to the users banning it and each drink to the users
+    drinking it, so that a pick needs neither create_banned_foods_dict nor
+    create_preferred_drinks_dict, which scan a flattened list of every selected user's terms.
+
+    Users are keyed by name in the same way as filter_users_by_name, so where a name is
+    repeated the user keeps the position of its first appearance and the details of its last.
+    The foods of its earlier records are kept in shadowed_foods, as they are still keys of
+    create_banned_foods_dict, and so count as banned without any user to give as the reason.
+    """
+
+    def __init__(self):
+        self.all_users = []
+        self.all_venues = []
+        self.errors = []
+        # One string object per distinct term, shared by every record using it
+        self.terms = {}
+        # Each user's position, by order of first appearance, and their last record
+        self.user_positions = {}
+        self.user_names = []
+        self.user_details = {}
+        # Positions of the users listing each term, in ascending order
+        self.food_banners = {}
+        self.drink_drinkers = {}
+        # Positions of the users whose earlier records list each food
+        self.shadowed_foods = {}
+
+    def clean_terms(
+        self, record: Dict[str, Any], key: str, label: str
+    ) -> Optional[List[str]]:
+        """Validates, lower cases and interns the terms listed under a key of a record,
+        dropping empty ones.
+
+        Args:
+            record (Dict[str, Any]): Record being loaded.
+            key (str): Key of the list of terms.
+            label (str): Description of the record, for error messages.
+
+        Returns:
+            Optional[List[str]]: Cleaned terms, or None if the list is invalid.
+        """
+        values = record.get(key)
+        if not isinstance(values, list):
+            self.errors.append(f"{label} has {key} {values!r}, expected a list of strings")
+            return None
+        terms = self.terms
+        try:
+            return [terms.setdefault(value, value) for value in map(str.lower, values) if value]
+        # str.lower rejects anything but strings, so only look for the culprit when it does
+        except TypeError:
+            value = next(value for value in values if not isinstance(value, str))
+            self.errors.append(f"{label} has {value!r} in {key}, expected a string")
+            return None
+
+    def clean_record(
+        self, record: Any, keys: List[str], label: str
+    ) -> Optional[Dict[str, Any]]:
+        """Validates and cleans a user or venue record, collecting any problems in errors.
+
+        Args:
+            record (Any): Record as parsed from the file.
+            keys (List[str]): Keys of its lists of terms.
+            label (str): Description of the record, for error messages.
+
+        Returns:
+            Optional[Dict[str, Any]]: Cleaned record, or None if it has problems.
+        """
+        if not isinstance(record, dict):
+            self.errors.append(f"{label} is {record!r}, expected an object")
+            return None
+        error_count = len(self.errors)
+        name = record.get("name")
+        if not isinstance(name, str) or not name.strip():
+            self.errors.append(f"{label} has name {name!r}, expected a non-empty string")
+        for key in keys:
+            terms = self.clean_terms(record, key, label)
+            if terms is not None:
+                record[key] = terms
+        try:
+            check_availability(check_coordinates(record))
+        except AssertionError as e:
+            self.errors.append(f"{label}: {e}")
+        if len(self.errors) > error_count:
+            return None
+        return record
+
+    def add_user(self, user: Dict[str, Any]):
+        """Adds a cleaned user, and indexes their banned foods and drinks. A user with the name
+        of an earlier one replaces their details.
+
+        Args:
+            user (Dict[str, Any]): Cleaned user dictionary.
+        """
+        self.all_users.append(user)
+        name = user["name"]
+        position = self.user_positions.get(name)
+        if position is None:
+            position = self.user_positions[name] = len(self.user_names)
+            self.user_names.append(name)
+        else:
+            earlier = self.user_details[name]
+            for food in earlier["wont_eat"]:
+                self.shadowed_foods.setdefault(food, set()).add(position)
+            for food in earlier["wont_eat"]:
+                unindex_position(self.food_banners, food, position)
+            for drink in earlier["drinks"]:
+                unindex_position(self.drink_drinkers, drink, position)
+        self.user_details[name] = user
+        for food in user["wont_eat"]:
+            bisect.insort(self.food_banners.setdefault(food, []), position)
+        for drink in user["drinks"]:
+            bisect.insort(self.drink_drinkers.setdefault(drink, []), position)
+
+    def add_venue(self, venue: Dict[str, Any]):
+        """Adds a cleaned venue.
+
+        Args:
+            venue (Dict[str, Any]): Cleaned venue dictionary.
+        """
+        self.all_venues.append(venue)
+
+    def load_file(
+        self,
+        file_path: str,
+        keys: List[str],
+        expected_record_count: Optional[int],
+        add_record: Callable[[Dict[str, Any]], None],
+    ):
+        """Reads a JSON array or NDJSON file one record at a time, adding each valid record.
+
+        Args:
+            file_path (str): File path for JSON or NDJSON.
+            keys (List[str]): Keys of each record's lists of terms.
+            expected_record_count (Optional[int]): Expected records, or None to skip the check.
+            add_record (Callable[[Dict[str, Any]], None]): add_user or add_venue.
+        """
+        record_count = 0
+        try:
+            with open(file_path, "r") as inputs:
+                for record in iter_json_records(inputs):
+                    record_count += 1
+                    label = f"{file_path} record {record_count}"
+                    record = self.clean_record(record, keys, label)
+                    if record is not None:
+                        add_record(record)
+        # Unreadable files, or malformed JSON, end the file but not the load
+        except Exception as e:
+            self.errors.append(f"An error occurred reading file at file path {file_path}: {e}")
+            return
+        if expected_record_count is not None and record_count != expected_record_count:
+            self.errors.append(
+                f"{file_path} has {record_count} records, expected {expected_record_count}"
+            )
+        PROFILER.count("records_loaded", record_count)
+
+    def filter_users(self, names: Iterable[str]) -> Dict[str, Dict]:
+        """Equivalent of filter_users_by_name over the loaded users.
+
+        Args:
+            names (Iterable[str]): Validated user names.
+
+        Returns:
+            Dict[str, Dict]: Dictionary of selected users and their details.
+        """
+        names = set(names)
+        return {
+            name: {"wont_eat": user["wont_eat"], "drinks": user["drinks"]}
+            for name, user in self.user_details.items()
+            if name in names
+        }
+
+    def user_terms_dict(
+        self,
+        term_users: Dict[str, List[int]],
+        names: Iterable[str],
+        shadowed_terms: Optional[Dict[str, Set[int]]] = None,
+    ) -> Dict[str, List[str]]:
+        """Restricts one of the user indexes to the selected users, giving the same mapping as
+        create_banned_foods_dict or create_preferred_drinks_dict.
+
+        Args:
+            term_users (Dict[str, List[int]]): food_banners or drink_drinkers.
+            names (Iterable[str]): Validated user names.
+            shadowed_terms (Optional[Dict[str, Set[int]]]): shadowed_foods, to include the
+            foods of selected users' earlier records, mapped to no users.
+
+        Returns:
+            Dict[str, List[str]]: Terms mapped to the selected users listing them.
+        """
+        selected = {self.user_positions[name] for name in names if name in self.user_positions}
+        selected_terms = {}
+        for term, positions in term_users.items():
+            selected_users = [
+                self.user_names[position] for position in positions if position in selected
+            ]
+            if selected_users:
+                selected_terms[term] = selected_users
+        for term, positions in (shadowed_terms or {}).items():
+            if term not in selected_terms and not positions.isdisjoint(selected):
+                selected_terms[term] = []
+        return selected_terms
+
+    @PROFILER.timed()
+    def pick(self, names: List[str], reasons: str = "text") -> Dict[str, Any]:
+        """Equivalent of pick_venues over the loaded data, taking the selected users' banned
+        foods and preferred drinks from the indexes built while loading.
+
+        Args:
+            names (List[str]): Validated user names to evaluate venues for.
+            reasons (str): One of REASON_MODES, as for pick_venues.
+
+        Returns:
+            Dict[str, Any]: Places to visit and places to avoid, with reasons.
+        """
+        assert reasons in REASON_MODES, f"Got reason mode {reasons}, expected one of {REASON_MODES}"
+        filtered_users = self.filter_users(names)
+        banned_foods_dict = self.user_terms_dict(self.food_banners, names, self.shadowed_foods)
+        preferred_drinks_dict = self.user_terms_dict(self.drink_drinkers, names)
+        failing_venues_reasons_dict, venues_passing_food = evaluate_venues_for_food_suitability(
+            banned_foods_dict, self.all_venues, {}, filtered_users, reasons
+        )
+        failing_venues_reasons_dict, venues_passing_drink = evaluate_venues_for_drink_suitability(
+            preferred_drinks_dict,
+            self.all_venues,
+            failing_venues_reasons_dict,
+            filtered_users,
+            reasons,
+        )
+
+        if PROFILER.enabled:
+            PROFILER.count("picks")
+            PROFILER.count("users_filtered", len(filtered_users))
+            PROFILER.count("venues_evaluated", len(self.all_venues))
+            PROFILER.count("reasons_generated", count_reasons(failing_venues_reasons_dict))
+
+        return create_response(
+            venues_passing_food, venues_passing_drink, failing_venues_reasons_dict
+        )
+
+
+def unindex_position(term_users: Dict[str, List[int]], term: str, position: int):
+    """Removes a user's position from the list of users listing a term, dropping the term once
+    no user lists it.
+
+    Args:
+        term_users (Dict[str, List[int]]): food_banners or drink_drinkers.
+        term (str): Food or drink term.
+        position (int): Position of the user.
+    """
+    positions = term_users.get(term)
+    if positions is None:
+        return
+    # Positions are kept in order, so any repeats of this one sit together
+    start = bisect.bisect_left(positions, position)
+    del positions[start : bisect.bisect_right(positions, position, start)]
+    if not positions:
+        del term_users[term]
+
+
+@PROFILER.timed()
+def load_team_data(
+    users_path: str,
+    venues_path: str,
+    expected_user_count: Optional[int] = None,
+    expected_venue_count: Optional[int] = None,
+) -> TeamData:
+    """Loads, validates and indexes the users and venues files in one pass over each.
+
+    Args:
+        users_path (str): File path for the users JSON or NDJSON.
+        venues_path (str): File path for the venues JSON or NDJSON.
+        expected_user_count (Optional[int]): Expected users, or None to skip the check.
+        expected_venue_count (Optional[int]): Expected venues, or None to skip the check.
+
+    Returns:
+        TeamData: Loaded data, with any validation problems in its errors.
+    """
+    team_data = TeamData()
+    team_data.load_file(users_path, USER_KEYS, expected_user_count, team_data.add_user)
+    team_data.load_file(venues_path, VENUE_KEYS, expected_venue_count, team_data.add_venue)
+    return team_data
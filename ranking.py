@@ -0,0 +1,85 @@
+import heapq
+from typing import Dict, List, Any, Iterable, Iterator, Tuple
+
+from engine import BitmaskEngine, encode_terms, iter_bits
+from instrument import PROFILER
+
+
+def count_bits(mask: int) -> int:
+    """Counts the set bits of an integer bitset.
+
+    Args:
+        mask (int): Bitset to count.
+
+    Returns:
+        int: Number of set bits.
+    """
+    return bin(mask).count("1")
+
+
+def score_venues(
+    engine: BitmaskEngine, names: Iterable[str]
+) -> Iterator[Tuple[Tuple[int, int, int, int], int]]:
+    """Scores every venue for the named users, giving partial credit to failing venues.
+
+    Each score is a tuple compared in order: whether the venue passes on both food and drink,
+    how many users have something to drink there, how many foods are left after removing
+    everything the users won't eat, and how many users have more than one drink to choose from.
+
+    Args:
+        engine (BitmaskEngine): Engine built over all users and venues.
+        names (Iterable[str]): Validated user names to score venues for.
+
+    Returns:
+        Iterator[Tuple[Tuple[int, int, int, int], int]]: Score and position of each venue.
+    """
+    selected = engine.select_users(names)
+    banned = engine.banned_foods(selected)
+    user_drink_masks = [
+        encode_terms(engine.user_drinks[position]) for position in iter_bits(selected)
+    ]
+    user_count = len(user_drink_masks)
+
+    for position in range(len(engine.venue_names)):
+        foods_left = count_bits(engine.venue_food_masks[position] & ~banned)
+        users_with_drink = user_count - count_bits(
+            selected & ~engine.venue_drinker_masks[position]
+        )
+        users_with_choice = 0
+        if users_with_drink:
+            venue_drink_mask = encode_terms(engine.venue_drinks[position])
+            users_with_choice = sum(
+                1
+                for user_drink_mask in user_drink_masks
+                if count_bits(user_drink_mask & venue_drink_mask) > 1
+            )
+        passes = int(foods_left > 0 and users_with_drink == user_count)
+        yield (passes, users_with_drink, foods_left, users_with_choice), position
+
+
+@PROFILER.timed()
+def rank_venues(
+    engine: BitmaskEngine, names: Iterable[str], k: int = 5
+) -> List[Dict[str, Any]]:
+    """Finds the k best scoring venues for the named users, keeping a bounded heap of k
+    venues rather than sorting the whole catalog. Ties keep catalog order.
+
+    Args:
+        engine (BitmaskEngine): Engine built over all users and venues.
+        names (Iterable[str]): Validated user names to rank venues for.
+        k (int): Number of venues to return.
+
+    Returns:
+        List[Dict[str, Any]]: Best venues first, with the parts of their scores.
+    """
+    top_venues = heapq.nlargest(k, score_venues(engine, names), key=lambda scored: scored[0])
+    return [
+        {
+            "name": engine.venue_names[position],
+            "passes": bool(passes),
+            "users_with_drink": users_with_drink,
+            "foods_left": foods_left,
+            "users_with_choice_of_drinks": users_with_choice,
+        }
+        for (passes, users_with_drink, foods_left, users_with_choice), position in top_venues
+    ]
@@ -0,0 +1,164 @@
+import sys
+from array import array
+from typing import Dict, List, Any, Iterable, Iterator, Optional, Tuple
+
+
+class TermTable:
+    """Table of distinct food and drink terms, shared by compact records, which store each
+    term as its integer ID in the table. Each term is stored once, as an interned string.
+    """
+
+    def __init__(self):
+        self.terms = []
+        self.term_ids = {}
+
+    def intern(self, term: str) -> int:
+        """Finds the ID of a term, adding it to the table if new.
+
+        Args:
+            term (str): Cleaned term.
+
+        Returns:
+            int: ID of the term.
+        """
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            term_id = len(self.terms)
+            term = sys.intern(term)
+            self.terms.append(term)
+            self.term_ids[term] = term_id
+        return term_id
+
+    def encode(self, terms: Iterable[str]) -> array:
+        """Converts terms to a compact array of their IDs, in the same order.
+
+        Args:
+            terms (Iterable[str]): Cleaned terms.
+
+        Returns:
+            array: Term IDs, as unsigned ints.
+        """
+        return array("I", [self.intern(term) for term in terms])
+
+    def decode(self, term_ids: Iterable[int]) -> List[str]:
+        """Converts term IDs back to terms.
+
+        Args:
+            term_ids (Iterable[int]): Term IDs.
+
+        Returns:
+            List[str]: Terms, in the same order.
+        """
+        terms = self.terms
+        return [terms[term_id] for term_id in term_ids]
+
+
+class CompactRecord:
+    """Base of the compact user and venue records, which keep their lists of terms as arrays
+    of IDs in a shared TermTable instead of lists of strings.
+
+    Records can be read like the cleaned dictionaries from retrieve_json_from_file - e.g.
+    venue["food"] gives the list of food terms - so that the existing functions accept them.
+    Subclasses list the dictionary keys they hold as term ID arrays in TERM_KEYS, and any
+    optional keys, absent when None, in OPTIONAL_KEYS.
+    """
+
+    __slots__ = ("name", "term_table")
+    TERM_KEYS = {}
+    OPTIONAL_KEYS = ()
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "name":
+            return self.name
+        if key in self.TERM_KEYS:
+            return self.term_table.decode(getattr(self, self.TERM_KEYS[key]))
+        if key in self.OPTIONAL_KEYS and getattr(self, key) is not None:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key == "name" or key in self.TERM_KEYS or (
+            key in self.OPTIONAL_KEYS and getattr(self, key) is not None
+        )
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, (dict, CompactRecord)):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Reads a key as dict.get does."""
+        return self[key] if key in self else default
+
+    def keys(self) -> List[str]:
+        """Lists the keys the record holds, as in its cleaned dictionary."""
+        return [key for key in ("name", *self.TERM_KEYS, *self.OPTIONAL_KEYS) if key in self]
+
+    def items(self) -> List[Tuple[str, Any]]:
+        """Lists the keys the record holds, with their values."""
+        return [(key, self[key]) for key in self.keys()]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Converts the record back to a cleaned dictionary.
+
+        Returns:
+            Dict[str, Any]: Dictionary with the same keys and values.
+        """
+        return dict(self.items())
+
+
+class UserRecord(CompactRecord):
+    """Compact user, with the IDs of the foods they won't eat and the drinks they drink."""
+
+    __slots__ = ("wont_eat_ids", "drink_ids")
+    TERM_KEYS = {"wont_eat": "wont_eat_ids", "drinks": "drink_ids"}
+
+    def __init__(self, user: Dict[str, Any], term_table: TermTable):
+        self.name = user["name"]
+        self.term_table = term_table
+        self.wont_eat_ids = term_table.encode(user["wont_eat"])
+        self.drink_ids = term_table.encode(user["drinks"])
+
+
+class VenueRecord(CompactRecord):
+    """Compact venue, with the IDs of the foods and drinks it serves, and its optional
+    coordinates, opening hours and capacity."""
+
+    __slots__ = ("food_ids", "drink_ids", "latitude", "longitude", "opening_hours", "capacity")
+    TERM_KEYS = {"food": "food_ids", "drinks": "drink_ids"}
+    OPTIONAL_KEYS = ("latitude", "longitude", "opening_hours", "capacity")
+
+    def __init__(self, venue: Dict[str, Any], term_table: TermTable):
+        self.name = venue["name"]
+        self.term_table = term_table
+        self.food_ids = term_table.encode(venue["food"])
+        self.drink_ids = term_table.encode(venue["drinks"])
+        self.latitude = venue.get("latitude")
+        self.longitude = venue.get("longitude")
+        self.opening_hours = venue.get("opening_hours")
+        self.capacity = venue.get("capacity")
+
+
+def compact_records(
+    all_users: List[Dict[str, Any]],
+    all_venues: List[Dict[str, Any]],
+    term_table: Optional[TermTable] = None,
+) -> Tuple[List[UserRecord], List[VenueRecord]]:
+    """Converts cleaned users and venues to compact records sharing one term table.
+
+    Args:
+        all_users (List[Dict[str, Any]]): List of dictionaries for all users.
+        all_venues (List[Dict[str, Any]]): List of dictionaries for all venues.
+        term_table (Optional[TermTable]): Table to intern terms into, or None for a new one.
+
+    Returns:
+        Tuple[List[UserRecord], List[VenueRecord]]: Users and venues, in the same order.
+    """
+    term_table = term_table or TermTable()
+    return (
+        [UserRecord(user, term_table) for user in all_users],
+        [VenueRecord(venue, term_table) for venue in all_venues],
+    )
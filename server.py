@@ -0,0 +1,253 @@
+import asyncio
+import json
+from typing import Dict, List, Any, Tuple, Optional, Union
+
+from engine import BitmaskEngine
+from cache import PickCache
+from instrument import PROFILER
+from output import encode_bytes
+from watch import DataWatcher
+
+
+HTTP_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+# Largest request body accepted - a list of every user's name fits many times over
+MAX_BODY_BYTES = 1 << 20
+
+
+class PickServer:
+    """Asyncio HTTP service which loads users and venues once, keeps the evaluation structures
+    in memory, and answers POST /pick requests with the JSON that create_response builds.
+
+    The request body is either a JSON list of user names, or an object with a 'names' list,
+    e.g. {"names": ["Tom Mullen", "Rosie Curran"]}. 'everyone' selects all users. When given
+    a PickCache, repeated groups are answered from it, and GET /stats reports its counters.
+    GET /metrics reports stage timings, data size counters and cache sizes as Prometheus text
+    while PROFILER is enabled, and is not found otherwise.
+
+    Bodies over MAX_BODY_BYTES are refused with a 413 and the connection closed, and a pick
+    which raises is answered with a 500 rather than leaving the client waiting.
+    """
+
+    def __init__(
+        self,
+        all_users: List[Dict[str, Any]],
+        all_venues: List[Dict[str, Any]],
+        cache: Optional[PickCache] = None,
+    ):
+        self.engine = BitmaskEngine(all_users, all_venues)
+        self.cache = cache
+
+    def pick(self, body: bytes) -> Tuple[int, Dict[str, Any]]:
+        """Evaluates venues for the names in a request body.
+
+        Args:
+            body (bytes): Raw request body.
+
+        Returns:
+            Tuple[int, Dict[str, Any]]: HTTP status code, and response to send as JSON.
+        """
+        try:
+            request = json.loads(body)
+        except ValueError as e:
+            return 400, {"error": f"Request body is not valid JSON: {e}"}
+        names = request.get("names") if isinstance(request, dict) else request
+        if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+            return 400, {"error": "Request must give a list of user names."}
+        # Use one engine for the whole request, even if a reload swaps in another meanwhile
+        engine = self.engine
+        names, error = engine.resolve_names(names)
+        if error:
+            return 400, {"error": error}
+        if self.cache is None:
+            return 200, engine.pick(names)
+        return 200, self.cache.get_or_pick(names, engine.pick)
+
+    def swap(self, engine: BitmaskEngine, data_version: str):
+        """Replaces the engine with one built from reloaded data, and drops cached responses.
+
+        Args:
+            engine (BitmaskEngine): Engine built from the new data.
+            data_version (str): Version hash of the new data.
+        """
+        self.engine = engine
+        if self.cache is not None:
+            self.cache.set_data_version(data_version)
+
+    def metrics(self) -> str:
+        """Formats the profiler's stages and counters, and the cache counters, as Prometheus text.
+
+        Returns:
+            str: Metrics text.
+        """
+        gauges = {}
+        if self.cache is not None:
+            gauges = {
+                f"cache_{name}": value
+                for name, value in self.cache.stats().items()
+                if isinstance(value, int)
+            }
+        return PROFILER.to_prometheus(gauges=gauges)
+
+    def route(
+        self, method: str, path: str, body: bytes
+    ) -> Tuple[int, Union[Dict[str, Any], str]]:
+        """Dispatches a request to its handler.
+
+        Args:
+            method (str): HTTP method.
+            path (str): Request path, without any query string.
+            body (bytes): Raw request body.
+
+        Returns:
+            Tuple[int, Union[Dict[str, Any], str]]: HTTP status code, and response to send as
+            JSON, or as plain text if a string.
+        """
+        PROFILER.count("http_requests")
+        if path == "/metrics" and method == "GET":
+            if not PROFILER.enabled:
+                return 404, {"error": "Metrics are only collected when serving with --profile."}
+            return 200, self.metrics()
+        if path == "/stats" and method == "GET":
+            return 200, {"cache": self.cache.stats() if self.cache else None}
+        if path != "/pick":
+            return 404, {"error": f"No such path: {path}"}
+        if method != "POST":
+            return 405, {"error": "Use POST to pick venues."}
+        return self.pick(body)
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        """Serves HTTP/1.1 requests on a client connection until the client closes it, or asks
+        for it to be closed.
+
+        Args:
+            reader (asyncio.StreamReader): Stream to read requests from.
+            writer (asyncio.StreamWriter): Stream to write responses to.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    header_line = await reader.readline()
+                    if header_line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = header_line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                content_length = int(headers.get("content-length", 0))
+                if content_length > MAX_BODY_BYTES:
+                    # The body is left unread, so the connection can't be reused
+                    status, response = 413, {
+                        "error": f"Request body is over {MAX_BODY_BYTES} bytes."
+                    }
+                    headers["connection"] = "close"
+                else:
+                    body = await reader.readexactly(content_length)
+                    try:
+                        status, response = self.route(method, target.split("?")[0], body)
+                    except Exception as e:
+                        status, response = 500, {"error": f"Failed to answer request: {e}"}
+                if isinstance(response, str):
+                    payload = response.encode("utf-8")
+                    content_type = "text/plain; version=0.0.4"
+                else:
+                    payload = encode_bytes(response)
+                    content_type = "application/json"
+                keep_alive = (
+                    version == "HTTP/1.1"
+                    and headers.get("connection", "").lower() != "close"
+                )
+                writer.write(
+                    (
+                        f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+                        f"Content-Type: {content_type}\r\n"
+                        f"Content-Length: {len(payload)}\r\n"
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                    ).encode("latin-1")
+                    + payload
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        # Drop connections sending malformed requests, or closed mid-request
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8000) -> asyncio.AbstractServer:
+        """Starts listening for connections. Binds to localhost only, by default.
+
+        Args:
+            host (str): Host address to bind to.
+            port (int): Port to listen on, or 0 to pick a free port.
+
+        Returns:
+            asyncio.AbstractServer: Running server.
+        """
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+
+def serve(
+    all_users: List[Dict[str, Any]],
+    all_venues: List[Dict[str, Any]],
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    cache: Optional[PickCache] = None,
+    watch_paths: Optional[Tuple[str, str]] = None,
+    watch_interval: float = 1.0,
+):
+    """Runs a PickServer until interrupted.
+
+    Args:
+        all_users (List[Dict[str, Any]]): List of dictionaries for all users.
+        all_venues (List[Dict[str, Any]]): List of dictionaries for all venues.
+        host (str): Host address to bind to.
+        port (int): Port to listen on.
+        cache (Optional[PickCache]): Cache for repeated groups. When watching, it should not be
+        given the data paths itself, as its version is set as each reload is swapped in.
+        watch_paths (Optional[Tuple[str, str]]): Users and venues file paths the data was
+        loaded from, to reload them in the background whenever they change.
+        watch_interval (float): Seconds between checks of the watched files.
+    """
+
+    async def run():
+        pick_server = PickServer(all_users, all_venues, cache)
+        watcher = None
+        if watch_paths:
+            loop = asyncio.get_running_loop()
+            # Swap on the event loop, between requests, rather than on the watcher's thread
+            watcher = DataWatcher(
+                *watch_paths,
+                lambda engine, data_version: loop.call_soon_threadsafe(
+                    pick_server.swap, engine, data_version
+                ),
+                watch_interval,
+            )
+            watcher.prime(all_users, all_venues)
+            watcher.start()
+        server = await pick_server.start(host, port)
+        print(f"Serving venue picks on http://{host}:{port}/pick")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if watcher is not None:
+                watcher.stop()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,521 @@
+import gc
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Dict, List, Any, Optional, Tuple
+
+from main import stream_json_from_file, parse_time, format_time
+from instrument import PROFILER
+from index import hash_file
+from spatial import GridIndex
+from availability import AvailabilityIndex
+
+
+SNAPSHOT_MAGIC = b"VPSNAP5\x00"
+# Byte order the snapshot was written in - snapshots are a local cache, not an exchange format
+SNAPSHOT_BYTE_ORDER = sys.byteorder.encode().ljust(8, b"\x00")
+# Sections load_snapshot rebuilds the users and venues from
+RECORD_SECTIONS = [
+    "string_offsets",
+    "string_blob",
+    "user_names",
+    "user_wont_eat_offsets",
+    "user_wont_eat_ids",
+    "user_drinks_offsets",
+    "user_drinks_ids",
+    "venue_names",
+    "venue_food_offsets",
+    "venue_food_ids",
+    "venue_drinks_offsets",
+    "venue_drinks_ids",
+    "venue_coordinates",
+    "venue_capacities",
+    "venue_hours_offsets",
+    "venue_hours",
+]
+# Sections holding indexes over the venues, read only when a filter needs them
+INDEX_SECTIONS = [
+    "grid_cells",
+    "grid_offsets",
+    "grid_positions",
+    "segment_starts",
+    "segment_masks",
+    "capacities",
+    "capacity_masks",
+    "unlimited_mask",
+]
+# Size, modification time and content hash of each file the snapshot was compiled from, as JSON
+SOURCE_SECTIONS = ["sources"]
+SNAPSHOT_SECTIONS = RECORD_SECTIONS + INDEX_SECTIONS + SOURCE_SECTIONS
+# Array type of each section, or None for sections read as bytes, defaulting to unsigned ints
+SECTION_TYPECODES = {
+    "string_blob": None,
+    "venue_coordinates": "d",
+    "grid_cells": "i",
+    "segment_masks": None,
+    "capacity_masks": None,
+    "unlimited_mask": None,
+    "sources": None,
+}
+# Stored in place of the opening hours of venues without any - no time of day is this late
+NO_OPENING_HOURS = 0xFFFFFFFF
+# Magic, byte order, then an (offset, length in bytes) pair per section
+SNAPSHOT_HEADER = struct.Struct(f"<8s8s{2 * len(SNAPSHOT_SECTIONS)}Q")
+
+
+def encode_records(
+    records: List[Dict[str, Any]], keys: List[str], string_ids: Dict[str, int]
+) -> Dict[str, array]:
+    """Encodes records as an array of name IDs, plus an offsets array and a term IDs array
+    for each list valued key, interning names and terms into string_ids as it goes.
+
+    Args:
+        records (List[Dict[str, Any]]): Cleaned user or venue dictionaries.
+        keys (List[str]): Keys of the list values to encode, e.g. ['food', 'drinks'].
+        string_ids (Dict[str, int]): Mapping of strings to IDs, updated in place.
+
+    Returns:
+        Dict[str, array]: Arrays keyed 'names', and '<key>_offsets' and '<key>_ids' per key.
+    """
+    encoded = {"names": array("I")}
+    for key in keys:
+        encoded[f"{key}_offsets"] = array("I", [0])
+        encoded[f"{key}_ids"] = array("I")
+    for record in records:
+        encoded["names"].append(string_ids.setdefault(record["name"], len(string_ids)))
+        for key in keys:
+            for term in record[key]:
+                encoded[f"{key}_ids"].append(string_ids.setdefault(term, len(string_ids)))
+            encoded[f"{key}_offsets"].append(len(encoded[f"{key}_ids"]))
+    return encoded
+
+
+def fingerprint_sources(source_paths: List[str]) -> List[Dict[str, Any]]:
+    """Fingerprints the files a snapshot is compiled from, by size, modification time and
+    content hash.
+
+    Args:
+        source_paths (List[str]): File paths of the source JSON files.
+
+    Returns:
+        List[Dict[str, Any]]: Fingerprint of each file, in order.
+    """
+    fingerprints = []
+    for source_path in source_paths:
+        stat = os.stat(source_path)
+        fingerprints.append(
+            {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": hash_file(source_path),
+            }
+        )
+    return fingerprints
+
+
+def mask_bytes(mask: int, venue_count: int) -> bytes:
+    """Converts a bitset over venue positions to a fixed number of bytes.
+
+    Args:
+        mask (int): Bitset of venue positions.
+        venue_count (int): Number of venues.
+
+    Returns:
+        bytes: Little-endian bytes of the bitset, one bit per venue.
+    """
+    return mask.to_bytes((venue_count + 7) // 8, "little")
+
+
+def decode_masks(blob: bytes, count: int, venue_count: int) -> List[int]:
+    """Converts bitsets written one after another by mask_bytes back to integers.
+
+    Args:
+        blob (bytes): Bytes of the bitsets.
+        count (int): Number of bitsets.
+        venue_count (int): Number of venues.
+
+    Returns:
+        List[int]: Bitsets of venue positions, in order.
+    """
+    width = (venue_count + 7) // 8
+    return [
+        int.from_bytes(blob[number * width : (number + 1) * width], "little")
+        for number in range(count)
+    ]
+
+
+def write_snapshot(
+    snapshot_path: str,
+    all_users: List[Dict[str, Any]],
+    all_venues: List[Dict[str, Any]],
+    sources: Optional[List[Dict[str, Any]]] = None,
+):
+    """Writes cleaned users and venues to a binary snapshot file. Every name and term is
+    stored once in a string table, and records refer to them by integer ID.
+
+    Args:
+        snapshot_path (str): File path to write the snapshot to.
+        all_users (List[Dict[str, Any]]): List of cleaned dictionaries for all users.
+        all_venues (List[Dict[str, Any]]): List of cleaned dictionaries for all venues.
+        sources (Optional[List[Dict[str, Any]]]): Fingerprints of the files the users and
+        venues were read from, from fingerprint_sources, for snapshot_is_current to check.
+    """
+    string_ids = {}
+    users = encode_records(all_users, ["wont_eat", "drinks"], string_ids)
+    venues = encode_records(all_venues, ["food", "drinks"], string_ids)
+    # Latitude and longitude of each venue, or NaN for venues without coordinates
+    venue_coordinates = array("d")
+    for venue in all_venues:
+        venue_coordinates.append(venue.get("latitude", math.nan))
+        venue_coordinates.append(venue.get("longitude", math.nan))
+
+    # Capacity of each venue, or 0 for venues without one, and the opening and closing minutes
+    # of each venue's opening hours
+    venue_capacities = array("I", [venue.get("capacity", 0) for venue in all_venues])
+    venue_hours_offsets = array("I", [0])
+    venue_hours = array("I")
+    for venue in all_venues:
+        if "opening_hours" in venue:
+            for interval in venue["opening_hours"]:
+                venue_hours.extend(parse_time(time) for time in interval)
+        else:
+            # Venues without opening hours, unlike venues never open, store a lone marker
+            venue_hours.append(NO_OPENING_HOURS)
+        venue_hours_offsets.append(len(venue_hours))
+
+    # Row and column of each occupied cell of a GridIndex, and the venues in it, so that
+    # --near can search the grid without building it on every run
+    grid_index = GridIndex(all_venues)
+    grid_cells = array("i")
+    grid_offsets = array("I", [0])
+    grid_positions = array("I")
+    for cell, positions in grid_index.cells.items():
+        grid_cells.extend(cell)
+        grid_positions.extend(positions)
+        grid_offsets.append(len(grid_positions))
+    # Bitsets of an AvailabilityIndex, each as one bit per venue, for --at and --party-size
+    availability_index = AvailabilityIndex(all_venues)
+    venue_count = len(all_venues)
+    segment_masks = b"".join(
+        mask_bytes(mask, venue_count) for mask in availability_index.segment_masks
+    )
+    capacity_masks = b"".join(
+        mask_bytes(mask, venue_count) for mask in availability_index.capacity_masks
+    )
+
+    string_offsets = array("I", [0])
+    string_blob = bytearray()
+    for string in string_ids:
+        string_blob += string.encode("utf-8")
+        string_offsets.append(len(string_blob))
+
+    sections = [
+        string_offsets.tobytes(),
+        bytes(string_blob),
+        users["names"].tobytes(),
+        users["wont_eat_offsets"].tobytes(),
+        users["wont_eat_ids"].tobytes(),
+        users["drinks_offsets"].tobytes(),
+        users["drinks_ids"].tobytes(),
+        venues["names"].tobytes(),
+        venues["food_offsets"].tobytes(),
+        venues["food_ids"].tobytes(),
+        venues["drinks_offsets"].tobytes(),
+        venues["drinks_ids"].tobytes(),
+        venue_coordinates.tobytes(),
+        venue_capacities.tobytes(),
+        venue_hours_offsets.tobytes(),
+        venue_hours.tobytes(),
+        grid_cells.tobytes(),
+        grid_offsets.tobytes(),
+        grid_positions.tobytes(),
+        array("I", availability_index.segment_starts).tobytes(),
+        segment_masks,
+        array("I", availability_index.capacities).tobytes(),
+        capacity_masks,
+        mask_bytes(availability_index.unlimited_mask, venue_count),
+        json.dumps(sources or []).encode("utf-8"),
+    ]
+    positions = []
+    offset = SNAPSHOT_HEADER.size
+    for section in sections:
+        positions += [offset, len(section)]
+        # Keep every section 8-byte aligned, so it can be viewed as an array in place
+        offset += len(section) + (-len(section) % 8)
+
+    # Write to a temporary file and rename, so readers never see a partial snapshot
+    temporary_path = f"{snapshot_path}.tmp"
+    with open(temporary_path, "wb") as output:
+        output.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_BYTE_ORDER, *positions))
+        for section in sections:
+            output.write(section)
+            output.write(b"\x00" * (-len(section) % 8))
+    os.replace(temporary_path, snapshot_path)
+
+
+def read_sections(snapshot_path: str, names: List[str]) -> Dict[str, Any]:
+    """Memory-maps a snapshot written by write_snapshot, and reads some of its sections.
+
+    Args:
+        snapshot_path (str): File path of the snapshot.
+        names (List[str]): Names of the sections to read, from SNAPSHOT_SECTIONS.
+
+    Returns:
+        Dict[str, Any]: Bytes, or a list of numbers, for each section, as SECTION_TYPECODES.
+    """
+    sections = {}
+    with open(snapshot_path, "rb") as inputs:
+        with mmap.mmap(inputs.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            header = SNAPSHOT_HEADER.unpack_from(mapped, 0)
+            assert header[0] == SNAPSHOT_MAGIC, "Not a venue picker snapshot"
+            assert header[1] == SNAPSHOT_BYTE_ORDER, "Snapshot written on another platform"
+            view = memoryview(mapped)
+            for name in names:
+                number = SNAPSHOT_SECTIONS.index(name)
+                offset, length = header[2 + 2 * number], header[3 + 2 * number]
+                section = view[offset : offset + length]
+                typecode = SECTION_TYPECODES.get(name, "I")
+                if typecode is None:
+                    sections[name] = bytes(section)
+                else:
+                    sections[name] = section.cast(typecode).tolist()
+                section.release()
+            view.release()
+    return sections
+
+
+def decode_records(
+    strings: List[str], names: List[int], columns: Dict[str, Tuple[List[int], List[int]]]
+) -> List[Dict[str, Any]]:
+    """Rebuilds record dictionaries from name IDs and per-key offsets and term IDs.
+
+    Args:
+        strings (List[str]): String table, indexed by ID.
+        names (List[int]): Name ID of each record.
+        columns (Dict[str, Tuple[List[int], List[int]]]): Offsets and term IDs per key.
+
+    Returns:
+        List[Dict[str, Any]]: Records in the same shape as retrieve_json_from_file returns.
+    """
+    key_lists = []
+    for offsets, ids in columns.values():
+        terms = list(map(strings.__getitem__, ids))
+        key_lists.append([terms[start:end] for start, end in zip(offsets, offsets[1:])])
+    keys = list(columns)
+    return [
+        {"name": strings[name_id], **dict(zip(keys, values))}
+        for name_id, values in zip(names, zip(*key_lists))
+    ]
+
+
+@PROFILER.timed()
+def load_snapshot(
+    snapshot_path: str,
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Memory-maps a snapshot written by write_snapshot, and rebuilds users and venues from it.
+    Each term is decoded once, so records share a single string object per term.
+
+    Args:
+        snapshot_path (str): File path of the snapshot.
+
+    Returns:
+        Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]: All users and all venues.
+    """
+    sections = read_sections(snapshot_path, RECORD_SECTIONS)
+
+    # Decoding allocates many small lists and dicts at once - pausing the cyclic garbage
+    # collector stops it repeatedly scanning them while they are built
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        blob = sections["string_blob"]
+        offsets = sections["string_offsets"]
+        strings = [
+            sys.intern(blob[offsets[number] : offsets[number + 1]].decode("utf-8"))
+            for number in range(len(offsets) - 1)
+        ]
+        all_users = decode_records(
+            strings,
+            sections["user_names"],
+            {
+                "wont_eat": (sections["user_wont_eat_offsets"], sections["user_wont_eat_ids"]),
+                "drinks": (sections["user_drinks_offsets"], sections["user_drinks_ids"]),
+            },
+        )
+        all_venues = decode_records(
+            strings,
+            sections["venue_names"],
+            {
+                "food": (sections["venue_food_offsets"], sections["venue_food_ids"]),
+                "drinks": (sections["venue_drinks_offsets"], sections["venue_drinks_ids"]),
+            },
+        )
+        coordinates = sections["venue_coordinates"]
+        for number, venue in enumerate(all_venues):
+            latitude = coordinates[2 * number]
+            if not math.isnan(latitude):
+                venue["latitude"] = latitude
+                venue["longitude"] = coordinates[2 * number + 1]
+        capacities = sections["venue_capacities"]
+        hours_offsets = sections["venue_hours_offsets"]
+        hours = sections["venue_hours"]
+        for number, venue in enumerate(all_venues):
+            if capacities[number]:
+                venue["capacity"] = capacities[number]
+            venue_hours = hours[hours_offsets[number] : hours_offsets[number + 1]]
+            if venue_hours != [NO_OPENING_HOURS]:
+                venue["opening_hours"] = [
+                    [format_time(opening), format_time(closing)]
+                    for opening, closing in zip(venue_hours[::2], venue_hours[1::2])
+                ]
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    PROFILER.count("records_loaded", len(all_users) + len(all_venues))
+    return all_users, all_venues
+
+
+@PROFILER.timed()
+def load_grid_index(snapshot_path: str) -> GridIndex:
+    """Reads the GridIndex stored in a snapshot by write_snapshot, over the snapshot's venues.
+
+    Args:
+        snapshot_path (str): File path of the snapshot.
+
+    Returns:
+        GridIndex: Index over the venues load_snapshot returns.
+    """
+    sections = read_sections(
+        snapshot_path, ["venue_coordinates", "grid_cells", "grid_offsets", "grid_positions"]
+    )
+    values = sections["venue_coordinates"]
+    coordinates = [
+        None if math.isnan(latitude) else (latitude, longitude)
+        for latitude, longitude in zip(values[::2], values[1::2])
+    ]
+    cell_values = sections["grid_cells"]
+    offsets = sections["grid_offsets"]
+    positions = sections["grid_positions"]
+    cells = {
+        (cell_values[2 * number], cell_values[2 * number + 1]): positions[start:end]
+        for number, (start, end) in enumerate(zip(offsets, offsets[1:]))
+    }
+    return GridIndex.from_cells(coordinates, cells)
+
+
+@PROFILER.timed()
+def load_availability_index(snapshot_path: str) -> AvailabilityIndex:
+    """Reads the AvailabilityIndex stored in a snapshot by write_snapshot, over the snapshot's
+    venues.
+
+    Args:
+        snapshot_path (str): File path of the snapshot.
+
+    Returns:
+        AvailabilityIndex: Index over the venues load_snapshot returns.
+    """
+    sections = read_sections(
+        snapshot_path,
+        [
+            "venue_names",
+            "segment_starts",
+            "segment_masks",
+            "capacities",
+            "capacity_masks",
+            "unlimited_mask",
+        ],
+    )
+    venue_count = len(sections["venue_names"])
+    return AvailabilityIndex.from_masks(
+        venue_count,
+        sections["segment_starts"],
+        decode_masks(sections["segment_masks"], len(sections["segment_starts"]), venue_count),
+        sections["capacities"],
+        decode_masks(sections["capacity_masks"], len(sections["capacities"]), venue_count),
+        int.from_bytes(sections["unlimited_mask"], "little"),
+    )
+
+
+def snapshot_is_current(snapshot_path: str, source_paths: List[str]) -> bool:
+    """Checks whether a snapshot exists in the current format, and was compiled from the
+    current contents of the source files. As in DataWatcher, each file is compared by size and
+    modification time, then by content hash, so that a file touched without being changed
+    keeps the snapshot, while a file replaced by one with an older modification time does not.
+
+    Args:
+        snapshot_path (str): File path of the snapshot.
+        source_paths (List[str]): File paths of the source JSON files.
+
+    Returns:
+        bool: True if the snapshot can be used in place of the source files.
+    """
+    if not os.path.exists(snapshot_path):
+        return False
+    # Snapshots from older versions are recompiled rather than read
+    with open(snapshot_path, "rb") as inputs:
+        if inputs.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            return False
+    sources = json.loads(read_sections(snapshot_path, ["sources"])["sources"])
+    return sources_are_current(sources, source_paths)
+
+
+def sources_are_current(sources: List[Dict[str, Any]], source_paths: List[str]) -> bool:
+    """Checks source files against the fingerprints taken by fingerprint_sources, comparing
+    each by size and modification time, then by content hash only if its time has moved.
+
+    Args:
+        sources (List[Dict[str, Any]]): Fingerprint of each file when last compiled.
+        source_paths (List[str]): File paths of the source JSON files.
+
+    Returns:
+        bool: True if every file has the contents it was fingerprinted with.
+    """
+    if len(sources) != len(source_paths):
+        return False
+    for source, source_path in zip(sources, source_paths):
+        try:
+            stat = os.stat(source_path)
+        except OSError:
+            return False
+        if stat.st_size != source["size"]:
+            return False
+        if stat.st_mtime_ns != source["mtime_ns"] and hash_file(source_path) != source["sha256"]:
+            return False
+    return True
+
+
+def compile_snapshot(
+    users_path: str,
+    venues_path: str,
+    snapshot_path: str,
+    expected_user_count: Optional[int] = None,
+    expected_venue_count: Optional[int] = None,
+):
+    """Reads, cleans and validates the users and venues JSON or NDJSON files, and writes them to
+    a snapshot, with the files' fingerprints taken before reading them.
+
+    Args:
+        users_path (str): File path for users JSON or NDJSON.
+        venues_path (str): File path for venues JSON or NDJSON.
+        snapshot_path (str): File path to write the snapshot to.
+        expected_user_count (Optional[int]): Expected user records, or None to skip the check.
+        expected_venue_count (Optional[int]): Expected venue records, or None to skip the check.
+    """
+    sources = fingerprint_sources([users_path, venues_path])
+    all_users = list(
+        stream_json_from_file(users_path, ["drinks", "wont_eat"], expected_user_count)
+    )
+    all_venues = list(
+        stream_json_from_file(venues_path, ["food", "drinks"], expected_venue_count)
+    )
+    write_snapshot(snapshot_path, all_users, all_venues, sources)
+
+
+if __name__ == "__main__":
+
+    compile_snapshot("./data/users.json", "./data/venues.json", "./data/snapshot.bin")
+    print("Compiled ./data/users.json and ./data/venues.json to ./data/snapshot.bin")
@@ -0,0 +1,62 @@
+from typing import Dict, Any, Iterable, Optional
+
+from engine import BitmaskEngine, iter_bits
+from instrument import PROFILER
+from ranking import count_bits
+
+
+@PROFILER.timed()
+def maximise_attendance(
+    engine: BitmaskEngine, names: Iterable[str], must_attend: Iterable[str] = ()
+) -> Optional[Dict[str, Any]]:
+    """Finds the largest subset of the named users for which at least one venue passes both
+    the food and drink checks, always including the must-attend users.
+
+    A venue suits a group when every member drinks something it serves, and at least one of
+    its foods is banned by none of them. So for each venue and each of its foods, the largest
+    suitable group is every named user who drinks there and doesn't ban that food, and the
+    answer is the biggest of these. Venues which cannot beat the best group found so far, or
+    which don't suit the must-attend users, are skipped without looking at their foods.
+
+    Args:
+        engine (BitmaskEngine): Engine built over all users and venues.
+        names (Iterable[str]): Validated user names hoping to attend.
+        must_attend (Iterable[str]): Validated user names who must be in the group.
+
+    Returns:
+        Optional[Dict[str, Any]]: Attendees, users left out, and every venue suiting the
+        attendees, or None if no venue suits the must-attend users.
+    """
+    selected = engine.select_users(names)
+    required = engine.select_users(must_attend)
+    selected |= required
+
+    best_group = None
+    best_size = -1
+    for position in range(len(engine.venue_names)):
+        drinkers = selected & engine.venue_drinker_masks[position]
+        if drinkers & required != required or count_bits(drinkers) <= best_size:
+            continue
+        for food_id in engine.venue_foods[position]:
+            group = drinkers & ~engine.food_blockers(food_id)
+            if group & required == required and count_bits(group) > best_size:
+                best_group = group
+                best_size = count_bits(group)
+
+    if best_group is None:
+        return None
+
+    banned = engine.banned_foods(best_group)
+    venues = [
+        name
+        for position, name in enumerate(engine.venue_names)
+        if engine.venue_food_masks[position] & ~banned
+        and best_group & ~engine.venue_drinker_masks[position] == 0
+    ]
+    return {
+        "attendees": [engine.user_names[position] for position in iter_bits(best_group)],
+        "left_out": [
+            engine.user_names[position] for position in iter_bits(selected & ~best_group)
+        ],
+        "places_to_visit": venues,
+    }
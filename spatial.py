@@ -0,0 +1,198 @@
+import math
+from typing import Dict, List, Any, Optional, Tuple
+
+from instrument import PROFILER
+
+
+# Mean radius of the Earth
+EARTH_RADIUS_KM = 6371.0088
+# Length of a degree of latitude, and of longitude at the equator
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+# Side of each GridIndex cell, in degrees - about 1.1 km north to south
+GRID_CELL_DEGREES = 0.01
+
+
+def distance_km(
+    latitude: float, longitude: float, other_latitude: float, other_longitude: float
+) -> float:
+    """Computes the great circle distance between two points, with the haversine formula.
+
+    Args:
+        latitude (float): Latitude of the first point, in degrees.
+        longitude (float): Longitude of the first point, in degrees.
+        other_latitude (float): Latitude of the second point, in degrees.
+        other_longitude (float): Longitude of the second point, in degrees.
+
+    Returns:
+        float: Distance in kilometres.
+    """
+    phi, other_phi = math.radians(latitude), math.radians(other_latitude)
+    half_chord = (
+        math.sin((other_phi - phi) / 2) ** 2
+        + math.cos(phi)
+        * math.cos(other_phi)
+        * math.sin(math.radians(other_longitude - longitude) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(half_chord)))
+
+
+def venue_coordinates(venue: Dict[str, Any]) -> Optional[Tuple[float, float]]:
+    """Reads the optional coordinates of a venue, as checked by check_coordinates.
+
+    Args:
+        venue (Dict[str, Any]): Cleaned venue dictionary.
+
+    Returns:
+        Optional[Tuple[float, float]]: Latitude and longitude, or None if the venue has none.
+    """
+    if "latitude" not in venue:
+        return None
+    return venue["latitude"], venue["longitude"]
+
+
+class GridIndex:
+    """Spatial index bucketing venues into a grid of cells, a fixed number of degrees on each
+    side, so that a radius search only measures the distance to venues in nearby cells.
+
+    Venues without coordinates can't be ruled out by distance, so every search includes them.
+    """
+
+    def __init__(
+        self, all_venues: List[Dict[str, Any]], cell_degrees: float = GRID_CELL_DEGREES
+    ):
+        self.cell_degrees = cell_degrees
+        self.coordinates = []
+        self.cells = {}
+        self.unlocated = []
+        for position, venue in enumerate(all_venues):
+            coordinates = venue_coordinates(venue)
+            self.coordinates.append(coordinates)
+            if coordinates is None:
+                self.unlocated.append(position)
+            else:
+                self.cells.setdefault(self.cell(*coordinates), []).append(position)
+
+    @classmethod
+    def from_cells(
+        cls,
+        coordinates: List[Optional[Tuple[float, float]]],
+        cells: Dict[Tuple[int, int], List[int]],
+        cell_degrees: float = GRID_CELL_DEGREES,
+    ) -> "GridIndex":
+        """Re-creates an index from its cells, e.g. as stored in a snapshot, without bucketing
+        the venues again.
+
+        Args:
+            coordinates (List[Optional[Tuple[float, float]]]): Latitude and longitude of each
+            venue, or None for venues without coordinates.
+            cells (Dict[Tuple[int, int], List[int]]): Positions of the venues in each occupied
+            cell, in catalog order.
+            cell_degrees (float): Side of each cell, in degrees.
+
+        Returns:
+            GridIndex: Index over the venues.
+        """
+        grid_index = cls([], cell_degrees)
+        grid_index.coordinates = coordinates
+        grid_index.cells = cells
+        grid_index.unlocated = [
+            position for position, point in enumerate(coordinates) if point is None
+        ]
+        return grid_index
+
+    def cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        """Finds the grid cell containing a point.
+
+        Args:
+            latitude (float): Latitude in degrees.
+            longitude (float): Longitude in degrees.
+
+        Returns:
+            Tuple[int, int]: Row and column of the cell.
+        """
+        return (
+            math.floor(latitude / self.cell_degrees),
+            math.floor(longitude / self.cell_degrees),
+        )
+
+    def candidate_cells(
+        self, latitude: float, longitude: float, radius_km: float
+    ) -> List[Tuple[int, int]]:
+        """Lists the occupied cells overlapping the bounding box of a circle. Falls back to
+        every occupied cell when the box is larger than the grid, or reaches a pole or the
+        antimeridian, where the box is hard to bound.
+
+        Args:
+            latitude (float): Latitude of the centre, in degrees.
+            longitude (float): Longitude of the centre, in degrees.
+            radius_km (float): Radius in kilometres.
+
+        Returns:
+            List[Tuple[int, int]]: Cells which may hold venues within the radius.
+        """
+        latitude_span = radius_km / KM_PER_DEGREE
+        if abs(latitude) + latitude_span >= 90:
+            return list(self.cells)
+        longitude_span = latitude_span / math.cos(
+            math.radians(abs(latitude) + latitude_span)
+        )
+        if abs(longitude) + longitude_span >= 180:
+            return list(self.cells)
+        low_row, low_column = self.cell(latitude - latitude_span, longitude - longitude_span)
+        high_row, high_column = self.cell(latitude + latitude_span, longitude + longitude_span)
+        if (high_row - low_row + 1) * (high_column - low_column + 1) > len(self.cells):
+            return list(self.cells)
+        return [
+            (row, column)
+            for row in range(low_row, high_row + 1)
+            for column in range(low_column, high_column + 1)
+            if (row, column) in self.cells
+        ]
+
+    def within(self, latitude: float, longitude: float, radius_km: float) -> List[int]:
+        """Finds the venues within a radius of a point, plus every venue without coordinates.
+
+        Args:
+            latitude (float): Latitude of the centre, in degrees.
+            longitude (float): Longitude of the centre, in degrees.
+            radius_km (float): Radius in kilometres.
+
+        Returns:
+            List[int]: Positions of the venues, in catalog order.
+        """
+        positions = list(self.unlocated)
+        for cell in self.candidate_cells(latitude, longitude, radius_km):
+            for position in self.cells[cell]:
+                if distance_km(latitude, longitude, *self.coordinates[position]) <= radius_km:
+                    positions.append(position)
+        positions.sort()
+        return positions
+
+
+@PROFILER.timed()
+def filter_venues_by_distance(
+    all_venues: List[Dict[str, Any]],
+    latitude: float,
+    longitude: float,
+    radius_km: float,
+    grid_index: Optional[GridIndex] = None,
+) -> List[Dict[str, Any]]:
+    """Restricts venues to those within a radius of a point, before any food or drink
+    evaluation, keeping venues without coordinates as they can't be ruled out.
+
+    Args:
+        all_venues (List[Dict[str, Any]]): List of dictionaries for all venues.
+        latitude (float): Latitude of the centre, in degrees.
+        longitude (float): Longitude of the centre, in degrees.
+        radius_km (float): Radius in kilometres.
+        grid_index (Optional[GridIndex]): Index built over all_venues, to reuse across picks.
+
+    Returns:
+        List[Dict[str, Any]]: Candidate venues, in catalog order.
+    """
+    grid_index = grid_index or GridIndex(all_venues)
+    candidates = [
+        all_venues[position] for position in grid_index.within(latitude, longitude, radius_km)
+    ]
+    PROFILER.count("venues_ruled_out_by_distance", len(all_venues) - len(candidates))
+    return candidates
@@ -0,0 +1,471 @@
+import os
+import sqlite3
+from typing import Dict, List, Any, Tuple, Iterable, Optional
+
+from main import (
+    create_response,
+    describe_reason,
+    add_reasons,
+    stream_json_from_file,
+    REASON_MODES,
+)
+from instrument import PROFILER, count_reasons
+from snapshot import fingerprint_sources, sources_are_current
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS terms (
+    id INTEGER PRIMARY KEY,
+    term TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS user_wont_eat (
+    user_id INTEGER NOT NULL REFERENCES users (id),
+    term_id INTEGER NOT NULL REFERENCES terms (id),
+    PRIMARY KEY (user_id, term_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS user_shadowed_foods (
+    user_id INTEGER NOT NULL REFERENCES users (id),
+    term_id INTEGER NOT NULL REFERENCES terms (id),
+    PRIMARY KEY (user_id, term_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS user_drinks (
+    user_id INTEGER NOT NULL REFERENCES users (id),
+    term_id INTEGER NOT NULL REFERENCES terms (id),
+    PRIMARY KEY (user_id, term_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS venues (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    food_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS venue_food (
+    venue_id INTEGER NOT NULL REFERENCES venues (id),
+    position INTEGER NOT NULL,
+    term_id INTEGER NOT NULL REFERENCES terms (id),
+    PRIMARY KEY (venue_id, position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS venue_drinks (
+    venue_id INTEGER NOT NULL REFERENCES venues (id),
+    term_id INTEGER NOT NULL REFERENCES terms (id),
+    PRIMARY KEY (venue_id, term_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sources (
+    position INTEGER PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS user_wont_eat_by_term ON user_wont_eat (term_id, user_id);
+CREATE INDEX IF NOT EXISTS user_drinks_by_term ON user_drinks (term_id, user_id);
+CREATE INDEX IF NOT EXISTS venue_food_by_term ON venue_food (term_id, venue_id);
+CREATE INDEX IF NOT EXISTS venue_drinks_by_term ON venue_drinks (term_id, venue_id);
+"""
+
+# Number of rows buffered in memory before each batch of inserts
+INSERT_BATCH_SIZE = 10000
+
+
+class VenueStore:
+    """SQLite store of users and venues, with every food and drink term normalized into a
+    terms table and indexed both ways, so that the food and drink checks run as set-based
+    queries on disk, and catalogs need not fit in memory.
+
+    Users are keyed by name in the same way as filter_users_by_name, so where a name is
+    repeated the user keeps the position of its first appearance and the details of its last.
+    The foods of its earlier records are kept in user_shadowed_foods, as they still count as
+    banned, without reasons, in the same way as in create_banned_foods_dict.
+    """
+
+    def __init__(self, database_path: str):
+        self.connection = sqlite3.connect(database_path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        """Closes the database connection."""
+        self.connection.close()
+
+    def intern_term(self, term: str, term_ids: Dict[str, int]) -> int:
+        """Finds the ID of a term, adding it to the terms table if new.
+
+        Args:
+            term (str): Food or drink term.
+            term_ids (Dict[str, int]): IDs of the terms seen so far, updated in place.
+
+        Returns:
+            int: ID of the term.
+        """
+        if term not in term_ids:
+            self.connection.execute("INSERT OR IGNORE INTO terms (term) VALUES (?)", (term,))
+            (term_ids[term],) = self.connection.execute(
+                "SELECT id FROM terms WHERE term = ?", (term,)
+            ).fetchone()
+        return term_ids[term]
+
+    def import_records(
+        self,
+        all_users: Iterable[Dict[str, Any]],
+        all_venues: Iterable[Dict[str, Any]],
+        sources: Optional[List[Dict[str, Any]]] = None,
+    ):
+        """Replaces the contents of the store with cleaned users and venues. Records are
+        inserted in batches, so both may be streams, e.g. from stream_json_from_file. Nothing
+        is replaced unless both are read in full.
+
+        Args:
+            all_users (Iterable[Dict[str, Any]]): Cleaned user dictionaries.
+            all_venues (Iterable[Dict[str, Any]]): Cleaned venue dictionaries.
+            sources (Optional[List[Dict[str, Any]]]): Fingerprints of the files the records
+            were read from, from fingerprint_sources, for store_is_current.
+        """
+        term_ids = {}
+        with self.connection:
+            for table in (
+                "user_wont_eat",
+                "user_shadowed_foods",
+                "user_drinks",
+                "users",
+                "venue_food",
+                "venue_drinks",
+                "venues",
+                "terms",
+                "sources",
+            ):
+                self.connection.execute(f"DELETE FROM {table}")
+            self.connection.executemany(
+                "INSERT INTO sources (position, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+                [
+                    (position, source["size"], source["mtime_ns"], source["sha256"])
+                    for position, source in enumerate(sources or [])
+                ],
+            )
+
+            for user in all_users:
+                row = self.connection.execute(
+                    "SELECT id FROM users WHERE name = ?", (user["name"],)
+                ).fetchone()
+                if row is None:
+                    user_id = self.connection.execute(
+                        "INSERT INTO users (name) VALUES (?)", (user["name"],)
+                    ).lastrowid
+                else:
+                    # A repeated name replaces the details of the earlier user, though the
+                    # earlier user's foods stay banned
+                    (user_id,) = row
+                    self.connection.execute(
+                        """
+                        INSERT OR IGNORE INTO user_shadowed_foods (user_id, term_id)
+                        SELECT user_id, term_id FROM user_wont_eat WHERE user_id = ?
+                        """,
+                        (user_id,),
+                    )
+                    self.connection.execute(
+                        "DELETE FROM user_wont_eat WHERE user_id = ?", (user_id,)
+                    )
+                    self.connection.execute(
+                        "DELETE FROM user_drinks WHERE user_id = ?", (user_id,)
+                    )
+                for table, key in (("user_wont_eat", "wont_eat"), ("user_drinks", "drinks")):
+                    self.connection.executemany(
+                        f"INSERT OR IGNORE INTO {table} (user_id, term_id) VALUES (?, ?)",
+                        [(user_id, self.intern_term(term, term_ids)) for term in user[key]],
+                    )
+
+            venue_rows = []
+            food_rows = []
+            drink_rows = []
+            for venue_id, venue in enumerate(all_venues):
+                venue_rows.append((venue_id, venue["name"], len(set(venue["food"]))))
+                for position, food in enumerate(venue["food"]):
+                    food_rows.append((venue_id, position, self.intern_term(food, term_ids)))
+                for drink in venue["drinks"]:
+                    drink_rows.append((venue_id, self.intern_term(drink, term_ids)))
+                if len(food_rows) + len(drink_rows) >= INSERT_BATCH_SIZE:
+                    self.insert_venue_rows(venue_rows, food_rows, drink_rows)
+                    venue_rows, food_rows, drink_rows = [], [], []
+            self.insert_venue_rows(venue_rows, food_rows, drink_rows)
+        self.connection.execute("ANALYZE")
+
+    def insert_venue_rows(
+        self,
+        venue_rows: List[Tuple[int, str, int]],
+        food_rows: List[Tuple[int, int, int]],
+        drink_rows: List[Tuple[int, int]],
+    ):
+        """Inserts a batch of venues with their foods and drinks.
+
+        Args:
+            venue_rows (List[Tuple[int, str, int]]): ID, name and distinct food count of each venue.
+            food_rows (List[Tuple[int, int, int]]): Venue ID, menu position and term ID of each food.
+            drink_rows (List[Tuple[int, int]]): Venue ID and term ID of each drink.
+        """
+        self.connection.executemany(
+            "INSERT INTO venues (id, name, food_count) VALUES (?, ?, ?)", venue_rows
+        )
+        self.connection.executemany(
+            "INSERT INTO venue_food (venue_id, position, term_id) VALUES (?, ?, ?)", food_rows
+        )
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO venue_drinks (venue_id, term_id) VALUES (?, ?)", drink_rows
+        )
+
+    def user_names(self) -> List[str]:
+        """Lists every user name, in the order users were first imported.
+
+        Returns:
+            List[str]: User names.
+        """
+        return [
+            name for (name,) in self.connection.execute("SELECT name FROM users ORDER BY id")
+        ]
+
+    def select_users(self, names: Iterable[str]):
+        """Loads the named users into the temporary picked table that the evaluation queries
+        join against. Names not in the store are ignored.
+
+        Args:
+            names (Iterable[str]): Validated user names.
+        """
+        self.connection.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS picked (user_id INTEGER PRIMARY KEY)"
+        )
+        self.connection.execute("DELETE FROM picked")
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO picked SELECT id FROM users WHERE name = ?",
+            [(name,) for name in names],
+        )
+
+    @PROFILER.timed()
+    def evaluate(
+        self, names: Iterable[str], reasons: str = "text"
+    ) -> Tuple[Dict[str, List[str]], List[str], List[str]]:
+        """Evaluates all venues for the named users, producing the same intermediate results
+        as running evaluate_venues_for_food_suitability then evaluate_venues_for_drink_suitability.
+
+        A venue fails on food when the number of its distinct foods banned by the picked users,
+        or by earlier records of their names, counted through the food term index, equals its
+        food count. It fails on drink when
+        fewer than all of the picked users drink something it serves.
+
+        Args:
+            names (Iterable[str]): Validated user names to evaluate venues for.
+            reasons (str): One of REASON_MODES - 'none' skips building reasons.
+
+        Returns:
+            Tuple[Dict[str, List[str]], List[str], List[str]]: Failing venues with reasons,
+            venues passing on food, and venues passing on drink.
+        """
+        assert reasons in REASON_MODES, f"Got reason mode {reasons}, expected one of {REASON_MODES}"
+        self.select_users(names)
+        (picked_count,) = self.connection.execute("SELECT COUNT(*) FROM picked").fetchone()
+
+        venue_outcomes = self.connection.execute(
+            """
+            WITH banned AS (
+                SELECT w.term_id FROM user_wont_eat w JOIN picked p USING (user_id)
+                UNION
+                SELECT s.term_id FROM user_shadowed_foods s JOIN picked p USING (user_id)
+            ),
+            banned_counts AS (
+                SELECT venue_id, COUNT(DISTINCT f.term_id) AS banned_count
+                FROM venue_food f JOIN banned USING (term_id)
+                GROUP BY venue_id
+            ),
+            drinker_counts AS (
+                SELECT d.venue_id, COUNT(DISTINCT u.user_id) AS drinker_count
+                FROM user_drinks u
+                JOIN picked p USING (user_id)
+                JOIN venue_drinks d USING (term_id)
+                GROUP BY d.venue_id
+            )
+            SELECT
+                v.id,
+                v.name,
+                v.food_count > COALESCE(b.banned_count, 0),
+                COALESCE(c.drinker_count, 0) = ?
+            FROM venues v
+            LEFT JOIN banned_counts b ON b.venue_id = v.id
+            LEFT JOIN drinker_counts c ON c.venue_id = v.id
+            ORDER BY v.id
+            """,
+            (picked_count,),
+        )
+
+        venues_passing_food = []
+        venues_passing_drink = []
+        food_failures = []
+        drink_failures = []
+        for venue_id, name, passes_food, passes_drink in venue_outcomes:
+            if passes_food:
+                venues_passing_food.append(name)
+            else:
+                food_failures.append((venue_id, name))
+            if passes_drink:
+                venues_passing_drink.append(name)
+            else:
+                drink_failures.append((venue_id, name))
+
+        failing_venues_reasons_dict = {}
+        if reasons == "none":
+            return failing_venues_reasons_dict, venues_passing_food, venues_passing_drink
+
+        # Food reasons come first, in menu order, as in the original pipeline
+        food_reasons = self.failure_reasons(
+            food_failures,
+            """
+            SELECT f.venue_id, u.name
+            FROM failing x
+            JOIN venue_food f ON f.venue_id = x.venue_id
+            JOIN user_wont_eat w ON w.term_id = f.term_id
+            JOIN picked p ON p.user_id = w.user_id
+            JOIN users u ON u.id = w.user_id
+            ORDER BY f.venue_id, f.position, u.id
+            """,
+        )
+        for venue_id, name in food_failures:
+            add_reasons(
+                failing_venues_reasons_dict,
+                name,
+                (describe_reason(user, "eat", reasons) for user in food_reasons.get(venue_id, [])),
+            )
+        drink_reasons = self.failure_reasons(
+            drink_failures,
+            """
+            SELECT x.venue_id, u.name
+            FROM failing x
+            CROSS JOIN picked p
+            JOIN users u ON u.id = p.user_id
+            WHERE NOT EXISTS (
+                SELECT 1
+                FROM user_drinks w JOIN venue_drinks d ON d.term_id = w.term_id
+                WHERE w.user_id = p.user_id AND d.venue_id = x.venue_id
+            )
+            ORDER BY x.venue_id, u.id
+            """,
+        )
+        for venue_id, name in drink_failures:
+            add_reasons(
+                failing_venues_reasons_dict,
+                name,
+                (describe_reason(user, "drink", reasons) for user in drink_reasons[venue_id]),
+            )
+        return failing_venues_reasons_dict, venues_passing_food, venues_passing_drink
+
+    def failure_reasons(
+        self, failures: List[Tuple[int, str]], query: str
+    ) -> Dict[int, List[str]]:
+        """Runs a reasons query over a set of failing venues, loaded into a temporary failing
+        table, so that all their reasons are found in a single query.
+
+        Args:
+            failures (List[Tuple[int, str]]): ID and name of each failing venue.
+            query (str): Query joining against the failing table, returning a venue ID and a
+            user name per row.
+
+        Returns:
+            Dict[int, List[str]]: Names of the users each venue fails for, in query order.
+        """
+        self.connection.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS failing (venue_id INTEGER PRIMARY KEY)"
+        )
+        self.connection.execute("DELETE FROM failing")
+        self.connection.executemany(
+            "INSERT INTO failing (venue_id) VALUES (?)",
+            [(venue_id,) for venue_id, _ in failures],
+        )
+        users_by_venue = {}
+        for venue_id, user in self.connection.execute(query):
+            users_by_venue.setdefault(venue_id, []).append(user)
+        return users_by_venue
+
+    @PROFILER.timed()
+    def pick(self, names: Iterable[str], reasons: str = "text") -> Dict[str, Any]:
+        """Evaluates all venues for the named users and forms the same output as create_response.
+
+        Args:
+            names (Iterable[str]): Validated user names to evaluate venues for.
+            reasons (str): One of REASON_MODES. With 'lazy', reasons are Reasons to be rendered
+            by render_reasons, and with 'none', places_to_avoid is left empty.
+
+        Returns:
+            Dict[str, Any]: Places to visit and places to avoid, with reasons.
+        """
+        (
+            failing_venues_reasons_dict,
+            venues_passing_food,
+            venues_passing_drink,
+        ) = self.evaluate(names, reasons)
+        if PROFILER.enabled:
+            PROFILER.count("picks")
+            PROFILER.count("reasons_generated", count_reasons(failing_venues_reasons_dict))
+        return create_response(
+            venues_passing_food, venues_passing_drink, failing_venues_reasons_dict
+        )
+
+
+def store_is_current(database_path: str, source_paths: List[str]) -> bool:
+    """Checks whether a store exists and was imported from the current contents of the source
+    files, in the same way as snapshot_is_current.
+
+    Args:
+        database_path (str): File path of the SQLite database.
+        source_paths (List[str]): File paths of the source JSON files.
+
+    Returns:
+        bool: True if the store can be used in place of the source files.
+    """
+    if not os.path.exists(database_path):
+        return False
+    connection = sqlite3.connect(database_path)
+    try:
+        rows = connection.execute(
+            "SELECT size, mtime_ns, sha256 FROM sources ORDER BY position"
+        ).fetchall()
+    # Stores from older versions have no sources table, and are imported again
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        connection.close()
+    sources = [
+        {"size": size, "mtime_ns": mtime_ns, "sha256": sha256} for size, mtime_ns, sha256 in rows
+    ]
+    return sources_are_current(sources, source_paths)
+
+
+def import_json(
+    users_path: str,
+    venues_path: str,
+    database_path: str,
+    expected_user_count: Optional[int],
+    expected_venue_count: Optional[int],
+):
+    """Streams, cleans and validates the users and venues JSON files into a store, replacing
+    its contents.
+
+    Args:
+        users_path (str): File path for users JSON or NDJSON.
+        venues_path (str): File path for venues JSON or NDJSON.
+        database_path (str): File path of the SQLite database.
+        expected_user_count (Optional[int]): Expected user records, or None to skip the check.
+        expected_venue_count (Optional[int]): Expected venue records, or None to skip the check.
+    """
+    # Fingerprinted before reading, so that files changed while importing are imported again
+    sources = fingerprint_sources([users_path, venues_path])
+    store = VenueStore(database_path)
+    try:
+        store.import_records(
+            stream_json_from_file(users_path, ["drinks", "wont_eat"], expected_user_count),
+            stream_json_from_file(venues_path, ["food", "drinks"], expected_venue_count),
+            sources,
+        )
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+
+    import_json("./data/users.json", "./data/venues.json", "./data/venues.db", None, None)
+    print("Imported ./data/users.json and ./data/venues.json to ./data/venues.db")
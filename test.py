@@ -1,10 +1,65 @@
+import asyncio
+import itertools
+import random
+import io
+import json
+import os
+import runpy
+
 import pytest
 
 from main import (
     validate_args,
     filter_users_by_name,
+    create_banned_foods_dict,
+    create_preferred_drinks_dict,
     evaluate_venues_for_food_suitability,
     evaluate_venues_for_drink_suitability,
+    create_response,
+    pick_venues,
+    evaluate_pick,
+    render_reasons,
+    check_coordinates,
+    check_availability,
+    parse_time,
+    iter_json_records,
+    stream_json_from_file,
+)
+from engine import BitmaskEngine
+from explain import VenueExplainer
+from pipeline import load_team_data
+from watch import DataWatcher
+from records import compact_records
+import fuzz
+from batch import read_groups, run_batch
+import main
+import matrix
+from server import PickServer, MAX_BODY_BYTES
+from cache import PickCache, hash_data_files
+from ranking import rank_venues
+from solver import maximise_attendance
+from instrument import PROFILER
+from store import VenueStore, import_json, store_is_current
+from parallel import ShardPool, pick_venues_parallel
+from names import NameIndex
+import output
+from spatial import GridIndex, distance_km, filter_venues_by_distance
+from availability import AvailabilityIndex, filter_venues_by_availability, opening_intervals
+from benchmark import benchmark_pipeline, compare_results, measure_record_memory
+from incremental import IncrementalPicker, apply_user_update, apply_user_removal
+from snapshot import (
+    write_snapshot,
+    load_snapshot,
+    load_grid_index,
+    load_availability_index,
+    snapshot_is_current,
+    fingerprint_sources,
+)
+from index import (
+    VenueIndex,
+    load_or_build_venue_index,
+    evaluate_venues_for_food_suitability_indexed,
+    evaluate_venues_for_drink_suitability_indexed,
 )
 
 
@@ -20,6 +75,24 @@ def test_validate_args_pass(acceptable_args, actual_args, expected_output):
     assert args == expected_output
 
 
+def test_validate_args_only_indexes_a_list_of_names_for_errors(monkeypatch, capsys):
+    built = []
+
+    class CountingNameIndex(NameIndex):
+        def __init__(self, names):
+            built.append(names)
+            super().__init__(names)
+
+    monkeypatch.setattr(main, "NameIndex", CountingNameIndex)
+
+    assert validate_args(["sarah", "david", "max"], ["max"]) == ["max"]
+    assert built == []
+    with pytest.raises(SystemExit):
+        validate_args(["sarah", "david", "max"], ["jeff"])
+    assert len(built) == 1
+    assert "Choose from: ['sarah', 'david', 'max']" in capsys.readouterr().out
+
+
 @pytest.mark.parametrize(
     "acceptable_args, actual_args",
     [
@@ -27,6 +100,7 @@ def test_validate_args_pass(acceptable_args, actual_args, expected_output):
         (["sarah", "david", "max"], ["jeff"]),
         (["sarah", "david", "max"], ["-"]),
         (["sarah", "david", "max"], []),
+        (["sarah", "david", "max"], ["max", "jeff"]),
     ],
 )
 def test_validate_args_fail(acceptable_args, actual_args):
@@ -300,3 +374,1059 @@ def test_combined_evaluate_venues_for_drink_and_food_suitability_pass(
 
     for key, value in failing_venues_reasons_dict.items():
         assert value.sort() == expected_failing_venues_dict[key].sort()
+
+
+TEAM_USERS = [
+    {"name": "Danielle Ren", "wont_eat": ["fish"], "drinks": ["cider", "rum", "soft drinks"]},
+    {"name": "Karol Drewno", "wont_eat": ["bread", "pasta"], "drinks": ["vodka", "gin", "whisky", "rum"]},
+    {"name": "Wen Li", "wont_eat": ["chinese"], "drinks": ["beer", "cider", "rum"]},
+    {"name": "Gavin Coulson", "wont_eat": [], "drinks": []},
+]
+
+TEAM_VENUES = [
+    {"name": "El Cantina", "food": ["mexican"], "drinks": ["soft drinks", "tequila", "beer"]},
+    {
+        "name": "Spice of life",
+        "food": ["eggs", "meat", "fish", "pasta", "dairy"],
+        "drinks": ["vodka", "gin", "whisky", "rum", "cider", "beer", "soft drinks"],
+    },
+    {"name": "Spirit House", "food": ["nuts", "cheese", "fruit"], "drinks": ["vodka", "gin", "rum", "tequila"]},
+    {"name": "Tally Joe", "food": ["fish", "meat", "salad", "deserts"], "drinks": ["beer", "cider", "soft drinks", "sake"]},
+    {"name": "Fabrique", "food": ["bread", "cheese", "deli"], "drinks": ["soft drinks", "tea", "coffee"]},
+    {"name": "Bread Shack", "food": ["bread", "fish"], "drinks": ["rum"]},
+    {"name": "Empty Bar", "food": [], "drinks": ["rum"]},
+]
+
+
+def normalise_response(response):
+    # places_to_visit comes from a set intersection, and drink reasons from a set difference
+    return {
+        "places_to_visit": sorted(response["places_to_visit"]),
+        "places_to_avoid": [
+            {"name": failure["name"], "reasons": sorted(failure["reasons"])}
+            for failure in response["places_to_avoid"]
+        ],
+    }
+
+
+@pytest.mark.parametrize(
+    "names",
+    [
+        ["Danielle Ren", "Karol Drewno"],
+        ["Danielle Ren", "Karol Drewno", "Wen Li"],
+        ["Wen Li", "Gavin Coulson"],
+        ["Karol Drewno"],
+        [],
+    ],
+)
+def test_bitmask_engine_matches_reference(names):
+    engine = BitmaskEngine(TEAM_USERS, TEAM_VENUES)
+    assert normalise_response(engine.pick(names)) == normalise_response(
+        pick_venues(names, TEAM_USERS, TEAM_VENUES)
+    )
+
+
+# Users sharing a name - only the last record's details count, but every record's foods are
+# keys of create_banned_foods_dict, so V2 fails on food for U1 with no reason given
+REPEATED_NAME_USERS = [
+    {"name": "U1", "wont_eat": ["f0"], "drinks": []},
+    {"name": "U1", "wont_eat": [], "drinks": []},
+    {"name": "U1", "wont_eat": [], "drinks": ["d0"]},
+    {"name": "U2", "wont_eat": [], "drinks": []},
+    {"name": "U2", "wont_eat": [], "drinks": ["d0"]},
+    {"name": "U2", "wont_eat": [], "drinks": []},
+]
+REPEATED_NAME_VENUES = [
+    {"name": "V1", "food": ["f1"], "drinks": ["d0"]},
+    {"name": "V2", "food": ["f0"], "drinks": ["d0"]},
+]
+REPEATED_NAME_GROUPS = [["U1"], ["U2"], ["U1", "U2"]]
+
+
+@pytest.mark.parametrize("names", REPEATED_NAME_GROUPS)
+def test_bitmask_engine_matches_reference_for_repeated_names(names):
+    engine = BitmaskEngine(REPEATED_NAME_USERS, REPEATED_NAME_VENUES)
+    assert normalise_response(engine.pick(names)) == normalise_response(
+        pick_venues(names, REPEATED_NAME_USERS, REPEATED_NAME_VENUES)
+    )
+
+
+def test_run_batch_streams_one_result_per_group():
+    groups = read_groups(['["Danielle Ren", "Karol Drewno"]\n', "\n", '["everyone"]\n', '["Jeff"]\n', "[]"])
+    results = list(run_batch(groups, TEAM_USERS, TEAM_VENUES))
+
+    assert len(results) == 4
+    assert normalise_response(results[0]) == normalise_response(
+        pick_venues(["Danielle Ren", "Karol Drewno"], TEAM_USERS, TEAM_VENUES)
+    )
+    everyone = [user["name"] for user in TEAM_USERS]
+    assert normalise_response(results[1]) == normalise_response(
+        pick_venues(everyone, TEAM_USERS, TEAM_VENUES)
+    )
+    assert "error" in results[2]
+    assert "error" in results[3]
+
+
+@pytest.mark.parametrize(
+    "names",
+    [
+        ["Danielle Ren", "Karol Drewno"],
+        ["Danielle Ren", "Karol Drewno", "Wen Li", "Gavin Coulson"],
+    ],
+)
+def test_indexed_evaluation_matches_reference(names, tmp_path):
+    venues_path = tmp_path / "venues.json"
+    venues_path.write_text(json.dumps(TEAM_VENUES))
+    index_path = str(tmp_path / "venues.index.json")
+    load_or_build_venue_index(str(venues_path), index_path, TEAM_VENUES)
+    # Second call reads the saved index back
+    venue_index = load_or_build_venue_index(str(venues_path), index_path, TEAM_VENUES)
+    assert venue_index.to_dict() == VenueIndex.build(TEAM_VENUES, venue_index.source_hash).to_dict()
+
+    filtered_users = filter_users_by_name(names, TEAM_USERS)
+    banned_foods_dict = create_banned_foods_dict("wont_eat", names, TEAM_USERS, filtered_users)
+    preferred_drinks_dict = create_preferred_drinks_dict("drinks", names, TEAM_USERS, filtered_users)
+    failing_venues_reasons_dict, venues_passing_food = evaluate_venues_for_food_suitability_indexed(
+        banned_foods_dict, venue_index, TEAM_VENUES, {}, filtered_users
+    )
+    failing_venues_reasons_dict, venues_passing_drink = evaluate_venues_for_drink_suitability_indexed(
+        preferred_drinks_dict, venue_index, failing_venues_reasons_dict, filtered_users
+    )
+    response = create_response(venues_passing_food, venues_passing_drink, failing_venues_reasons_dict)
+
+    assert normalise_response(response) == normalise_response(
+        pick_venues(names, TEAM_USERS, TEAM_VENUES)
+    )
+
+
+@pytest.mark.parametrize(
+    "names",
+    [
+        ["Danielle Ren", "Karol Drewno"],
+        ["Danielle Ren", "Karol Drewno", "Wen Li", "Gavin Coulson"],
+        [],
+    ],
+)
+def test_matrix_engine_matches_reference(names):
+    pytest.importorskip("numpy")
+    engine = matrix.MatrixEngine(TEAM_USERS, TEAM_VENUES)
+    assert normalise_response(engine.pick(names)) == normalise_response(
+        pick_venues(names, TEAM_USERS, TEAM_VENUES)
+    )
+
+
+@pytest.mark.parametrize("names", REPEATED_NAME_GROUPS)
+def test_matrix_engine_matches_reference_for_repeated_names_in_small_blocks(names, monkeypatch):
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(matrix, "BLOCK_CELLS", 1)
+    engine = matrix.MatrixEngine(REPEATED_NAME_USERS, REPEATED_NAME_VENUES + TEAM_VENUES)
+    assert normalise_response(engine.pick(names)) == normalise_response(
+        pick_venues(names, REPEATED_NAME_USERS, REPEATED_NAME_VENUES + TEAM_VENUES)
+    )
+
+
+def test_matrix_engine_falls_back_without_numpy(monkeypatch):
+    monkeypatch.setattr(matrix, "np", None)
+    names = ["Danielle Ren", "Wen Li"]
+    engine = matrix.MatrixEngine(TEAM_USERS, TEAM_VENUES)
+    assert normalise_response(engine.pick(names)) == normalise_response(
+        pick_venues(names, TEAM_USERS, TEAM_VENUES)
+    )
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        json.dumps(TEAM_VENUES, indent=2),
+        "\n".join(json.dumps(venue) for venue in TEAM_VENUES) + "\n",
+    ],
+)
+def test_iter_json_records_parses_array_and_ndjson_across_chunks(text):
+    records = list(iter_json_records(io.StringIO(text), chunk_size=7))
+    assert records == TEAM_VENUES
+
+
+@pytest.mark.parametrize("malformed", ['{"name": tru, "food": []}', '{"name" "Pie Shop"}'])
+def test_iter_json_records_raises_on_malformed_record_without_reading_on(malformed):
+    venue = json.dumps(TEAM_VENUES[0])
+    inputs = io.StringIO("\n".join([venue, malformed] + [venue] * 10000))
+    records = iter_json_records(inputs, chunk_size=1024)
+
+    assert next(records) == TEAM_VENUES[0]
+    with pytest.raises(json.JSONDecodeError):
+        next(records)
+    assert inputs.tell() <= 2048
+
+
+def test_stream_json_from_file_feeds_evaluate_functions(tmp_path):
+    venues_path = tmp_path / "venues.json"
+    venues_path.write_text(json.dumps([{"name": "Pie Shop", "food": ["PIES", ""], "drinks": ["Tea"]}]))
+
+    all_venues = stream_json_from_file(str(venues_path), ["food", "drinks"], 1)
+    failing_venues_reasons_dict, venues_passing_food = evaluate_venues_for_food_suitability(
+        {"pies": ["sarah"]}, all_venues, {}, {"sarah": {"wont_eat": ["pies"], "drinks": ["tea"]}}
+    )
+
+    assert failing_venues_reasons_dict == {"Pie Shop": ["There is nothing for sarah to eat."]}
+    assert venues_passing_food == []
+
+
+def test_stream_json_from_file_checks_record_count(tmp_path):
+    venues_path = tmp_path / "venues.json"
+    venues_path.write_text(json.dumps(TEAM_VENUES))
+
+    with pytest.raises(SystemExit):
+        list(stream_json_from_file(str(venues_path), ["food", "drinks"], 2))
+
+
+def test_snapshot_round_trip(tmp_path):
+    users_path = tmp_path / "users.json"
+    users_path.write_text(json.dumps(TEAM_USERS))
+    snapshot_path = str(tmp_path / "snapshot.bin")
+    assert not snapshot_is_current(snapshot_path, [str(users_path)])
+
+    write_snapshot(
+        snapshot_path, TEAM_USERS, TEAM_VENUES, fingerprint_sources([str(users_path)])
+    )
+    all_users, all_venues = load_snapshot(snapshot_path)
+
+    assert snapshot_is_current(snapshot_path, [str(users_path)])
+    assert all_users == TEAM_USERS
+    assert all_venues == TEAM_VENUES
+
+
+def test_snapshot_is_current_checks_source_contents_not_just_times(tmp_path):
+    users_path = tmp_path / "users.json"
+    users_path.write_text(json.dumps(TEAM_USERS))
+    snapshot_path = str(tmp_path / "snapshot.bin")
+    write_snapshot(
+        snapshot_path, TEAM_USERS, TEAM_VENUES, fingerprint_sources([str(users_path)])
+    )
+    stat = os.stat(users_path)
+
+    # Touched without being changed
+    os.utime(users_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert snapshot_is_current(snapshot_path, [str(users_path)])
+
+    # Replaced by a file of the same size, older than the snapshot
+    users_path.write_text(json.dumps(TEAM_USERS).replace("Danielle", "Danielly"))
+    os.utime(users_path, ns=(stat.st_atime_ns, stat.st_mtime_ns - 10**10))
+    assert not snapshot_is_current(snapshot_path, [str(users_path)])
+
+    # Changed size
+    users_path.write_text(json.dumps(TEAM_USERS[:1]))
+    assert not snapshot_is_current(snapshot_path, [str(users_path)])
+
+
+def test_snapshot_round_trip_keeps_venue_coordinates(tmp_path):
+    venues = [dict(venue) for venue in TEAM_VENUES]
+    venues[0].update(latitude=51.5074, longitude=-0.1278)
+    snapshot_path = str(tmp_path / "snapshot.bin")
+
+    write_snapshot(snapshot_path, TEAM_USERS, venues)
+
+    assert load_snapshot(snapshot_path)[1] == venues
+    grid_index = load_grid_index(snapshot_path)
+    assert grid_index.within(51.5074, -0.1278, 1) == list(range(len(venues)))
+    assert grid_index.within(48.85, 2.35, 1) == list(range(1, len(venues)))
+    assert grid_index.cells == GridIndex(venues).cells
+
+
+def test_pick_server_answers_requests_over_localhost():
+    async def request(port, method, path, body):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(
+            f"{method} {path} HTTP/1.1\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+            + body
+        )
+        response = await reader.read()
+        writer.close()
+        status_line, _, payload = response.partition(b"\r\n\r\n")
+        return int(status_line.split()[1]), json.loads(payload)
+
+    async def run():
+        server = await PickServer(TEAM_USERS, TEAM_VENUES).start("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            return await asyncio.gather(
+                request(port, "POST", "/pick", json.dumps({"names": ["Wen Li", "Karol Drewno"]}).encode()),
+                request(port, "POST", "/pick", b'["Jeff"]'),
+                request(port, "GET", "/pick", b""),
+                request(port, "POST", "/other", b"[]"),
+            )
+
+    picked, invalid, wrong_method, not_found = asyncio.run(run())
+
+    assert picked[0] == 200
+    assert normalise_response(picked[1]) == normalise_response(
+        pick_venues(["Wen Li", "Karol Drewno"], TEAM_USERS, TEAM_VENUES)
+    )
+    assert invalid[0] == 400
+    assert wrong_method[0] == 405
+    assert not_found[0] == 404
+
+
+def test_pick_server_answers_failed_picks_and_refuses_large_bodies(monkeypatch):
+    async def request(port, head, body):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(head.encode() + body)
+        response = await reader.read()
+        writer.close()
+        status_line, _, payload = response.partition(b"\r\n\r\n")
+        return int(status_line.split()[1]), json.loads(payload)
+
+    pick_server = PickServer(TEAM_USERS, TEAM_VENUES)
+
+    def failing_pick(names):
+        raise RuntimeError("engine failed")
+
+    monkeypatch.setattr(pick_server.engine, "pick", failing_pick)
+
+    async def run():
+        server = await pick_server.start("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            return await asyncio.gather(
+                request(
+                    port,
+                    "POST /pick HTTP/1.1\r\nContent-Length: 10\r\nConnection: close\r\n\r\n",
+                    b'["Wen Li"]',
+                ),
+                request(
+                    port,
+                    f"POST /pick HTTP/1.1\r\nContent-Length: {MAX_BODY_BYTES + 1}\r\n\r\n",
+                    b"[",
+                ),
+            )
+
+    failed, too_large = asyncio.run(run())
+
+    assert failed == (500, {"error": "Failed to answer request: engine failed"})
+    assert too_large[0] == 413
+
+
+def test_pick_cache_counts_hits_misses_and_evictions():
+    cache = PickCache(max_size=2, data_version="v1")
+    picks = []
+
+    def pick(names):
+        picks.append(names)
+        return {"names": sorted(names)}
+
+    cache.get_or_pick(["sarah", "max"], pick)
+    cache.get_or_pick(["max", "sarah", "max"], pick)
+    cache.get_or_pick(["david"], pick)
+    cache.get_or_pick(["jeff"], pick)
+    cache.get_or_pick(["sarah", "max"], pick)
+
+    assert len(picks) == 4
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["entries"]) == (1, 4, 2, 2)
+
+
+def test_pick_cache_invalidates_when_data_file_changes(tmp_path):
+    users_path = tmp_path / "users.json"
+    users_path.write_text(json.dumps(TEAM_USERS))
+    cache = PickCache(data_paths=[str(users_path)])
+    cache.put(["sarah"], {"places_to_visit": []})
+    assert cache.get(["sarah"]) is not None
+
+    users_path.write_text(json.dumps(TEAM_USERS[:1]))
+
+    assert cache.get(["sarah"]) is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_incremental_picker_matches_rebuild_and_keeps_unaffected_results():
+    all_users = [dict(user) for user in TEAM_USERS]
+    all_venues = [dict(venue) for venue in TEAM_VENUES]
+    picker = IncrementalPicker(all_users, all_venues)
+    groups = [["Danielle Ren", "Karol Drewno"], ["Wen Li"], ["Karol Drewno", "Gavin Coulson"]]
+    for names in groups:
+        picker.pick(names)
+
+    # Serving fish makes no difference to Wen Li, who already has food at Spirit House
+    spirit_house = {"name": "Spirit House", "food": ["nuts", "cheese", "fruit", "fish"], "drinks": ["vodka", "gin", "rum", "tequila"]}
+    all_venues[2] = spirit_house
+    picker.update_venue(spirit_house)
+    assert picker.cache.invalidations == 0
+
+    wen_li = {"name": "Wen Li", "wont_eat": ["chinese", "nuts"], "drinks": ["tea"]}
+    all_users[2] = wen_li
+    picker.update_user(wen_li)
+    assert picker.cache.invalidations == 1
+
+    new_venue = {"name": "Tea Rooms", "food": ["cake"], "drinks": ["tea"]}
+    all_venues.append(new_venue)
+    picker.add_venue(new_venue)
+    del all_venues[0]
+    picker.remove_venue("El Cantina")
+    del all_users[0]
+    picker.remove_user("Danielle Ren")
+
+    for names in groups[1:] + [["everyone"]]:
+        names, error = picker.engine.resolve_names(names)
+        assert error is None
+        assert normalise_response(picker.pick(names)) == normalise_response(
+            pick_venues(names, all_users, all_venues)
+        )
+
+
+def test_incremental_picker_add_user_with_existing_name_updates_them():
+    all_venues = [{"name": "V", "food": ["fish"], "drinks": ["tea"]}]
+    picker = IncrementalPicker([{"name": "a", "wont_eat": ["fish"], "drinks": ["tea"]}], all_venues)
+    assert picker.pick(["a"])["places_to_visit"] == []
+
+    user = {"name": "a", "wont_eat": [], "drinks": ["tea"]}
+    picker.add_user(user)
+    rebuilt = IncrementalPicker([user], all_venues)
+
+    assert picker.pick(["a"]) == rebuilt.pick(["a"]) == pick_venues(["a"], [user], all_venues)
+    assert picker.pick(["a"])["places_to_visit"] == ["V"]
+    picker.update_user(user)
+    assert picker.pick(["a"]) == rebuilt.pick(["a"])
+
+
+def test_apply_user_update_matches_rebuilt_dicts():
+    names = ["Danielle Ren", "Karol Drewno", "Wen Li"]
+    all_users = [dict(user) for user in TEAM_USERS]
+    filtered_users = filter_users_by_name(names, all_users)
+    banned_foods_dict = create_banned_foods_dict("wont_eat", names, all_users, filtered_users)
+    preferred_drinks_dict = create_preferred_drinks_dict("drinks", names, all_users, filtered_users)
+
+    all_users[0] = {"name": "Danielle Ren", "wont_eat": ["bread", "chinese"], "drinks": ["beer"]}
+    apply_user_update(all_users[0], filtered_users, banned_foods_dict, preferred_drinks_dict)
+    del all_users[1]
+    apply_user_removal("Karol Drewno", filtered_users, banned_foods_dict, preferred_drinks_dict)
+
+    names = ["Danielle Ren", "Wen Li"]
+    expected_filtered_users = filter_users_by_name(names, all_users)
+    assert filtered_users == expected_filtered_users
+    assert banned_foods_dict == create_banned_foods_dict("wont_eat", names, all_users, expected_filtered_users)
+    assert preferred_drinks_dict == create_preferred_drinks_dict("drinks", names, all_users, expected_filtered_users)
+
+
+def test_venue_index_updates_match_rebuild():
+    all_venues = [dict(venue) for venue in TEAM_VENUES]
+    venue_index = VenueIndex.build(all_venues)
+
+    updated = {"name": "Fabrique", "food": ["bread", "soup"], "drinks": ["tea"]}
+    venue_index.update_venue(4, all_venues[4], updated)
+    all_venues[4] = updated
+    venue_index.remove_venue(1, all_venues[1])
+    del all_venues[1]
+    venue_index.add_venue({"name": "Tea Rooms", "food": ["cake"], "drinks": ["tea"]})
+    all_venues.append({"name": "Tea Rooms", "food": ["cake"], "drinks": ["tea"]})
+
+    assert venue_index.to_dict() == VenueIndex.build(all_venues).to_dict()
+    names = ["Danielle Ren", "Wen Li"]
+    filtered_users = filter_users_by_name(names, TEAM_USERS)
+    banned_foods_dict = create_banned_foods_dict("wont_eat", names, TEAM_USERS, filtered_users)
+    preferred_drinks_dict = create_preferred_drinks_dict("drinks", names, TEAM_USERS, filtered_users)
+    failing_venues_reasons_dict, venues_passing_food = evaluate_venues_for_food_suitability_indexed(
+        banned_foods_dict, venue_index, all_venues, {}, filtered_users
+    )
+    failing_venues_reasons_dict, venues_passing_drink = evaluate_venues_for_drink_suitability_indexed(
+        preferred_drinks_dict, venue_index, failing_venues_reasons_dict, filtered_users
+    )
+    response = create_response(venues_passing_food, venues_passing_drink, failing_venues_reasons_dict)
+    assert normalise_response(response) == normalise_response(pick_venues(names, TEAM_USERS, all_venues))
+
+
+def test_rank_venues_returns_top_k_with_passing_venues_first():
+    engine = BitmaskEngine(TEAM_USERS, TEAM_VENUES)
+    names = ["Danielle Ren", "Karol Drewno"]
+
+    top_venues = rank_venues(engine, names, k=3)
+
+    assert [venue["name"] for venue in top_venues] == ["Spice of life", "Spirit House", "Bread Shack"]
+    assert top_venues[0] == {
+        "name": "Spice of life",
+        "passes": True,
+        "users_with_drink": 2,
+        "foods_left": 3,
+        "users_with_choice_of_drinks": 2,
+    }
+    assert top_venues[2]["passes"] is False
+    passing = set(pick_venues(names, TEAM_USERS, TEAM_VENUES)["places_to_visit"])
+    assert {venue["name"] for venue in rank_venues(engine, names, k=len(passing))} == passing
+
+
+@pytest.mark.parametrize(
+    "must_attend",
+    [[], ["Gavin Coulson"], ["Karol Drewno"]],
+)
+def test_maximise_attendance_finds_largest_group_with_a_venue(must_attend):
+    engine = BitmaskEngine(TEAM_USERS, TEAM_VENUES)
+    everyone = [user["name"] for user in TEAM_USERS]
+
+    result = maximise_attendance(engine, everyone, must_attend)
+
+    # Compare against trying every subset, largest first
+    expected_size = None
+    for size in range(len(everyone), -1, -1):
+        for group in itertools.combinations(everyone, size):
+            if set(must_attend) <= set(group) and pick_venues(list(group), TEAM_USERS, TEAM_VENUES)["places_to_visit"]:
+                expected_size = size
+                break
+        if expected_size is not None:
+            break
+
+    if expected_size is None:
+        assert result is None
+    else:
+        assert len(result["attendees"]) == expected_size
+        assert set(must_attend) <= set(result["attendees"])
+        assert sorted(result["places_to_visit"]) == sorted(
+            pick_venues(result["attendees"], TEAM_USERS, TEAM_VENUES)["places_to_visit"]
+        )
+
+
+def test_benchmark_pipeline_times_every_stage():
+    result = benchmark_pipeline(user_count=10, venue_count=20, group_size=3, seed=1)
+
+    assert result["parameters"]["users"] == 10
+    assert set(result["seconds"]) == {
+        "retrieve_users",
+        "retrieve_venues",
+        "filter_users_by_name",
+        "create_banned_foods_dict",
+        "create_preferred_drinks_dict",
+        "evaluate_venues_for_food_suitability",
+        "evaluate_venues_for_drink_suitability",
+        "create_response",
+        "total",
+        "load_team_data",
+        "team_data_pick",
+        "fused_total",
+    }
+    comparisons = compare_results({"pipeline": [result]}, {"pipeline": [result]})
+    assert all(comparison["ratio"] == 1.0 for comparison in comparisons)
+
+
+def test_profiler_records_stages_and_counters_only_when_enabled():
+    PROFILER.reset()
+    pick_venues(["Danielle Ren"], TEAM_USERS, TEAM_VENUES)
+    assert PROFILER.report() == {"stages": {}, "counters": {}}
+    assert PickServer(TEAM_USERS, TEAM_VENUES).route("GET", "/metrics", b"")[0] == 404
+
+    PROFILER.enabled = True
+    try:
+        pick_venues(["Danielle Ren", "Wen Li"], TEAM_USERS, TEAM_VENUES)
+        status, metrics = PickServer(TEAM_USERS, TEAM_VENUES).route("GET", "/metrics", b"")
+    finally:
+        PROFILER.enabled = False
+        report = PROFILER.report()
+        PROFILER.reset()
+
+    assert report["stages"]["pick_venues"]["calls"] == 1
+    assert report["stages"]["evaluate_venues_for_food_suitability"]["calls"] == 1
+    assert report["counters"]["users_filtered"] == 2
+    assert report["counters"]["venues_evaluated"] == len(TEAM_VENUES)
+    assert status == 200
+    assert 'venue_picker_stage_calls_total{stage="pick_venues"} 1' in metrics
+    assert "venue_picker_http_requests_total 1" in metrics
+
+
+def run_profiled_pick(monkeypatch, capsys, names):
+    monkeypatch.setattr("sys.argv", ["main.py", "--profile"] + names)
+    try:
+        runpy.run_path(os.path.join(os.path.dirname(__file__), "main.py"), run_name="__main__")
+    finally:
+        PROFILER.enabled = False
+        PROFILER.reset()
+    return json.loads(capsys.readouterr().err)["counters"]
+
+
+@pytest.mark.parametrize("radius", ["-1", "0", "nan", "inf"])
+def test_near_refuses_radius_not_finite_and_positive(radius, tmp_path, monkeypatch, capsys):
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data" / "users.json").write_text(json.dumps(TEAM_USERS))
+    (tmp_path / "data" / "venues.json").write_text(json.dumps(TEAM_VENUES))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr("sys.argv", ["main.py", "--near", "51.5,-0.1", "--radius", radius, "Wen Li"])
+
+    with pytest.raises(SystemExit) as exit_info:
+        runpy.run_path(os.path.join(os.path.dirname(__file__), "main.py"), run_name="__main__")
+
+    assert exit_info.value.code == 2
+    assert capsys.readouterr().out.startswith("Sorry, give --near")
+
+
+def test_profile_counts_picks_the_same_from_json_and_snapshot(tmp_path, monkeypatch, capsys):
+    data_path = tmp_path / "data"
+    data_path.mkdir()
+    source_paths = [str(data_path / "users.json"), str(data_path / "venues.json")]
+    (data_path / "users.json").write_text(json.dumps(TEAM_USERS))
+    (data_path / "venues.json").write_text(json.dumps(TEAM_VENUES))
+    monkeypatch.chdir(tmp_path)
+    names = ["Danielle Ren", "Wen Li"]
+
+    json_counters = run_profiled_pick(monkeypatch, capsys, names)
+    write_snapshot(
+        str(data_path / "snapshot.bin"), TEAM_USERS, TEAM_VENUES, fingerprint_sources(source_paths)
+    )
+    snapshot_counters = run_profiled_pick(monkeypatch, capsys, names)
+
+    assert json_counters["picks"] == 1
+    assert json_counters == snapshot_counters
+
+
+@pytest.mark.parametrize("names", [["Danielle Ren"], ["Karol Drewno", "Wen Li", "Gavin Coulson"]])
+def test_lazy_and_passing_only_reasons_match_default(names):
+    expected = pick_venues(names, TEAM_USERS, TEAM_VENUES)
+    engine = BitmaskEngine(TEAM_USERS, TEAM_VENUES)
+
+    for response in (
+        pick_venues(names, TEAM_USERS, TEAM_VENUES, reasons="lazy"),
+        engine.pick(names, reasons="lazy"),
+    ):
+        assert normalise_response(render_reasons(response)) == normalise_response(expected)
+
+    for response in (
+        pick_venues(names, TEAM_USERS, TEAM_VENUES, reasons="none"),
+        engine.pick(names, reasons="none"),
+    ):
+        assert sorted(response["places_to_visit"]) == sorted(expected["places_to_visit"])
+        assert response["places_to_avoid"] == []
+
+
+@pytest.mark.parametrize(
+    "names",
+    [
+        ["Danielle Ren"],
+        ["Karol Drewno", "Wen Li"],
+        ["Gavin Coulson"],
+        [user["name"] for user in TEAM_USERS],
+    ],
+)
+def test_venue_store_matches_reference(names, tmp_path):
+    store = VenueStore(str(tmp_path / "venues.db"))
+    store.import_records(TEAM_USERS, TEAM_VENUES)
+    expected = pick_venues(names, TEAM_USERS, TEAM_VENUES)
+
+    response = store.pick(names)
+
+    assert normalise_response(response) == normalise_response(expected)
+    assert [failure["name"] for failure in response["places_to_avoid"]] == [
+        failure["name"] for failure in expected["places_to_avoid"]
+    ]
+    assert store.user_names() == [user["name"] for user in TEAM_USERS]
+    store.close()
+
+
+@pytest.mark.parametrize("names", REPEATED_NAME_GROUPS)
+def test_venue_store_matches_reference_for_repeated_names(names, tmp_path):
+    store = VenueStore(str(tmp_path / "venues.db"))
+    store.import_records(REPEATED_NAME_USERS, REPEATED_NAME_VENUES)
+
+    assert normalise_response(store.pick(names)) == normalise_response(
+        pick_venues(names, REPEATED_NAME_USERS, REPEATED_NAME_VENUES)
+    )
+    store.close()
+
+
+def test_store_is_current_checks_source_contents_not_just_times(tmp_path):
+    users_path, venues_path = tmp_path / "users.json", tmp_path / "venues.json"
+    users_path.write_text(json.dumps(TEAM_USERS))
+    venues_path.write_text(json.dumps(TEAM_VENUES))
+    source_paths = [str(users_path), str(venues_path)]
+    database_path = str(tmp_path / "venues.db")
+    assert not store_is_current(database_path, source_paths)
+
+    import_json(*source_paths, database_path, None, None)
+    assert store_is_current(database_path, source_paths)
+    stat = os.stat(users_path)
+
+    # Replaced by a file of the same size, older than the store
+    users_path.write_text(json.dumps(TEAM_USERS).replace("Danielle", "Danielly"))
+    os.utime(users_path, ns=(stat.st_atime_ns, stat.st_mtime_ns - 10**10))
+    assert not store_is_current(database_path, source_paths)
+
+    import_json(*source_paths, database_path, None, None)
+    assert store_is_current(database_path, source_paths)
+
+
+def test_pick_venues_parallel_gives_exact_reference_output():
+    names = [user["name"] for user in TEAM_USERS]
+
+    response = pick_venues_parallel(names, TEAM_USERS, TEAM_VENUES, workers=2)
+
+    assert json.dumps(response) == json.dumps(pick_venues(names, TEAM_USERS, TEAM_VENUES))
+
+
+def test_shard_pool_is_reused_across_picks():
+    groups = [["Wen Li", "Karol Drewno"], ["Danielle Ren"], [user["name"] for user in TEAM_USERS]]
+
+    with ShardPool(TEAM_VENUES, workers=2) as pool:
+        responses = [
+            pick_venues_parallel(names, TEAM_USERS, TEAM_VENUES, pool=pool) for names in groups
+        ]
+        passing_only = pick_venues_parallel(
+            groups[0], TEAM_USERS, TEAM_VENUES, reasons="none", pool=pool
+        )
+
+    assert pool.picks == 4
+    for names, response in zip(groups, responses):
+        assert json.dumps(response) == json.dumps(pick_venues(names, TEAM_USERS, TEAM_VENUES))
+    assert passing_only["places_to_visit"] == responses[0]["places_to_visit"]
+    assert passing_only["places_to_avoid"] == []
+
+
+def test_grid_index_matches_brute_force_radius_search():
+    rng = random.Random(0)
+    venues = [
+        {"name": f"Venue {number}", "food": [], "drinks": []}
+        for number in range(500)
+    ]
+    for venue in venues[:450]:
+        venue["latitude"] = 51.5 + rng.uniform(-0.1, 0.1)
+        venue["longitude"] = -0.12 + rng.uniform(-0.1, 0.1)
+    grid_index = GridIndex(venues)
+
+    for radius_km in (0.5, 2, 50):
+        expected = [
+            position
+            for position, venue in enumerate(venues)
+            if "latitude" not in venue
+            or distance_km(51.5, -0.12, venue["latitude"], venue["longitude"]) <= radius_km
+        ]
+        assert grid_index.within(51.5, -0.12, radius_km) == expected
+
+
+def test_filter_venues_by_distance_keeps_venues_without_coordinates():
+    venues = [dict(venue) for venue in TEAM_VENUES]
+    venues[0].update(latitude=51.5, longitude=-0.12)
+    venues[1].update(latitude=48.85, longitude=2.35)
+
+    candidates = filter_venues_by_distance(venues, 51.5, -0.12, 1)
+
+    assert candidates == [venues[0]] + venues[2:]
+
+
+@pytest.mark.parametrize(
+    "record", [{"name": "A", "latitude": 51.5}, {"name": "A", "latitude": 91, "longitude": 0}]
+)
+def test_check_coordinates_rejects_partial_or_out_of_range(record):
+    with pytest.raises(AssertionError):
+        check_coordinates(record)
+
+
+def test_name_index_completes_prefixes_and_suggests_close_names():
+    name_index = NameIndex(["Tom Mullen", "Rosie Curran", "Tom Brady", "Rosie Curran"])
+
+    assert "Tom Mullen" in name_index and "tom mullen" not in name_index
+    assert len(name_index) == 3
+    assert name_index.complete("tom") == ["Tom Brady", "Tom Mullen"]
+    assert name_index.complete("tom", limit=1) == ["Tom Brady"]
+    assert name_index.complete("x") == []
+    assert name_index.suggest("Tom Mulen")[0] == "Tom Mullen"
+    assert name_index.suggest("rosie") == ["Rosie Curran"]
+
+
+def test_validate_args_suggests_names_for_large_rosters(capsys):
+    roster = [f"User {number}" for number in range(100)] + ["Tom Mullen"]
+
+    assert validate_args(NameIndex(roster), ["Tom Mullen"]) == ["Tom Mullen"]
+    with pytest.raises(SystemExit):
+        validate_args(roster, ["Tom Mulen"])
+
+    message = capsys.readouterr().out
+    assert "Tom Mullen" in message and "User 50" not in message
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_streamed_output_matches_serialized_response(use_orjson, monkeypatch):
+    if not use_orjson:
+        monkeypatch.setattr(output, "orjson", None)
+    names = ["Danielle Ren", "Wen Li", "Karol Drewno"]
+    expected = pick_venues(names, TEAM_USERS, TEAM_VENUES)
+    results = evaluate_pick(names, TEAM_USERS, TEAM_VENUES, reasons="lazy")
+    failing_venues, venues_passing_food, venues_passing_drink = results
+
+    compact = "".join(
+        output.iter_pick_json(
+            venues_passing_food, venues_passing_drink, failing_venues, "compact"
+        )
+    )
+    lines = list(
+        output.iter_pick_json(
+            venues_passing_food, venues_passing_drink, failing_venues, "ndjson"
+        )
+    )
+
+    assert json.loads(compact) == expected
+    assert compact == output.encode(expected) + "\n"
+    entries = [json.loads(line) for line in lines]
+    assert [entry["places_to_visit"] for entry in entries if "places_to_visit" in entry] == (
+        expected["places_to_visit"]
+    )
+    assert [entry["places_to_avoid"] for entry in entries if "places_to_avoid" in entry] == (
+        expected["places_to_avoid"]
+    )
+
+
+def test_fallback_encoding_keeps_non_ascii_text_and_output_files_are_closed(monkeypatch, tmp_path):
+    monkeypatch.setattr(output, "orjson", None)
+    response = {"places_to_visit": ["Café Zoë"]}
+    output_path = str(tmp_path / "results.json")
+
+    with output.open_output(output_path) as output_file:
+        output.write_pieces(output.iter_response_json(response, "compact"), output_file)
+
+    assert output_file.closed
+    with open(output_path, encoding="utf-8") as results:
+        assert results.read() == '{"places_to_visit":["Café Zoë"]}\n'
+    assert output.encode_bytes(response) == '{"places_to_visit":["Café Zoë"]}'.encode("utf-8")
+
+
+def test_venue_explainer_fixes_pass_and_drop_fewest_users():
+    names = ["Danielle Ren", "Karol Drewno", "Wen Li", "Gavin Coulson"]
+    explanations = VenueExplainer(BitmaskEngine(TEAM_USERS, TEAM_VENUES)).explain(names)
+    expected = pick_venues(names, TEAM_USERS, TEAM_VENUES)
+    assert [entry["name"] for entry in explanations] == [
+        failure["name"] for failure in expected["places_to_avoid"]
+    ]
+
+    for entry in explanations:
+        venue = next(venue for venue in TEAM_VENUES if venue["name"] == entry["name"])
+        passing_groups = [
+            group
+            for size in range(1, len(names) + 1)
+            for group in itertools.combinations(names, size)
+            if venue["name"] in pick_venues(list(group), TEAM_USERS, [venue])["places_to_visit"]
+        ]
+        if entry["drop_users"] is None:
+            assert not passing_groups
+        else:
+            kept = [name for name in names if name not in entry["drop_users"]]
+            assert kept in [list(group) for group in passing_groups]
+            assert len(kept) == max(len(group) for group in passing_groups)
+        for key, addition in (("food", "add_food"), ("drinks", "add_drink")):
+            for term in entry[addition]:
+                changed = dict(venue, **{key: venue[key] + [term]})
+                response = pick_venues(names, TEAM_USERS, [changed])
+                assert response["places_to_visit"] == [venue["name"]]
+
+
+@pytest.mark.parametrize("names", REPEATED_NAME_GROUPS)
+def test_venue_explainer_lists_places_to_avoid_for_repeated_names(names):
+    venues = REPEATED_NAME_VENUES + [{"name": "V3", "food": ["f0"], "drinks": ["d1"]}]
+    explanations = VenueExplainer(BitmaskEngine(REPEATED_NAME_USERS, venues)).explain(names)
+
+    assert [entry["name"] for entry in explanations] == [
+        failure["name"] for failure in pick_venues(names, REPEATED_NAME_USERS, venues)["places_to_avoid"]
+    ]
+
+
+def test_load_team_data_matches_reference_pick(tmp_path):
+    users_path, venues_path = tmp_path / "users.json", tmp_path / "venues.json"
+    users_path.write_text(json.dumps(TEAM_USERS))
+    venues_path.write_text("\n".join(json.dumps(venue) for venue in TEAM_VENUES))
+
+    team_data = load_team_data(str(users_path), str(venues_path), len(TEAM_USERS), len(TEAM_VENUES))
+
+    assert team_data.errors == []
+    assert team_data.all_users == TEAM_USERS and team_data.all_venues == TEAM_VENUES
+    names = ["Danielle Ren", "Karol Drewno", "Wen Li"]
+    filtered_users = filter_users_by_name(names, TEAM_USERS)
+    assert team_data.user_terms_dict(team_data.food_banners, names) == create_banned_foods_dict(
+        "wont_eat", names, TEAM_USERS, filtered_users
+    )
+    assert normalise_response(team_data.pick(names)) == normalise_response(
+        pick_venues(names, TEAM_USERS, TEAM_VENUES)
+    )
+
+
+@pytest.mark.parametrize("names", REPEATED_NAME_GROUPS)
+def test_load_team_data_matches_reference_for_repeated_names(names, tmp_path):
+    users_path, venues_path = tmp_path / "users.json", tmp_path / "venues.json"
+    users_path.write_text(json.dumps(REPEATED_NAME_USERS))
+    venues_path.write_text(json.dumps(REPEATED_NAME_VENUES))
+
+    team_data = load_team_data(str(users_path), str(venues_path))
+
+    filtered_users = filter_users_by_name(names, REPEATED_NAME_USERS)
+    assert team_data.filter_users(names) == filtered_users
+    assert team_data.user_terms_dict(
+        team_data.food_banners, names, team_data.shadowed_foods
+    ) == create_banned_foods_dict("wont_eat", names, REPEATED_NAME_USERS, filtered_users)
+    assert normalise_response(team_data.pick(names)) == normalise_response(
+        pick_venues(names, REPEATED_NAME_USERS, REPEATED_NAME_VENUES)
+    )
+
+
+def test_load_team_data_collects_every_validation_error(tmp_path):
+    users_path, venues_path = tmp_path / "users.json", tmp_path / "venues.json"
+    users_path.write_text(
+        json.dumps(
+            [
+                {"name": "Sarah", "wont_eat": ["FISH", ""], "drinks": ["Tea"]},
+                {"name": "", "wont_eat": "fish", "drinks": [1]},
+                ["not", "a", "user"],
+            ]
+        )
+    )
+    venues_path.write_text(
+        json.dumps([{"name": "Pie Shop", "food": ["pies"], "drinks": [], "latitude": 95}])
+    )
+
+    team_data = load_team_data(str(users_path), str(venues_path), 2, None)
+
+    assert team_data.all_users == [{"name": "Sarah", "wont_eat": ["fish"], "drinks": ["tea"]}]
+    assert team_data.all_venues == []
+    assert [error.split(" ", 1)[1] for error in team_data.errors] == [
+        "record 2 has name '', expected a non-empty string",
+        "record 2 has wont_eat 'fish', expected a list of strings",
+        "record 2 has 1 in drinks, expected a string",
+        "record 3 is ['not', 'a', 'user'], expected an object",
+        "has 3 records, expected 2",
+        "record 1: Record Pie Shop has latitude 95, out of range",
+    ]
+
+
+def test_data_watcher_reloads_only_changed_file_and_swaps_engine(tmp_path):
+    users_path, venues_path = tmp_path / "users.json", tmp_path / "venues.json"
+    users_path.write_text(json.dumps(TEAM_USERS))
+    venues_path.write_text(json.dumps(TEAM_VENUES[:4]))
+    cache = PickCache(data_version="start")
+    server = PickServer(TEAM_USERS, TEAM_VENUES[:4], cache)
+    watcher = DataWatcher(str(users_path), str(venues_path), server.swap)
+    watcher.prime(TEAM_USERS, TEAM_VENUES[:4])
+    assert watcher.data_version() == hash_data_files([str(users_path), str(venues_path)])
+    names = ["Danielle Ren", "Wen Li"]
+    cache.get_or_pick(names, server.engine.pick)
+
+    assert watcher.poll() is False
+    venues_path.write_text(json.dumps(TEAM_VENUES))
+    assert watcher.poll() is True
+    assert watcher.records["users"] is TEAM_USERS
+    assert normalise_response(server.pick(json.dumps(names).encode())[1]) == normalise_response(
+        pick_venues(names, TEAM_USERS, TEAM_VENUES)
+    )
+    assert cache.stats()["invalidations"] == 1
+
+    engine = server.engine
+    venues_path.write_text(json.dumps(TEAM_VENUES) + " ")
+    venues_path.write_text(json.dumps(TEAM_VENUES))
+    assert watcher.poll() is False
+    venues_path.write_text(json.dumps([{"name": "Pie Shop", "food": [1], "drinks": []}]))
+    assert watcher.poll() is False
+    assert watcher.errors and server.engine is engine
+
+
+def test_compact_records_work_with_existing_functions():
+    users, venues = compact_records(TEAM_USERS, TEAM_VENUES)
+    names = ["Danielle Ren", "Karol Drewno", "Wen Li"]
+    expected = normalise_response(pick_venues(names, TEAM_USERS, TEAM_VENUES))
+
+    assert users == TEAM_USERS and venues == TEAM_VENUES
+    assert venues[0]["food"] == TEAM_VENUES[0]["food"] and "latitude" not in venues[0]
+    assert users[0].wont_eat_ids.itemsize == 4
+    assert venues[0]["drinks"][0] is users[0].term_table.terms[venues[0].drink_ids[0]]
+    assert normalise_response(pick_venues(names, users, venues)) == expected
+    assert normalise_response(BitmaskEngine(users, venues).pick(names)) == expected
+
+    memory = measure_record_memory(user_count=50, venue_count=2000)
+    assert memory["record_bytes"] < memory["dict_bytes"]
+
+
+def test_fuzz_engines_match_reference_and_mismatches_shrink(monkeypatch):
+    assert fuzz.fuzz(100, seed=0, workers=1) == []
+
+    # Skipping venues with no food loses them from places_to_avoid when they fail on drink
+    monkeypatch.setitem(
+        fuzz.ENGINES,
+        "skips_foodless",
+        lambda names, users, venues: pick_venues(names, users, [v for v in venues if v["food"]]),
+    )
+    failures = fuzz.fuzz(50, seed=0, engine_names=["skips_foodless"], workers=1)
+
+    assert failures
+    case = failures[0]["case"]
+    assert len(case["venues"]) == 1 and case["venues"][0]["food"] == []
+    assert len(case["names"]) == 1 and case["venues"][0]["drinks"] == []
+    assert fuzz.check_seed((failures[0]["seed"], ["skips_foodless"]))[0]["case"] == case
+
+
+def test_availability_index_matches_brute_force_search():
+    rng = random.Random(0)
+    venues = [
+        {"name": f"Venue {number}", "food": [], "drinks": []}
+        for number in range(300)
+    ]
+    for venue in venues[:250]:
+        # Opening on the half hour and closing on the hour, so never opening and closing at once
+        venue["opening_hours"] = [
+            [f"{rng.randrange(24):02d}:30", f"{rng.randrange(1, 25):02d}:00"]
+            for _ in range(rng.randint(0, 2))
+        ]
+    for venue in venues[50:]:
+        venue["capacity"] = rng.randint(1, 40)
+    venues = [check_availability(venue) for venue in venues]
+    availability_index = AvailabilityIndex(venues)
+
+    for time in ("00:00", "12:30", "23:59", "24:00"):
+        minutes = parse_time(time)
+        for party_size in (None, 1, 14, 41):
+            expected = [
+                position
+                for position, venue in enumerate(venues)
+                if (
+                    opening_intervals(venue) is None
+                    or any(
+                        opening <= minutes % (24 * 60) < closing
+                        for opening, closing in opening_intervals(venue)
+                    )
+                )
+                and venue.get("capacity", party_size or 0) >= (party_size or 0)
+            ]
+            assert availability_index.available(minutes, party_size) == expected
+
+
+def test_filter_venues_by_availability_prunes_before_picking():
+    venues = [dict(venue) for venue in TEAM_VENUES]
+    venues[0].update(opening_hours=[["18:00", "02:00"]], capacity=40)
+    venues[1].update(opening_hours=[["11:00", "15:00"]], capacity=10)
+    names = ["Danielle Ren", "Karol Drewno"]
+
+    assert filter_venues_by_availability(venues) is venues
+    assert filter_venues_by_availability(venues, parse_time("01:00"), 14) == [venues[0]] + venues[2:]
+    candidates = filter_venues_by_availability(venues, parse_time("12:30"), 14)
+    assert candidates == venues[2:]
+    assert normalise_response(pick_venues(names, TEAM_USERS, candidates)) == normalise_response(
+        pick_venues(names, TEAM_USERS, TEAM_VENUES[2:])
+    )
+
+
+@pytest.mark.parametrize(
+    "record",
+    [
+        {"name": "A", "opening_hours": ["12:00", "14:00"]},
+        {"name": "A", "opening_hours": [["12:00", "25:00"]]},
+        {"name": "A", "opening_hours": [["9am", "5pm"]]},
+        {"name": "A", "opening_hours": [["00:00", "00:00"]]},
+        {"name": "A", "capacity": 0},
+        {"name": "A", "capacity": "20"},
+    ],
+)
+def test_check_availability_rejects_malformed_hours_or_capacity(record):
+    with pytest.raises(AssertionError):
+        check_availability(record)
+
+
+def test_snapshot_round_trip_keeps_opening_hours_and_capacity(tmp_path):
+    venues = [dict(venue) for venue in TEAM_VENUES]
+    venues[0].update(opening_hours=[["18:00", "02:00"], ["11:30", "14:00"]], capacity=40)
+    venues[1].update(opening_hours=[])
+    venues[2].update(capacity=8)
+    snapshot_path = str(tmp_path / "snapshot.bin")
+
+    write_snapshot(snapshot_path, TEAM_USERS, venues)
+
+    assert load_snapshot(snapshot_path)[1] == venues
+    availability_index = load_availability_index(snapshot_path)
+    for minutes, party_size in itertools.product([None, 0, 60, 720, 1140], [None, 8, 9, 41]):
+        assert availability_index.available(minutes, party_size) == AvailabilityIndex(
+            venues
+        ).available(minutes, party_size)
@@ -0,0 +1,142 @@
+import hashlib
+import sys
+import threading
+from typing import Dict, List, Any, Callable
+
+from engine import BitmaskEngine
+from cache import stat_files
+from index import hash_file
+from pipeline import TeamData, USER_KEYS, VENUE_KEYS
+from instrument import PROFILER
+
+
+class DataWatcher:
+    """Polls the users and venues files, and when either changes, reloads only that file and
+    builds a new BitmaskEngine from it and the other file's current data, on a background
+    thread so that picks are never kept waiting.
+
+    Files are checked by modification time and size, then by content hash, so that touching a
+    file without changing it does nothing. A new engine is handed to on_reload only once fully
+    built, so anything reading the current engine sees either the old data or the new, never a
+    mixture. Files which fail validation are left unloaded, keeping the previous data, and the
+    problems are kept in errors.
+    """
+
+    def __init__(
+        self,
+        users_path: str,
+        venues_path: str,
+        on_reload: Callable[[BitmaskEngine, str], None],
+        interval: float = 1.0,
+    ):
+        self.paths = {"users": users_path, "venues": venues_path}
+        self.on_reload = on_reload
+        self.interval = interval
+        self.records = {}
+        self.fingerprints = {}
+        self.hashes = {}
+        self.errors = []
+        self.reloads = 0
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def prime(self, all_users: List[Dict[str, Any]], all_venues: List[Dict[str, Any]]):
+        """Records data already loaded from the files, so that only later changes to them are
+        reloaded.
+
+        Args:
+            all_users (List[Dict[str, Any]]): List of dictionaries for all users.
+            all_venues (List[Dict[str, Any]]): List of dictionaries for all venues.
+        """
+        self.records = {"users": all_users, "venues": all_venues}
+        for kind, file_path in self.paths.items():
+            self.fingerprints[kind] = stat_files([file_path])
+            self.hashes[kind] = hash_file(file_path)
+
+    def data_version(self) -> str:
+        """Computes a version hash over the contents of both files as last loaded, matching
+        PickCache's data_version for the same files.
+
+        Returns:
+            str: Hex digest of the file hashes.
+        """
+        digest = hashlib.sha256()
+        for kind in ("users", "venues"):
+            digest.update(self.hashes[kind].encode("utf-8"))
+        return digest.hexdigest()
+
+    def load(self, kind: str) -> bool:
+        """Loads one of the files, keeping the data previously loaded from it if it has
+        problems.
+
+        Args:
+            kind (str): 'users' or 'venues'.
+
+        Returns:
+            bool: Whether the file loaded without problems.
+        """
+        team_data = TeamData()
+        if kind == "users":
+            team_data.load_file(self.paths[kind], USER_KEYS, None, team_data.add_user)
+            records = team_data.all_users
+        else:
+            team_data.load_file(self.paths[kind], VENUE_KEYS, None, team_data.add_venue)
+            records = team_data.all_venues
+        self.errors.extend(team_data.errors)
+        if team_data.errors:
+            return False
+        self.records[kind] = records
+        return True
+
+    @PROFILER.timed()
+    def poll(self) -> bool:
+        """Checks both files once, reloading whichever changed and handing on a new engine.
+
+        Returns:
+            bool: Whether a new engine was built.
+        """
+        self.errors = []
+        changed = []
+        for kind, file_path in self.paths.items():
+            fingerprint = stat_files([file_path])
+            if fingerprint == self.fingerprints.get(kind):
+                continue
+            self.fingerprints[kind] = fingerprint
+            try:
+                file_hash = hash_file(file_path)
+            # A file being replaced may be briefly missing - check it again next time
+            except OSError:
+                self.fingerprints.pop(kind)
+                continue
+            if file_hash != self.hashes.get(kind) and self.load(kind):
+                self.hashes[kind] = file_hash
+                changed.append(kind)
+        if not changed or len(self.records) < 2:
+            return False
+
+        engine = BitmaskEngine(self.records["users"], self.records["venues"])
+        self.reloads += 1
+        PROFILER.count("data_reloads")
+        self.on_reload(engine, self.data_version())
+        return True
+
+    def run(self):
+        """Polls the files every interval until stopped, reporting files with problems on
+        stderr."""
+        while not self.stopping.wait(self.interval):
+            self.poll()
+            if self.errors:
+                print("\n".join(self.errors), file=sys.stderr)
+
+    def start(self):
+        """Starts polling on a background daemon thread."""
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name="data-watcher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops polling, waiting for any reload in progress to finish."""
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None